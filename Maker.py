@@ -1,252 +1,293 @@
 # NULL is replaced with None for cross-platform compatibility
+import logging
 import random
-from classes import Map, Tile, Adjacent
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from classes import Map, RESOURCE_CODES, layoutFromSpec
+from solver import namedConstraints, prepareConstraints, solvePrepared, deadlineAfter
+import numpy as np
+from bulk import bulkTables, sampleBoards, packedBoards
+from metrics import STAGE_SECONDS, SWAPS, RESHUFFLES
 
-def randomizeBoard(map):
-    numbers = map.numbers[:]
-    coordinates = map.coordinates[:]
-    random.shuffle(numbers)
-    random.shuffle(coordinates)
+logger = logging.getLogger(__name__)
 
-    for i in range(len(map.resources)-1):
-        map.tiles[i] = Tile(numbers[i], map.resources[i], None, coordinates[i])
+@STAGE_SECONDS.time(stage="randomize")
+def randomizeBoard(map, rng=random):
+    """Deal a fresh random board; pass a seeded random.Random as `rng` to make it reproducible"""
+    resources = list(map.resources)
+    numbers = list(map.numbers)
+    rng.shuffle(resources)
+    rng.shuffle(numbers)
 
-    map.tiles[len(map.resources)-1] = Tile(0, map.resources[len(map.resources)-1], None, coordinates[len(map.resources)-1])
+    dealTiles(map, resources, numbers)
 
     return fillAdjacentNumbers(map)
 
+# Boards drawn from each seeded RNG stream in a batch. Chunk k always uses the stream for
+# (seed, k), so a batch is the same for a given seed no matter how many workers run it.
+BATCH_CHUNK_SIZE = 256
+
+def chunkRandom(seed, chunk):
+    return random.Random(f"{seed}/{chunk}")
+
+def generateChunk(constraints, seed, chunk, size, engine="solver", budget_ms=None, layout_spec=None):
+    """Worker entry point: one chunk of boards, each packed as slot numbers then resource codes
+
+    engine="numpy" rejection-samples the whole chunk with the vectorized bulk engine,
+    which is much faster for number constraints but hopeless for noResources. With the
+    solver engine `budget_ms` caps the time spent on each board; a board that runs out
+    is the solver's best effort (see solvePrepared). The numpy engine ignores it.
+    Boards use the layout of `layout_spec` (see layoutFromSpec), which pickles cheaply.
+    """
+    rng = chunkRandom(seed, chunk)
+    layout = layoutFromSpec(layout_spec)
+    if engine == "numpy":
+        resources, numbers = sampleBoards(size, *namedConstraints(constraints), rng=np.random.default_rng(rng.getrandbits(64)), tables=bulkTables(layout))
+        return packedBoards(resources, numbers)
+    map = Map(layout)
+    prepared = prepareConstraints(map, *namedConstraints(constraints))
+    boards = []
+    for _ in range(size):
+        solvePrepared(map, prepared, rng, deadline=deadlineAfter(budget_ms))
+        boards.append(map.pack())
+    return boards
+
+def generateBoards(count, constraints=(), seed=None, workers=1, executor=None, engine="solver", budget_ms=None, layout_spec=None):
+    """Yield `count` boards satisfying the named constraints, reproducible from `seed`
+
+    With workers > 1 the chunks are spread over a process pool (`executor`, or a
+    temporary one), keeping at most two chunks per worker in flight. Each yielded
+    board is the same Map refilled in place; serialize it before taking the next one.
+    `budget_ms` is a per-board time cap for the solver engine, and `layout_spec` picks
+    the layout, as in generateChunk.
+    """
+    if seed is None:
+        seed = random.getrandbits(64)
+    chunks = [(chunk, min(BATCH_CHUNK_SIZE, count - start)) for chunk, start in enumerate(range(0, count, BATCH_CHUNK_SIZE))]
+    map = Map(layoutFromSpec(layout_spec))
+
+    if workers <= 1:
+        results = (generateChunk(constraints, seed, chunk, chunk_size, engine, budget_ms, layout_spec) for chunk, chunk_size in chunks)
+    else:
+        results = _poolResults(executor, workers, constraints, seed, chunks, engine, budget_ms, layout_spec)
+
+    for boards in results:
+        for packed in boards:
+            yield map.unpack(packed)
+
+def _poolResults(executor, workers, constraints, seed, chunks, engine, budget_ms, layout_spec):
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        remaining = iter(chunks)
+        pending = deque()
+        for chunk, chunk_size in remaining:
+            pending.append(executor.submit(generateChunk, constraints, seed, chunk, chunk_size, engine, budget_ms, layout_spec))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            boards = pending.popleft().result()
+            for chunk, chunk_size in remaining:
+                pending.append(executor.submit(generateChunk, constraints, seed, chunk, chunk_size, engine, budget_ms, layout_spec))
+                break
+            yield boards
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+def dealTiles(map, resources, numbers):
+    """Lay resources out slot by slot and hand numbers to every non-desert slot"""
+    next_number = iter(numbers)
+    slot_numbers = map.slot_numbers
+    slot_resources = map.slot_resources
+    for slot, resource in enumerate(resources):
+        slot_resources[slot] = RESOURCE_CODES[resource]
+        slot_numbers[slot] = 0 if resource == "Desert" else next(next_number)
+    map.resetConflicts()
+    return map
+
 def fillAdjacentNumbers(map):
-    map.coord_to_tile = {tile.coordinates: tile for tile in map.tiles if tile}
-
-    for i in range(len(map.resources)):
-        q, r, s = map.tiles[i].coordinates[0], map.tiles[i].coordinates[1], map.tiles[i].coordinates[2]
-        TL = map.coord_to_tile.get((q, r - 1 , s + 1))
-        TR = map.coord_to_tile.get((q + 1, r - 1, s))
-        R = map.coord_to_tile.get((q - 1, r, s + 1))
-        BR = map.coord_to_tile.get((q , r + 1, s - 1))
-        BL = map.coord_to_tile.get((q - 1, r + 1, s))
-        L = map.coord_to_tile.get((q + 1, r, s - 1))
-        map.tiles[i].adjacent = Adjacent(TL, TR, R, BR, BL, L)
+    # Neighbors come from the shared layout table, so there is nothing per-map to rebuild
     return map
 
+@STAGE_SECONDS.time(stage="repair")
 def noNumberPairs(map, pairs):
     sort(map)
+    conflicts = map.conflicts()
     for tile in map.tiles:
-        if tile is not None and tile.number in pairs:
-            adjacent_pairs = []
-            for adj in tile.adjacent.to_list_no_none():
-                if adj is not None and adj.number in pairs:
-                    adjacent_pairs.append(adj)
-            
-            if adjacent_pairs:
-                swap_candidate = findSwapCandidate(tile, map, pairs, 1)
-                if swap_candidate is None:
-                    swap_candidate = findSwapCandidate(tile, map, pairs, 2)
-                if swap_candidate is None:
-                    swap_candidate = findSwapCandidate(tile, map, pairs, 0)
-                if swap_candidate is not None:
-                    temp_number = tile.number
-                    tile.number = swap_candidate.number
-                    swap_candidate.number = temp_number
-                    map = fillAdjacentNumbers(map)
-                    break
+        if tile is not None and conflicts.pairConflictsAt(tile.slot, tile.number, pairs) > 0:
+            swap_candidate = findSwapCandidate(tile, map, pairs, 1)
+            if swap_candidate is None:
+                swap_candidate = findSwapCandidate(tile, map, pairs, 2)
+            if swap_candidate is None:
+                swap_candidate = findSwapCandidate(tile, map, pairs, 0)
+            if swap_candidate is not None:
+                conflicts.swapNumbers(tile.slot, swap_candidate.slot)
+                SWAPS.inc(kind="number")
+                break
     return map
 
 def findSwapCandidate(original_tile, map, pairs, search_depth):
     if search_depth == 0:
-        candidates = [tile for tile in map.tiles if tile is not None]
+        # Lazily, so the first usable tile ends the scan instead of listing the whole board
+        candidates = (tile for tile in map.tiles if tile is not None)
     elif search_depth == 1:
-        candidates = original_tile.adjacent.to_list_no_none()
+        candidates = map.adjacentTiles(original_tile)
     elif search_depth == 2:
         candidates = []
-        for adj in original_tile.adjacent.to_list_no_none():
+        for adj in map.adjacentTiles(original_tile):
             if adj is not None:
-                candidates.extend(adj.adjacent.to_list_no_none())
-        candidates = list(set([c for c in candidates if c is not None]))
+                candidates.extend(map.adjacentTiles(adj))
+        # dict.fromkeys keeps first-seen order so seeded runs repeat exactly
+        candidates = list(dict.fromkeys([c for c in candidates if c is not None]))
     
+    conflicts = map.conflicts()
     for candidate in candidates:
         if (candidate is not None and 
             candidate.number not in pairs and
             candidate.number != 0):
-            is_safe = True
-            for other_tile in map.tiles:
-                if (other_tile is not None and 
-                    other_tile.number in pairs and 
-                    other_tile != original_tile):
-                    for adj in other_tile.adjacent.to_list_no_none():
-                        if adj == candidate:
-                            is_safe = False
-                            break
-                    if not is_safe:
-                        break
-            
-            if is_safe:
+            # Safe when no pair number other than the original tile touches the candidate
+            if conflicts.pairConflictsAt(candidate.slot, original_tile.number, pairs, original_tile.slot) == 0:
                 return candidate
     return None
 
 def checkForPairs(map, pairs):
     """Check if any adjacent tiles have numbers in the pairs list"""
-    for tile in map.tiles:
-        if tile is not None and tile.number in pairs:
-            for adj in tile.adjacent.to_list_no_none():
-                if adj is not None and adj.number in pairs:
-                    return True  # Found a pair
-    return False  # No pairs found
-
-def rerandomizeNumbersUntilNoPairs(map, pairs, max_attempts=100):
-    """Keep randomizing until no pairs are found or max attempts reached"""
+    return map.conflicts().pairConflicts(pairs) > 0
+
+@STAGE_SECONDS.time(stage="reshuffle")
+def rerandomizeNumbersUntilNoPairs(map, pairs, max_attempts=100, rng=random, budget_ms=None):
+    """Keep randomizing until no pairs are found, max attempts are reached or `budget_ms` runs out
+
+    If it gives up, the map is left holding the attempt with the fewest pairs.
+    """
     attempts = 0
+    deadline = deadlineAfter(budget_ms)
+    best = _BestBoard(map, lambda: map.conflicts().pairConflicts(pairs))
     
-    while checkForPairs(map, pairs) and attempts < max_attempts:
-        # Rerandomize the board
-        numbers = map.numbers[:]
-        coordinates = map.coordinates[:]
-        random.shuffle(numbers)
-        random.shuffle(coordinates)
-        
-        # Create new tiles with shuffled numbers and coordinates
-        for i in range(len(map.resources)-1):
-            map.tiles[i] = Tile(numbers[i], map.resources[i], None, coordinates[i])
+    # Only the numbers move, so resources (and the desert) stay where earlier fixes put them
+    slots = [slot for slot, number in enumerate(map.slot_numbers) if number]
+    while checkForPairs(map, pairs) and attempts < max_attempts and not _expired(deadline):
+        _shuffleSlots(map.slot_numbers, slots, rng)
+        map.resetConflicts()
+        best.consider()
         
-        map.tiles[len(map.resources)-1] = Tile(0, map.resources[len(map.resources)-1], None, coordinates[len(map.resources)-1])
-        
-        # Update adjacent relationships
-        map = fillAdjacentNumbers(map)
         attempts += 1
     
-    if attempts >= max_attempts:
-        print(f"Warning: Could not eliminate pairs after {max_attempts} attempts")
+    RESHUFFLES.inc(attempts, kind="number")
+    if checkForPairs(map, pairs):
+        best.restore()
+        logger.warning("Could not eliminate pairs after %d attempts", attempts)
     else:
-        print(f"Successfully eliminated pairs after {attempts} attempts")
+        logger.debug("Eliminated pairs after %d attempts", attempts)
     
     return map
 
+def _shuffleSlots(values, slots, rng):
+    shuffled = [values[slot] for slot in slots]
+    rng.shuffle(shuffled)
+    for slot, value in zip(slots, shuffled):
+        values[slot] = value
+
+def _expired(deadline):
+    return deadline is not None and time.perf_counter() >= deadline
+
+class _BestBoard:
+    """Packed copy of the attempt with the fewest violations seen so far"""
+    def __init__(self, map, violations):
+        self.map = map
+        self.violations = violations
+        self.packed = map.pack()
+        self.best = violations()
+
+    def consider(self):
+        current = self.violations()
+        if current < self.best:
+            self.packed, self.best = self.map.pack(), current
+
+    def restore(self):
+        self.map.unpack(self.packed)
+        return self.map
+
 def sort(map):
-    # Create a mapping from coordinates to their original index
-    coord_to_index = {coord: i for i, coord in enumerate(map.coordinates)}
-    
-    # Filter out None tiles and sort by their original coordinate order
-    valid_tiles = []
-    for tile in map.tiles:
-        if tile is not None:
-            original_index = coord_to_index[tile.coordinates]
-            valid_tiles.append((tile, original_index))
-    
-    # Sort by original index
-    valid_tiles.sort(key=lambda x: x[1])
-    
-    # Create new tiles array with same length as original
-    new_tiles = [None] * len(map.tiles)
-    
-    # Place tiles back in their original positions
-    for i, (tile, _) in enumerate(valid_tiles):
-        new_tiles[i] = tile
-    
-    map.tiles = new_tiles
-    
-    # Update the coord_to_tile mapping
-    map.coord_to_tile = {tile.coordinates: tile for tile in map.tiles if tile}
-    
+    # Tiles are views over the slot arrays, so they are always in layout order
     return map
-print("Done!")
 
+@STAGE_SECONDS.time(stage="repair")
 def noAdjacentSameResources(map):
     """Eliminate adjacent tiles with the same resource using depth-based swapping"""
     sort(map)
+    conflicts = map.conflicts()
     for tile in map.tiles:
-        if tile is not None:
-            adjacent_same_resources = []
-            for adj in tile.adjacent.to_list_no_none():
-                if adj is not None and adj.resource == tile.resource:
-                    adjacent_same_resources.append(adj)
-            
-            if adjacent_same_resources:
-                swap_candidate = findResourceSwapCandidate(tile, map, 1)
-                if swap_candidate is None:
-                    swap_candidate = findResourceSwapCandidate(tile, map, 2)
-                if swap_candidate is None:
-                    swap_candidate = findResourceSwapCandidate(tile, map, 0)
-                if swap_candidate is not None:
-                    temp_resource = tile.resource
-                    tile.resource = swap_candidate.resource
-                    swap_candidate.resource = temp_resource
-                    map = fillAdjacentNumbers(map)
-                    break
+        if tile is not None and conflicts.resourceConflictsAt(tile.slot, map.slot_resources[tile.slot]) > 0:
+            swap_candidate = findResourceSwapCandidate(tile, map, 1)
+            if swap_candidate is None:
+                swap_candidate = findResourceSwapCandidate(tile, map, 2)
+            if swap_candidate is None:
+                swap_candidate = findResourceSwapCandidate(tile, map, 0)
+            if swap_candidate is not None:
+                conflicts.swapResources(tile.slot, swap_candidate.slot)
+                SWAPS.inc(kind="resource")
+                break
     return map
 
 def findResourceSwapCandidate(original_tile, map, search_depth):
     """Find a tile to swap resources with using depth-based search"""
     if search_depth == 0:
-        candidates = [tile for tile in map.tiles if tile is not None]
+        # Lazily, so the first usable tile ends the scan instead of listing the whole board
+        candidates = (tile for tile in map.tiles if tile is not None)
     elif search_depth == 1:
-        candidates = original_tile.adjacent.to_list_no_none()
+        candidates = map.adjacentTiles(original_tile)
     elif search_depth == 2:
         candidates = []
-        for adj in original_tile.adjacent.to_list_no_none():
+        for adj in map.adjacentTiles(original_tile):
             if adj is not None:
-                candidates.extend(adj.adjacent.to_list_no_none())
-        candidates = list(set([c for c in candidates if c is not None]))
+                candidates.extend(map.adjacentTiles(adj))
+        # dict.fromkeys keeps first-seen order so seeded runs repeat exactly
+        candidates = list(dict.fromkeys([c for c in candidates if c is not None]))
     
+    conflicts = map.conflicts()
+    original_code = map.slot_resources[original_tile.slot]
     for candidate in candidates:
         if (candidate is not None and 
             candidate.resource != original_tile.resource and
             candidate.resource != "Desert"):  # Don't swap with desert
-            is_safe = True
-            # Check if swapping would create new adjacent same resources
-            for other_tile in map.tiles:
-                if (other_tile is not None and 
-                    other_tile.resource == original_tile.resource and 
-                    other_tile != original_tile):
-                    for adj in other_tile.adjacent.to_list_no_none():
-                        if adj == candidate:
-                            is_safe = False
-                            break
-                    if not is_safe:
-                        break
-            
-            # Also check if the candidate's new resource would conflict with its neighbors
-            if is_safe:
-                for adj in candidate.adjacent.to_list_no_none():
-                    if adj is not None and adj.resource == original_tile.resource:
-                        is_safe = False
-                        break
-            
-            if is_safe:
+            # Check if swapping would create new adjacent same resources around either tile
+            if (conflicts.resourceConflictsAt(candidate.slot, original_code, original_tile.slot) == 0 and
+                conflicts.resourceConflictsAt(original_tile.slot, map.slot_resources[candidate.slot], candidate.slot) == 0):
                 return candidate
     return None
 
 def checkForAdjacentSameResources(map):
     """Check if any adjacent tiles have the same resource type"""
-    for tile in map.tiles:
-        if tile is not None:
-            for adj in tile.adjacent.to_list_no_none():
-                if adj is not None and adj.resource == tile.resource:
-                    return True  # Found adjacent same resources
-    return False  # No adjacent same resources found
-
-def rerandomizeResourcesUntilNoAdjacentSame(map, max_attempts=100):
-    """Keep randomizing resources until no adjacent same resources or max attempts reached"""
+    return map.conflicts().resourceConflicts() > 0
+
+@STAGE_SECONDS.time(stage="reshuffle")
+def rerandomizeResourcesUntilNoAdjacentSame(map, max_attempts=100, rng=random, budget_ms=None):
+    """Keep randomizing resources until no adjacent same resources, max attempts or `budget_ms` runs out
+
+    If it gives up, the map is left holding the attempt with the fewest adjacent matches.
+    """
     attempts = 0
+    deadline = deadlineAfter(budget_ms)
+    best = _BestBoard(map, lambda: map.conflicts().resourceConflicts())
     
-    while checkForAdjacentSameResources(map) and attempts < max_attempts:
-        # Rerandomize the resources
-        resources = map.resources[:]
-        random.shuffle(resources)
+    # The desert keeps its slot so it stays on number 0, and no number moves
+    slots = [slot for slot, number in enumerate(map.slot_numbers) if number]
+    while checkForAdjacentSameResources(map) and attempts < max_attempts and not _expired(deadline):
+        _shuffleSlots(map.slot_resources, slots, rng)
+        map.resetConflicts()
+        best.consider()
         
-        # Create new tiles with shuffled resources
-        for i in range(len(map.resources)):
-            if map.tiles[i] is not None:
-                map.tiles[i].resource = resources[i]
-        
-        # Update adjacent relationships
-        map = fillAdjacentNumbers(map)
         attempts += 1
     
-    if attempts >= max_attempts:
-        print(f"Warning: Could not eliminate adjacent same resources after {max_attempts} attempts")
+    RESHUFFLES.inc(attempts, kind="resource")
+    if checkForAdjacentSameResources(map):
+        best.restore()
+        logger.warning("Could not eliminate adjacent same resources after %d attempts", attempts)
     else:
-        print(f"Successfully eliminated adjacent same resources after {attempts} attempts")
+        logger.debug("Eliminated adjacent same resources after %d attempts", attempts)
     
     return map
-
-print("Done!")
\ No newline at end of file
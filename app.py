@@ -1,8 +1,24 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-from classes import Map
-from Maker import randomizeBoard, noNumberPairs, rerandomizeNumbersUntilNoPairs, checkForAdjacentSameResources, noAdjacentSameResources, rerandomizeResourcesUntilNoAdjacentSame
+from classes import Map, RESOURCE_CODES, RESOURCE_NAMES, STANDARD_LAYOUT, layoutFromSpec
+from Maker import randomizeBoard, generateBoards
+from solver import CONSTRAINT_NAMES, solveBoard, solveConstraints, rerollBoard, namedConstraints, constraintViolations, constraintLabel, InfeasibleBoardError, SearchBudgetError
+from cache import BoardCache
+from pool import BoardPool
+from boardspace import BoardSpace
+from scoring import DEFAULT_WEIGHTS, bestBalancedBoard, scoreMap
+from simulation import DEFAULT_TURNS, PERCENTILES, PRODUCING, boardArrays, expectedIncome, seatWeights, simulateIncome
+from serialize import RESOURCE_TO_TERRAIN, encode_object, map_dict_fragment, new_format_fields
+from render import render_png
+from archive import BoardArchive, MAX_SEARCH_LIMIT
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, BOARDS
 import json
+import math
+import os
+import random
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 app = Flask(__name__)
 CORS(app, origins=[
@@ -11,32 +27,87 @@ CORS(app, origins=[
     'https://catan-map-maker-frontend.vercel.app'  # Add your actual frontend domain
 ])
 
-# Resource to terrain mapping
-RESOURCE_TO_TERRAIN = {
-    "Wheat": "field",
-    "Brick": "hill", 
-    "Rock": "mountain",
-    "Sheep": "pasture",
-    "Wood": "forest",
-    "Desert": "desert"
-}
+# Largest number of boards a single /generate-batch request may ask for
+MAX_BATCH_COUNT = 100000
+
+# Process pool shared by /generate-batch requests that ask for more than one worker
+MAX_BATCH_WORKERS = os.cpu_count() or 1
+batch_executor = None
+
+def get_batch_executor():
+    global batch_executor
+    if batch_executor is None:
+        batch_executor = ProcessPoolExecutor(max_workers=MAX_BATCH_WORKERS)
+    return batch_executor
+
+# LRU of serialized responses for seeded requests; BOARD_CACHE_SIZE=0 turns it off
+board_cache = BoardCache(int(os.environ.get('BOARD_CACHE_SIZE', 1024)))
+
+# Ready-made boards for the common /generate-constrained constraint sets, as
+# ';'-separated lists of ','-separated names; BOARD_POOL_SIZE=0 turns it off
+BOARD_POOL_SIGNATURES = os.environ.get('BOARD_POOL_SIGNATURES', 'eightSix,twoTwelve;eightSix,twoTwelve,noResources,noTwoNumber')
+board_pool = BoardPool(
+    [signature.split(',') for signature in BOARD_POOL_SIGNATURES.split(';') if signature],
+    max_size=int(os.environ.get('BOARD_POOL_SIZE', 256)),
+    low_watermark=int(os.environ.get('BOARD_POOL_LOW_WATERMARK', 64))
+)
+
+# LRU of rendered PNGs for /render/<code>, keyed by layout and short code; IMAGE_CACHE_SIZE=0 turns it off
+image_cache = BoardCache(int(os.environ.get('IMAGE_CACHE_SIZE', 256)))
+
+# Fields of a board response that format=png sends as X-Board-* headers next to the image
+PNG_HEADER_FIELDS = ("code", "seed", "satisfied", "violations")
+
+# Longest board code sent as X-Board-Code; codes of large layouts would overflow the header
+# buffers of common proxies, so those boards are fetched with format=compact instead
+MAX_CODE_HEADER_CHARS = 1024
+
+# SQLite archive every served board is appended to, searched by /boards/search; off unless BOARD_ARCHIVE_PATH is set
+BOARD_ARCHIVE_PATH = os.environ.get('BOARD_ARCHIVE_PATH')
+board_archive = BoardArchive(BOARD_ARCHIVE_PATH) if BOARD_ARCHIVE_PATH else None
+
+# Valid-board index written by `python boardspace.py build`; unseeded /generate-constrained
+# requests it covers draw a uniformly random board from it. Without the file the solver is used.
+BOARD_INDEX_PATH = os.environ.get('BOARD_INDEX_PATH', 'board_index.bin')
+board_space = BoardSpace.load(BOARD_INDEX_PATH) if os.path.exists(BOARD_INDEX_PATH) else None
+
+# Time budget for /generate-balanced: the default, and the most a request may ask for
+BALANCED_BUDGET_MS = 50
+MAX_BALANCED_BUDGET_MS = 2000
+
+# /simulate limits: boards per request, seats per board, settlements and cities per seat (a
+# player's 5 settlements and 4 cities), rolls per game, and dice rolls per request summed over
+# its boards (the default is per board)
+MAX_SIMULATION_BOARDS = 100
+MAX_SIMULATION_SEATS = 8
+MAX_SIMULATION_SETTLEMENTS = 9
+MAX_SIMULATION_TURNS = 1000
+MAX_SIMULATION_ROLLS = 50000000
+SIMULATION_ROLLS = 1000000
+
+# Per-board time budget for the constrained endpoints; when it runs out the best board
+# found so far is returned with "satisfied": false. GENERATION_BUDGET_MS sets the default.
+GENERATION_BUDGET_MS = float(os.environ.get('GENERATION_BUDGET_MS', 250))
+MAX_GENERATION_BUDGET_MS = 5000
 
 def map_to_dict(map_obj):
     """Convert Map object to dictionary for JSON serialization"""
+    layout = map_obj.layout
     tiles_data = []
     for tile in map_obj.tiles:
         if tile is not None:
+            adjacent = layout.adjacent[tile.slot]
             tile_data = {
                 "number": tile.number,
                 "resource": tile.resource,
                 "coordinates": tile.coordinates,
                 "adjacent": {
-                    "TL": tile.adjacent.TL.coordinates if tile.adjacent.TL else None,
-                    "TR": tile.adjacent.TR.coordinates if tile.adjacent.TR else None,
-                    "R": tile.adjacent.R.coordinates if tile.adjacent.R else None,
-                    "BR": tile.adjacent.BR.coordinates if tile.adjacent.BR else None,
-                    "BL": tile.adjacent.BL.coordinates if tile.adjacent.BL else None,
-                    "L": tile.adjacent.L.coordinates if tile.adjacent.L else None
+                    "TL": layout.coordinates[adjacent.TL] if adjacent.TL is not None else None,
+                    "TR": layout.coordinates[adjacent.TR] if adjacent.TR is not None else None,
+                    "R": layout.coordinates[adjacent.R] if adjacent.R is not None else None,
+                    "BR": layout.coordinates[adjacent.BR] if adjacent.BR is not None else None,
+                    "BL": layout.coordinates[adjacent.BL] if adjacent.BL is not None else None,
+                    "L": layout.coordinates[adjacent.L] if adjacent.L is not None else None
                 }
             }
             tiles_data.append(tile_data)
@@ -50,56 +121,234 @@ def map_to_dict(map_obj):
         "numbers": map_obj.numbers
     }
 
+def new_format_tile(tile):
+    """One tile of map_to_new_format"""
+    q, r, s = tile.coordinates
+    return {
+        "q": q,
+        "r": r,
+        "s": s,
+        "terrain": RESOURCE_TO_TERRAIN.get(tile.resource, "desert"),
+        "number": tile.number if tile.number != 0 else None
+    }
+
 def map_to_new_format(map_obj):
     """Convert Map object to new format with q,r,s coordinates and terrain"""
     tiles_data = []
     for tile in map_obj.tiles:
         if tile is not None:
-            q, r, s = tile.coordinates
-            terrain = RESOURCE_TO_TERRAIN.get(tile.resource, "desert")
-            number = tile.number if tile.number != 0 else None
-            
-            tile_data = {
-                "q": q,
-                "r": r, 
-                "s": s,
-                "terrain": terrain,
-                "number": number
-            }
-            tiles_data.append(tile_data)
+            tiles_data.append(new_format_tile(tile))
     
     return {
         "tiles": tiles_data
     }
 
-def apply_constraints(map_obj, constraints):
+TERRAIN_TO_RESOURCE = {terrain: resource for resource, terrain in RESOURCE_TO_TERRAIN.items()}
+
+def hex_slot(value, layout):
+    """Slot of a hex given as {"q": .., "r": ..} or [q, r, s]; raises ValueError if it is not on the layout"""
+    if isinstance(value, dict):
+        value = [value.get('q'), value.get('r')]
+    if not isinstance(value, list) or len(value) not in (2, 3) or not all(isinstance(c, int) and not isinstance(c, bool) for c in value):
+        raise ValueError("Hexes must be given as {\"q\": .., \"r\": ..} or [q, r, s]")
+    q, r = value[0], value[1]
+    slot = layout.coord_to_slot.get((q, r, -q - r))
+    if slot is None or (len(value) == 3 and value[2] != -q - r):
+        raise ValueError(f"Hex {value} is not on the {layout.name} layout")
+    return slot
+
+def map_from_new_format(tiles, layout=STANDARD_LAYOUT):
+    """Map of a board in the map_to_new_format tile list; raises ValueError unless it is a full board of the layout"""
+    if not isinstance(tiles, list) or len(tiles) != len(layout):
+        raise ValueError(f"tiles must list all {len(layout)} tiles of the {layout.name} layout")
+    map_obj = Map(layout)
+    seen = set()
+    for tile in tiles:
+        if not isinstance(tile, dict):
+            raise ValueError("Each tile must be an object with q, r, terrain and number")
+        slot = hex_slot(tile, layout)
+        terrain, number = tile.get('terrain'), tile.get('number')
+        if slot in seen:
+            raise ValueError(f"Hex {[tile.get('q'), tile.get('r')]} is listed twice")
+        if not isinstance(terrain, str) or terrain not in TERRAIN_TO_RESOURCE:
+            raise ValueError(f"Tile terrain must be one of {', '.join(TERRAIN_TO_RESOURCE)}")
+        if number is not None and (not isinstance(number, int) or isinstance(number, bool)):
+            raise ValueError("Tile number must be an integer or null")
+        if (terrain == "desert") != (number is None):
+            raise ValueError("Desert tiles, and only they, must have a null number")
+        seen.add(slot)
+        map_obj.slot_resources[slot] = RESOURCE_CODES[TERRAIN_TO_RESOURCE[terrain]]
+        map_obj.slot_numbers[slot] = number if number is not None and 0 < number < 256 else 0
+    # The solver deals from the layout's tiles, so a board with any others cannot be rerolled
+    if (sorted(map_obj.slot_resources) != sorted(RESOURCE_CODES[resource] for resource in layout.resources)
+            or sorted(number for number in map_obj.slot_numbers if number) != sorted(layout.numbers)):
+        raise ValueError(f"tiles must hold exactly the resources and numbers of the {layout.name} layout")
+    map_obj.resetConflicts()
+    return map_obj
+
+def apply_constraints(map_obj, constraints, rng=random, budget_ms=None):
     """Apply constraints to the map"""
     if not constraints:
         return map_obj
     
-    # Handle eightSix constraint (no adjacent 6,8 pairs)
-    if "eightSix" in constraints:
-        map_obj = noNumberPairs(map_obj, [6, 8])
-        map_obj = rerandomizeNumbersUntilNoPairs(map_obj, [6, 8])
-    
-    # Handle twoTwelve constraint (no adjacent 2,12 pairs)  
-    if "twoTwelve" in constraints:
-        map_obj = noNumberPairs(map_obj, [2, 12])
-        map_obj = rerandomizeNumbersUntilNoPairs(map_obj, [2, 12])
-    
-    # Handle noResources constraint (no adjacent same resource tiles)
-    if "noResources" in constraints:
-        pass
-    
-    # Handle noTwoNumber constraint (no adjacent tiles with same number)
-    if "noTwoNumber" in constraints:
-        # This would require additional logic to check for adjacent same numbers
-        # For now, we'll implement a basic version
-        pass
-    
-    return map_obj
+    # eightSix (no adjacent 6,8), twoTwelve (no adjacent 2,12), noResources (no adjacent
+    # same resource) and noTwoNumber (no adjacent same number) are solved together
+    return solveConstraints(map_obj, constraints, rng, budget_ms=budget_ms)
 
-import os
+def request_seed(data=None):
+    """Seed from the query string or JSON body, as a string so GET and POST agree"""
+    seed = request.args.get('seed')
+    if seed is None and data:
+        seed = data.get('seed')
+    return None if seed is None else str(seed)
+
+def request_format(data=None):
+    """'compact' for a short board code instead of the full map, from ?format= or the JSON body"""
+    response_format = request.args.get('format')
+    if response_format is None and data:
+        response_format = data.get('format')
+    return response_format or 'full'
+
+def request_layout(data=None):
+    """Layout spec from ?layout= or the JSON body (see classes.layoutFromSpec); None is the standard board"""
+    spec = request.args.get('layout')
+    if spec is None and data:
+        spec = data.get('layout')
+    return spec
+
+def request_budget(data=None, default=GENERATION_BUDGET_MS):
+    """budget_ms from the query string or JSON body; raises ValueError if it is out of range"""
+    message = f"budget_ms must be a number between 0 and {MAX_GENERATION_BUDGET_MS}"
+    budget_ms = request.args.get('budget_ms')
+    if budget_ms is not None:
+        try:
+            budget_ms = float(budget_ms)
+        except ValueError:
+            raise ValueError(message)
+    else:
+        budget_ms = data.get('budget_ms', default) if data else default
+        if budget_ms is None:
+            return None
+    if not isinstance(budget_ms, (int, float)) or isinstance(budget_ms, bool) or not 0 < budget_ms <= MAX_GENERATION_BUDGET_MS:
+        raise ValueError(message)
+    return budget_ms
+
+def request_constraints(constraints):
+    """Sorted, distinct constraint names; raises ValueError for anything but a list of known names"""
+    if not isinstance(constraints, list) or not all(isinstance(name, str) for name in constraints):
+        raise ValueError("constraints must be a list of constraint names")
+    unknown = sorted(set(constraints) - set(CONSTRAINT_NAMES))
+    if unknown:
+        raise ValueError(f"Unknown constraints {', '.join(unknown)}; use {', '.join(CONSTRAINT_NAMES)}")
+    return sorted(set(constraints))
+
+def request_pairs(pairs):
+    """Sorted, distinct numbers of a pair group; raises ValueError for anything but a list of integers"""
+    if not isinstance(pairs, list) or not all(isinstance(number, int) and not isinstance(number, bool) for number in pairs):
+        raise ValueError("pairs must be a list of integers")
+    return sorted(set(pairs))
+
+def request_weights(weights):
+    """Balance weights as floats; raises ValueError for unknown metrics or values that are not finite numbers"""
+    if not isinstance(weights, dict) or not set(weights) <= set(DEFAULT_WEIGHTS):
+        raise ValueError(f"weights may only set {', '.join(DEFAULT_WEIGHTS)}")
+    if not all(isinstance(weight, (int, float)) and not isinstance(weight, bool) for weight in weights.values()):
+        raise ValueError("weights must be finite numbers")
+    try:
+        weights = {name: float(weight) for name, weight in weights.items()}
+    except OverflowError:
+        raise ValueError("weights must be finite numbers")
+    if not all(math.isfinite(weight) for weight in weights.values()):
+        raise ValueError("weights must be finite numbers")
+    return weights
+
+def satisfaction_fields(map_obj, pair_groups=(), no_same_number=False, no_same_resource=False):
+    """Whether a possibly best-effort board meets every constraint, and how many adjacent pairs break one"""
+    violations = constraintViolations(map_obj, pair_groups, no_same_number, no_same_resource)
+    BOARDS.inc(
+        constraints=constraintLabel(pair_groups, no_same_number, no_same_resource),
+        outcome="satisfied" if violations == 0 else "best_effort"
+    )
+    return {"satisfied": violations == 0, "violations": violations}
+
+def board_fields(map_obj, response_format, full_fields):
+    """Fields describing the board: its short code for format=compact, its code and image for
+    format=png, otherwise full_fields(map_obj)"""
+    # Every board a response carries passes through here, so this is where it gets archived
+    if board_archive is not None:
+        board_archive.record(map_obj)
+    if response_format == 'png':
+        with STAGE_SECONDS.time(stage="render"):
+            return {"code": map_obj.shortCode(), "png": map_png(map_obj)}
+    with STAGE_SECONDS.time(stage="serialize"):
+        if response_format == 'compact':
+            return {"code": map_obj.shortCode()}
+        return full_fields(map_obj)
+
+def map_png(map_obj):
+    return render_png(map_to_new_format(map_obj)["tiles"])
+
+def map_fields(map_obj):
+    return {"map": map_dict_fragment(map_obj)}
+
+def board_response(fields):
+    """Response for a dict whose values may be pre-encoded JSON bytes (see serialize.encode_object)"""
+    body, mimetype, headers = response_parts(fields)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def response_parts(fields):
+    """(body, mimetype, headers): the fields as JSON, or for format=png the image with X-Board-* headers"""
+    png = fields.pop("png", None)
+    if png is None:
+        return encode_fields(fields), 'application/json', {}
+    headers = {f"X-Board-{name.capitalize()}": json.dumps(fields[name]).strip('"') for name in PNG_HEADER_FIELDS if name in fields}
+    return png, 'image/png', code_header(headers)
+
+def code_header(headers):
+    """headers without X-Board-Code when the code is longer than MAX_CODE_HEADER_CHARS"""
+    if len(headers.get("X-Board-Code", "")) > MAX_CODE_HEADER_CHARS:
+        del headers["X-Board-Code"]
+    return headers
+
+def encode_fields(fields):
+    with STAGE_SECONDS.time(stage="encode"):
+        return encode_object(fields) + b"\n"
+
+def seeded_response(endpoint, seed, options, build, layout=STANDARD_LAYOUT):
+    """Return build(rng) as JSON; seeded requests are serialized once and then served from the cache"""
+    if seed is None:
+        return board_response(build(random))
+    key = (endpoint, seed, options, layout.name)
+    parts = board_cache.get(key)
+    if parts is None:
+        fields = build(random.Random(seed))
+        fields["seed"] = seed
+        parts = response_parts(fields)
+        # A board cut short by its time budget depends on timing, so it is not reproducible
+        if fields.get("satisfied", True):
+            board_cache.put(key, parts)
+    body, mimetype, headers = parts
+    return Response(body, mimetype=mimetype, headers=headers)
+
+# Snapshots of the cache and pool counters, refreshed on every /metrics scrape
+CACHE_STATS = REGISTRY.gauge("catan_board_cache", "Seeded response cache size and hit counts", ["stat"])
+ARCHIVE_STATS = REGISTRY.gauge("catan_board_archive", "Boards recorded, written, dropped and pending in the archive", ["stat"])
+IMAGE_CACHE_STATS = REGISTRY.gauge("catan_image_cache", "Rendered image cache size and hit counts", ["stat"])
+POOL_STATS = REGISTRY.gauge("catan_board_pool", "Board pool size and hit counts, per constraint set", ["constraints", "stat"])
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Streamed responses (/generate-batch) are timed up to their first line
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
 
 # Get base URL from environment variable, default to localhost
 BASE_URL = os.environ.get('BASE_URL', 'http://127.0.0.1:5000')
@@ -113,8 +362,22 @@ def home():
             "/generate": "Generate a random Catan map",
             "/generate-no-pairs": "Generate a map with no adjacent number pairs (6,8)",
             "/generate-constrained": "Generate a map with constraints (POST)",
+            "/generate-batch": "Stream many constrained maps as newline-delimited JSON (POST)",
+            "/generate-balanced": "Best-balanced constrained map found within a time budget (POST)",
+            "/reroll": "Re-randomize a board's unlocked tiles and return only the changed ones (POST)",
+            "/simulate": "Expected dice income per seat for settlement placements, exact or by Monte Carlo (POST)",
+            "/decode/<code>": "Expand a short board code (from format=compact) into the new format",
+            "/render/<code>": "PNG image of a short board code",
+            "/render": "PNG image of a new-format board posted as {\"tiles\": [...]} (POST)",
+            "/pool": "Size and hit rate of the pre-generated board pools",
+            "/boards/search": "Archived boards by ?constraints=, ?desert=center|slot|q,r,s, ?max_pips= and ?limit= (needs BOARD_ARCHIVE_PATH)",
+            "/metrics": "Request, generation-stage and solver metrics in Prometheus text format",
             "/health": "Health check endpoint"
         },
+        "seed": "Pass ?seed=... (or \"seed\" in a POST body) to any /generate endpoint for a reproducible map",
+        "format": "Pass ?format=compact (or \"format\" in a POST body) to any /generate endpoint for a short board code, or format=png for a PNG image",
+        "layout": "Pass ?layout= (or \"layout\" in a POST body) as standard, extension, hexagon-N, or {\"radius\": N}, {\"rows\": [...]} or {\"coordinates\": [[q, r, s], ...]}",
+        "budget_ms": "Time cap per constrained board; on expiry the best board so far is returned with \"satisfied\": false",
         "post_example": {
             "url": f"{BASE_URL}/generate-constrained",
             "method": "POST",
@@ -129,17 +392,55 @@ def home():
 def health():
     return jsonify({"status": "healthy"})
 
+@app.route('/pool')
+def pool_stats():
+    return jsonify(board_pool.stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the request, stage, solver and pool metrics
+
+    Under serve.py these include the generation workers' (see metrics.Registry.absorb).
+    """
+    refresh_stat_gauges()
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def refresh_stat_gauges():
+    """Copy this process's cache, archive and pool counters into their gauges"""
+    for stat, value in board_cache.stats().items():
+        CACHE_STATS.set(value, stat=stat)
+    for stat, value in image_cache.stats().items():
+        IMAGE_CACHE_STATS.set(value, stat=stat)
+    if board_archive is not None:
+        for stat in ("recorded", "written", "dropped", "pending"):
+            ARCHIVE_STATS.set(board_archive.stats()[stat], stat=stat)
+    for signature, stats in board_pool.stats()["pools"].items():
+        for stat in ("size", "hits", "misses", "generated"):
+            POOL_STATS.set(stats[stat], constraints=signature, stat=stat)
+
 @app.route('/generate', methods=['GET', 'POST'])
 def generate_map():
     """Generate a basic random Catan map"""
     try:
-        map_obj = Map()
-        map_obj = randomizeBoard(map_obj)
+        data = request.get_json(silent=True)
+        seed = request_seed(data)
+        response_format = request_format(data)
+        layout = layoutFromSpec(request_layout(data))
+        
+        def build(rng):
+            map_obj = Map(layout)
+            map_obj = randomizeBoard(map_obj, rng)
+            return {
+                "success": True,
+                **board_fields(map_obj, response_format, map_fields)
+            }
         
+        return seeded_response('generate', seed, (response_format,), build, layout)
+    except ValueError as e:
         return jsonify({
-            "success": True,
-            "map": map_to_dict(map_obj)
-        })
+            "success": False,
+            "error": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "success": False,
@@ -152,18 +453,34 @@ def generate_map_no_pairs():
     try:
         # Get pairs from query parameters or use default
         pairs = request.args.get('pairs', '6,8').split(',')
-        pairs = [int(p.strip()) for p in pairs]
+        pairs = request_pairs([int(p.strip()) for p in pairs])
+        data = request.get_json(silent=True)
+        seed = request_seed(data)
+        response_format = request_format(data)
+        budget_ms = request_budget(data)
+        layout = layoutFromSpec(request_layout(data))
         
-        map_obj = Map()
-        map_obj = randomizeBoard(map_obj)
-        map_obj = noNumberPairs(map_obj, pairs)
-        map_obj = rerandomizeNumbersUntilNoPairs(map_obj, pairs)
+        def build(rng):
+            map_obj = Map(layout)
+            map_obj = solveBoard(map_obj, [pairs], rng=rng, budget_ms=budget_ms)
+            return {
+                "success": True,
+                **board_fields(map_obj, response_format, map_fields),
+                **satisfaction_fields(map_obj, [pairs]),
+                "pairs_avoided": pairs
+            }
         
+        return seeded_response('generate-no-pairs', seed, (tuple(pairs), response_format), build, layout)
+    except ValueError as e:
         return jsonify({
-            "success": True,
-            "map": map_to_dict(map_obj),
-            "pairs_avoided": pairs
-        })
+            "success": False,
+            "error": str(e)
+        }), 400
+    except InfeasibleBoardError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 422
     except Exception as e:
         return jsonify({
             "success": False,
@@ -175,20 +492,37 @@ def generate_custom_map():
     """Generate a map with custom parameters"""
     try:
         data = request.get_json() or {}
-        pairs = data.get('pairs', [6, 8])
+        pairs = request_pairs(data.get('pairs', [6, 8]))
         max_attempts = data.get('max_attempts', 100)
+        seed = request_seed(data)
+        response_format = request_format(data)
+        budget_ms = request_budget(data)
+        layout = layoutFromSpec(request_layout(data))
         
-        map_obj = Map()
-        map_obj = randomizeBoard(map_obj)
-        map_obj = noNumberPairs(map_obj, pairs)
-        map_obj = rerandomizeNumbersUntilNoPairs(map_obj, pairs, max_attempts)
+        # max_attempts is echoed back for older clients; the solver never reshuffles,
+        # budget_ms is what bounds the time spent
+        def build(rng):
+            map_obj = Map(layout)
+            map_obj = solveBoard(map_obj, [pairs], rng=rng, budget_ms=budget_ms)
+            return {
+                "success": True,
+                **board_fields(map_obj, response_format, map_fields),
+                **satisfaction_fields(map_obj, [pairs]),
+                "pairs_avoided": pairs,
+                "max_attempts": max_attempts
+            }
         
+        return seeded_response('generate-custom', seed, (tuple(pairs), max_attempts, response_format), build, layout)
+    except ValueError as e:
         return jsonify({
-            "success": True,
-            "map": map_to_dict(map_obj),
-            "pairs_avoided": pairs,
-            "max_attempts": max_attempts
-        })
+            "success": False,
+            "error": str(e)
+        }), 400
+    except InfeasibleBoardError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 422
     except Exception as e:
         return jsonify({
             "success": False,
@@ -200,26 +534,472 @@ def generate_constrained_map():
     """Generate a map with constraints in the new format"""
     try:
         data = request.get_json() or {}
-        constraints = data.get('constraints', [])
+        constraints = request_constraints(data.get('constraints', []))
+        seed = request_seed(data)
+        response_format = request_format(data)
+        budget_ms = request_budget(data)
+        layout = layoutFromSpec(request_layout(data))
+        
+        # Unseeded requests for an indexed or pooled constraint set skip generation entirely;
+        # both only hold standard boards. The index is exactly uniform, so it goes first.
+        if seed is None and layout is STANDARD_LAYOUT:
+            if board_space is not None and board_space.supports(constraints):
+                BOARDS.inc(constraints=constraintLabel(*namedConstraints(constraints)), outcome="indexed")
+                return board_response({
+                    **board_fields(board_space.sample(constraints), response_format, new_format_fields),
+                    "satisfied": True,
+                    "violations": 0
+                })
+            packed = board_pool.take(constraints)
+            if packed is not None:
+                BOARDS.inc(constraints=constraintLabel(*namedConstraints(constraints)), outcome="pooled")
+                return board_response({
+                    **board_fields(Map().unpack(packed), response_format, new_format_fields),
+                    "satisfied": True,
+                    "violations": 0
+                })
         
-        # Generate base map
-        map_obj = Map()
-        map_obj = randomizeBoard(map_obj)
+        def build(rng):
+            # Generate base map
+            map_obj = Map(layout)
+            map_obj = randomizeBoard(map_obj, rng)
+            
+            # Apply constraints (replaces the random board with a solved one)
+            map_obj = apply_constraints(map_obj, constraints, rng, budget_ms)
+            
+            # Convert to new format
+            return {
+                **board_fields(map_obj, response_format, new_format_fields),
+                **satisfaction_fields(map_obj, *namedConstraints(constraints))
+            }
         
-        # Apply constraints
-        map_obj = apply_constraints(map_obj, constraints)
+        return seeded_response('generate-constrained', seed, (tuple(constraints), response_format), build, layout)
+        
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except InfeasibleBoardError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 422
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/generate-batch', methods=['POST'])
+def generate_batch():
+    """Stream `count` constrained maps in the new format, one JSON object per line
+
+    The seed comes from ?seed= or the body, or is drawn at random, and is echoed in the
+    X-Board-Seed header; the same seed gives the same boards whatever `workers` is set to.
+    engine='numpy' rejection-samples with the vectorized bulk engine, which suits number
+    constraints. With budget_ms each solver board is capped at that many milliseconds and
+    every line reports whether its board satisfied the constraints; a board cut short
+    depends on timing, so only the satisfied ones are reproducible.
+    """
+    data = request.get_json() or {}
+    count = data.get('count', 1)
+    constraints = data.get('constraints', [])
+    seed = request_seed(data)
+    # Drawn here rather than in generateBoards so an unseeded batch can be replayed
+    if seed is None:
+        seed = str(random.getrandbits(64))
+    workers = data.get('workers', 1)
+    engine = data.get('engine', 'solver')
+    response_format = request_format(data)
+    layout_spec = request_layout(data)
+    try:
+        constraints = request_constraints(constraints)
+        budget_ms = request_budget(data, default=None)
+        layoutFromSpec(layout_spec)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_BATCH_COUNT:
+        return jsonify({
+            "success": False,
+            "error": f"count must be an integer between 1 and {MAX_BATCH_COUNT}"
+        }), 400
+    if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+        return jsonify({
+            "success": False,
+            "error": "workers must be a positive integer"
+        }), 400
+    if engine not in ('solver', 'numpy'):
+        return jsonify({
+            "success": False,
+            "error": "engine must be 'solver' or 'numpy'"
+        }), 400
+    if response_format == 'png':
+        return jsonify({
+            "success": False,
+            "error": "format=png is not available for /generate-batch; render the codes with /render/<code>"
+        }), 400
+    if engine == 'numpy' and 'noResources' in constraints:
+        return jsonify({
+            "success": False,
+            "error": "engine 'numpy' rejects almost every board under noResources; use engine 'solver'"
+        }), 400
+
+    workers = min(workers, MAX_BATCH_WORKERS)
+    executor = get_batch_executor() if workers > 1 else None
+    boards = generateBoards(count, constraints, seed, workers, executor, engine, budget_ms, layout_spec)
+    # Boards can only fall short of the constraints when a per-board budget was given
+    named = namedConstraints(constraints) if budget_ms is not None else None
+
+    def line(map_obj):
+        fields = board_fields(map_obj, response_format, new_format_fields)
+        if named is not None:
+            fields.update(satisfaction_fields(map_obj, *named))
+        return encode_fields(fields)
+
+    try:
+        # Solve the first board up front so an impossible request still gets a proper status code
+        first = line(next(boards))
+    except SearchBudgetError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 503
+    except InfeasibleBoardError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 422
+
+    def stream():
+        yield first
+        try:
+            for map_obj in boards:
+                yield line(map_obj)
+        except InfeasibleBoardError as e:
+            yield encode_object({"success": False, "error": str(e)}) + b"\n"
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers={"X-Board-Seed": seed})
+
+@app.route('/generate-balanced', methods=['POST'])
+def generate_balanced_map():
+    """Sample many constrained candidates and return the most balanced one in the new format
+
+    The candidates are drawn from the seed, but how many get scored depends on how far
+    the budget_ms wall-clock budget reaches, so a seed alone does not pin down the board.
+    """
+    try:
+        data = request.get_json() or {}
+        constraints = request_constraints(data.get('constraints', []))
+        budget_ms = data.get('budget_ms', BALANCED_BUDGET_MS)
+        weights = data.get('weights')
+        seed = request_seed(data)
+        response_format = request_format(data)
+        layout = layoutFromSpec(request_layout(data))
         
-        # Convert to new format
-        map_data = map_to_new_format(map_obj)
+        if not isinstance(budget_ms, (int, float)) or isinstance(budget_ms, bool) or not 0 < budget_ms <= MAX_BALANCED_BUDGET_MS:
+            return jsonify({
+                "success": False,
+                "error": f"budget_ms must be a number between 0 and {MAX_BALANCED_BUDGET_MS}"
+            }), 400
+        if weights is not None:
+            weights = request_weights(weights)
         
-        return jsonify(map_data)
+        rng = np.random.default_rng(random.Random(seed).getrandbits(64) if seed is not None else None)
+        pair_groups, no_same_number, no_same_resource = namedConstraints(constraints)
+        map_obj, candidates = bestBalancedBoard(pair_groups, no_same_number, no_same_resource, budget_ms, weights=weights, rng=rng, layout=layout)
         
+        return board_response({
+            **board_fields(map_obj, response_format, new_format_fields),
+            "score": scoreMap(map_obj, weights),
+            "candidates": candidates
+        })
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except InfeasibleBoardError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 422
     except Exception as e:
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
+@app.route('/decode/<code>')
+def decode_board(code):
+    """Expand a short board code back into the new format; pass ?layout= for codes of other layouts"""
+    try:
+        map_obj = Map.fromShortCode(code, layoutFromSpec(request.args.get('layout')))
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    return board_response(new_format_fields(map_obj))
+
+@app.route('/reroll', methods=['POST'])
+def reroll_board():
+    """Re-randomize the unlocked tiles of a board under constraints and return only the tiles that changed
+
+    The board is posted as "code" (a short code) or "tiles" (the new format). "locked" hexes keep
+    their resource and number, "locked_resources" and "locked_numbers" hexes keep just that one.
+    The response carries the new board's code and the changed tiles in the new format.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        constraints = request_constraints(data.get('constraints', []))
+        seed = request_seed(data)
+        budget_ms = request_budget(data)
+        layout = layoutFromSpec(request_layout(data))
+        if isinstance(data.get('code'), str):
+            map_obj = Map.fromShortCode(data['code'], layout)
+        elif 'tiles' in data:
+            map_obj = map_from_new_format(data['tiles'], layout)
+        else:
+            raise ValueError("Pass the board as \"code\" or as new-format \"tiles\"")
+        locked = {}
+        for name in ('locked', 'locked_resources', 'locked_numbers'):
+            hexes = data.get(name, [])
+            if not isinstance(hexes, list):
+                raise ValueError(f"{name} must be a list of hexes")
+            locked[name] = {hex_slot(value, layout) for value in hexes}
+        locked_resources = locked['locked'] | locked['locked_resources']
+        locked_numbers = locked['locked'] | locked['locked_numbers']
+        named = namedConstraints(constraints)
+        base = map_obj.pack()
+
+        def build(rng):
+            map_obj.unpack(base)
+            changed = rerollBoard(map_obj, locked_resources, locked_numbers, *named, rng=rng, budget_ms=budget_ms)
+            tiles = map_obj.tiles
+            return {
+                **board_fields(map_obj, 'compact', new_format_fields),
+                "changed": [new_format_tile(tiles[slot]) for slot in changed],
+                **satisfaction_fields(map_obj, *named)
+            }
+
+        options = (base, tuple(sorted(locked_resources)), tuple(sorted(locked_numbers)), tuple(constraints))
+        return seeded_response('reroll', seed, options, build, layout)
+
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except InfeasibleBoardError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 422
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+def request_settlement(settlement, layout):
+    """(corner, city) for seatWeights from a vertex index, a list of hexes, or {"vertex"|"hexes": .., "city": bool}"""
+    city = False
+    if isinstance(settlement, dict):
+        city = settlement.get('city', False)
+        if not isinstance(city, bool):
+            raise ValueError("city must be true or false")
+        settlement = settlement.get('vertex', settlement.get('hexes'))
+    if isinstance(settlement, int) and not isinstance(settlement, bool):
+        return settlement, city
+    if isinstance(settlement, list) and settlement:
+        return tuple(hex_slot(value, layout) for value in settlement), city
+    raise ValueError("Each settlement must be a vertex index or the list of hexes around its corner")
+
+@app.route('/simulate', methods=['POST'])
+def simulate_income():
+    """Income each seat's settlements collect from the dice over games of `turns` rolls
+
+    Boards are posted as "code", "codes" or new-format "tiles"; "seats" lists each seat's
+    settlements. method "monte_carlo" (the default) simulates `rolls` rolls per board and adds
+    the spread of each seat's total; "exact" computes the mean and variance from the dice odds.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        layout = layoutFromSpec(request_layout(data))
+        method = data.get('method', 'monte_carlo')
+        rolls = data.get('rolls', SIMULATION_ROLLS)
+        turns = data.get('turns', DEFAULT_TURNS)
+        seed = request_seed(data)
+
+        if isinstance(data.get('codes'), list):
+            maps = [Map.fromShortCode(code, layout) for code in data['codes'] if isinstance(code, str)]
+        elif isinstance(data.get('code'), str):
+            maps = [Map.fromShortCode(data['code'], layout)]
+        elif 'tiles' in data:
+            maps = [map_from_new_format(data['tiles'], layout)]
+        else:
+            raise ValueError("Pass the boards as \"code\", \"codes\" or new-format \"tiles\"")
+        if not 1 <= len(maps) <= MAX_SIMULATION_BOARDS:
+            raise ValueError(f"Pass between 1 and {MAX_SIMULATION_BOARDS} boards")
+        seats = data.get('seats')
+        if not isinstance(seats, list) or not 1 <= len(seats) <= MAX_SIMULATION_SEATS or not all(isinstance(seat, list) for seat in seats):
+            raise ValueError(f"seats must be a list of 1 to {MAX_SIMULATION_SEATS} lists of settlements")
+        if any(len(seat) > MAX_SIMULATION_SETTLEMENTS for seat in seats):
+            raise ValueError(f"A seat can have at most {MAX_SIMULATION_SETTLEMENTS} settlements and cities")
+        weights = seatWeights(layout, [[request_settlement(settlement, layout) for settlement in seat] for seat in seats])
+        if method not in ('monte_carlo', 'exact'):
+            raise ValueError("method must be 'monte_carlo' or 'exact'")
+        if not isinstance(turns, int) or isinstance(turns, bool) or not 1 <= turns <= MAX_SIMULATION_TURNS:
+            raise ValueError(f"turns must be an integer between 1 and {MAX_SIMULATION_TURNS}")
+        if not isinstance(rolls, int) or isinstance(rolls, bool) or not turns <= rolls * len(maps) <= MAX_SIMULATION_ROLLS:
+            raise ValueError(f"rolls must be an integer of at least turns, and at most {MAX_SIMULATION_ROLLS} summed over the boards")
+
+        resources, numbers = boardArrays(maps, layout)
+        producing = [RESOURCE_NAMES[code] for code in PRODUCING]
+        with STAGE_SECONDS.time(stage="simulate"):
+            if method == 'exact':
+                income = expectedIncome(resources, numbers, weights, turns)
+            else:
+                rng = np.random.default_rng(random.Random(seed).getrandbits(64) if seed is not None else None)
+                income = simulateIncome(resources, numbers, weights, rolls, turns, rng)
+
+        boards = []
+        for board, map_obj in enumerate(maps):
+            board_seats = []
+            for seat in range(len(seats)):
+                total = {
+                    "mean": float(income["total_mean"][board, seat]),
+                    "variance": float(income["total_variance"][board, seat]),
+                    "std": float(np.sqrt(max(income["total_variance"][board, seat], 0.0)))
+                }
+                if method == 'monte_carlo':
+                    total["percentiles"] = {str(p): int(value) for p, value in zip(PERCENTILES, income["percentiles"][board, seat])}
+                    # Share of games per total income, from the smallest total any game reached
+                    histogram = income["histogram"][board, seat]
+                    reached = np.flatnonzero(histogram)
+                    total["distribution"] = {
+                        "min": int(reached[0]),
+                        "probabilities": (histogram[reached[0]:reached[-1] + 1] / income["games"]).round(6).tolist()
+                    }
+                board_seats.append({
+                    "mean": dict(zip(producing, income["mean"][board, seat].tolist())),
+                    "variance": dict(zip(producing, income["variance"][board, seat].tolist())),
+                    "total": total
+                })
+            boards.append({"code": map_obj.shortCode(), "seats": board_seats})
+
+        fields = {"method": method, "turns": turns, "boards": boards}
+        if method == 'monte_carlo':
+            fields.update({"games": income["games"], "rolls": income["games"] * turns, "seed": seed})
+        return jsonify(fields)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+def request_desert_slot(layout):
+    """Slot from ?desert= given as "center", a slot number or "q,r,s"; raises ValueError if it is off the layout"""
+    desert = request.args.get('desert')
+    if desert is None:
+        return None
+    try:
+        if desert == 'center':
+            slot = layout.coord_to_slot.get((0, 0, 0))
+        elif ',' in desert:
+            slot = layout.coord_to_slot.get(tuple(int(c) for c in desert.split(',')))
+        else:
+            slot = int(desert) if 0 <= int(desert) < len(layout) else None
+    except ValueError:
+        slot = None
+    if slot is None:
+        raise ValueError("desert must be center, a slot number or q,r,s of a tile on the layout")
+    return slot
+
+def request_int_arg(name, default=None):
+    """Integer query parameter; raises ValueError when it is given but is not an integer"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+@app.route('/boards/search')
+def search_boards():
+    """Archived boards matching ?constraints=a,b&desert=...&max_pips=...&layout=...&limit=..., without generating any"""
+    if board_archive is None:
+        return jsonify({
+            "success": False,
+            "error": "The board archive is off; set BOARD_ARCHIVE_PATH to enable it"
+        }), 503
+    try:
+        constraints = request_constraints([name for name in request.args.get('constraints', '').split(',') if name])
+        layout = layoutFromSpec(request_layout())
+        desert_slot = request_desert_slot(layout)
+        max_pips = request_int_arg('max_pips')
+        limit = request_int_arg('limit', 20)
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+        boards = board_archive.search(constraints, request_layout(), desert_slot, max_pips, limit)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    return jsonify({"success": True, "count": len(boards), "boards": boards})
+
+@app.route('/render/<code>')
+def render_code(code):
+    """PNG of a short board code, served from the image cache after the first render"""
+    try:
+        layout = layoutFromSpec(request.args.get('layout'))
+        map_obj = Map.fromShortCode(code, layout)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    # Keyed by the re-encoded code so equivalent spellings of one code share an entry
+    key = (layout.name, map_obj.shortCode())
+    png = image_cache.get(key)
+    if png is None:
+        with STAGE_SECONDS.time(stage="render"):
+            png = map_png(map_obj)
+        image_cache.put(key, png)
+    return Response(png, mimetype='image/png', headers=code_header({"X-Board-Code": key[1]}))
+
+@app.route('/render', methods=['POST'])
+def render_tiles():
+    """PNG of a board posted as {"tiles": [...]} in the new format (as returned by /generate-constrained)"""
+    data = request.get_json(silent=True) or {}
+    tiles = data.get('tiles')
+    if not isinstance(tiles, list):
+        return jsonify({
+            "success": False,
+            "error": "tiles must be the list of tiles of a new-format board"
+        }), 400
+    try:
+        with STAGE_SECONDS.time(stage="render"):
+            png = render_png(tiles)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    return Response(png, mimetype='image/png')
+
 # Add this for Vercel compatibility
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,214 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+import numpy as np
+from classes import Map, DESERT_CODE, layoutFromSpec
+from bulk import bulkTables, validBoards
+from scoring import boardMetrics
+from solver import namedConstraints
+
+# Bit of each constraint in the `satisfied` column
+ARCHIVE_CONSTRAINTS = ("eightSix", "twoTwelve", "noResources", "noTwoNumber")
+
+# Boards written per transaction, and the longest a recorded board waits before it is written
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_FLUSH_SECONDS = 1.0
+
+# Recorded boards held in memory while the writer catches up; beyond this new ones are dropped
+MAX_PENDING_BOARDS = 100000
+
+# Most rows a single search returns
+MAX_SEARCH_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boards (
+    id INTEGER PRIMARY KEY,
+    layout TEXT NOT NULL,
+    board BLOB NOT NULL,
+    satisfied INTEGER NOT NULL,
+    desert_slot INTEGER NOT NULL,
+    max_vertex_pips INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boards_by_properties ON boards (layout, satisfied, desert_slot, max_vertex_pips);
+"""
+
+
+def constraintMask(constraints):
+    """Bits of the `satisfied` column for a list of constraint names; unknown names raise ValueError"""
+    mask = 0
+    for name in constraints:
+        if name not in ARCHIVE_CONSTRAINTS:
+            raise ValueError(f"Unknown constraint {name!r}; expected one of {', '.join(ARCHIVE_CONSTRAINTS)}")
+        mask |= 1 << ARCHIVE_CONSTRAINTS.index(name)
+    return mask
+
+
+def satisfiedMasks(resources, numbers, layout):
+    """`satisfied` bits for (N, slots) resource and number arrays of one layout"""
+    tables = bulkTables(layout)
+    masks = np.zeros(len(numbers), dtype=np.int64)
+    for bit, name in enumerate(ARCHIVE_CONSTRAINTS):
+        valid = validBoards(resources, numbers, *namedConstraints([name]), tables=tables)
+        masks |= valid.astype(np.int64) << bit
+    return masks
+
+
+class BoardArchive:
+    """Append-only SQLite archive of generated boards, written in batches by a background thread
+
+    record() only queues the board, so the request path never touches the database. Each row
+    keeps the board's canonicalBytes() and the indexed columns searched by search(): which
+    constraints it satisfies, its (first) desert slot and its highest intersection pip count.
+    """
+    def __init__(self, path, batch_size=ARCHIVE_BATCH_SIZE, flush_seconds=ARCHIVE_FLUSH_SECONDS, max_pending=MAX_PENDING_BOARDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.flushing = 0
+        self.stats_counts = {"recorded": 0, "written": 0, "dropped": 0}
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        # WAL lets searches read while the writer appends
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._write, name="board-archive-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Write everything still queued, then stop the writer"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def record(self, map):
+        """Queue a board for the archive; returns False if the queue was full and it was dropped"""
+        self.start()
+        with self.condition:
+            if len(self.pending) >= self.max_pending:
+                self.stats_counts["dropped"] += 1
+                return False
+            self.pending.append((map.layout, map.pack()))
+            self.stats_counts["recorded"] += 1
+            # The first board starts the writer's flush timer; a full batch is written at once
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.condition.notify_all()
+            return True
+
+    def flush(self):
+        """Block until every board recorded so far is written"""
+        self.start()
+        with self.condition:
+            target = self.stats_counts["recorded"]
+            self.flushing += 1
+            self.condition.notify_all()
+            while self.stats_counts["written"] < target and self.thread.is_alive():
+                self.condition.wait(0.1)
+            self.flushing -= 1
+
+    def stats(self):
+        with self.condition:
+            return dict(self.stats_counts, pending=len(self.pending), running=self.thread is not None and self.thread.is_alive())
+
+    def _write(self):
+        connection = self._connect()
+        try:
+            while True:
+                with self.condition:
+                    while not self.pending and not self.stopping:
+                        self.condition.wait()
+                    # Wait for a full batch, flush() or stop(), but no longer than flush_seconds
+                    deadline = time.monotonic() + self.flush_seconds
+                    while not self.stopping and not self.flushing and len(self.pending) < self.batch_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    if not self.pending:
+                        return
+                    batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+
+                # Derive the indexed columns and insert outside the lock so record() never waits on SQLite
+                rows = self._rows(batch)
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO boards (layout, board, satisfied, desert_slot, max_vertex_pips, created) VALUES (?, ?, ?, ?, ?, ?)",
+                        rows
+                    )
+                with self.condition:
+                    self.stats_counts["written"] += len(rows)
+                    self.condition.notify_all()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _rows(batch):
+        """Insert rows for a batch of (layout, packed) boards, with columns derived per layout in bulk"""
+        by_layout = {}
+        for layout, packed in batch:
+            by_layout.setdefault(layout, []).append(packed)
+        now = time.time()
+        rows = []
+        for layout, boards in by_layout.items():
+            size = len(layout)
+            packed = np.frombuffer(b"".join(boards), dtype=np.uint8).reshape(len(boards), 2 * size)
+            numbers, resources = packed[:, :size], packed[:, size:]
+            masks = satisfiedMasks(resources, numbers, layout)
+            max_pips = boardMetrics(resources, numbers, layout)["max_vertex_pips"]
+            deserts = (resources == DESERT_CODE).argmax(axis=1)
+            map = Map(layout)
+            for i, board in enumerate(boards):
+                rows.append((layout.name, map.unpack(board).canonicalBytes(), int(masks[i]), int(deserts[i]), int(max_pips[i]), now))
+        return rows
+
+    def search(self, constraints=(), layout=None, desert_slot=None, max_vertex_pips=None, limit=20):
+        """Up to `limit` archived boards of `layout` satisfying every named constraint, in no particular order
+
+        Returns dicts with the board's short code and its indexed columns. Only boards already
+        written are seen; call flush() first to include everything recorded.
+        """
+        layout = layoutFromSpec(layout)
+        mask = constraintMask(constraints)
+        # Every mask containing the requested bits, so the IN list can use the index
+        masks = [m for m in range(1 << len(ARCHIVE_CONSTRAINTS)) if m & mask == mask]
+        query = f"SELECT id, board, satisfied, desert_slot, max_vertex_pips FROM boards WHERE layout = ? AND satisfied IN ({', '.join('?' * len(masks))})"
+        params = [layout.name, *masks]
+        if desert_slot is not None:
+            query += " AND desert_slot = ?"
+            params.append(desert_slot)
+        if max_vertex_pips is not None:
+            query += " AND max_vertex_pips <= ?"
+            params.append(max_vertex_pips)
+        query += " LIMIT ?"
+        params.append(limit)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+        return [{
+            "id": row_id,
+            "code": Map.fromCanonicalBytes(board, layout).shortCode(),
+            "satisfied": [name for bit, name in enumerate(ARCHIVE_CONSTRAINTS) if satisfied >> bit & 1],
+            "desert_slot": desert,
+            "desert": layout.coordinates[desert],
+            "max_vertex_pips": max_pips
+        } for row_id, board, satisfied, desert, max_pips in rows]
@@ -0,0 +1,377 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import combinations
+from classes import Map, layoutFromSpec
+from Maker import (randomizeBoard, generateBoards, fillAdjacentNumbers, noNumberPairs, noAdjacentSameResources,
+                   rerandomizeNumbersUntilNoPairs, rerandomizeResourcesUntilNoAdjacentSame)
+from solver import solveConstraints, namedConstraints, constraintViolations, InfeasibleBoardError
+
+CONSTRAINT_NAMES = ("eightSix", "twoTwelve", "noResources", "noTwoNumber")
+
+class _ReferenceTile:
+    """Tile as boards stored it before the byte-array Map: a plain object with a __dict__"""
+    def __init__(self, number, resource, slot, coordinates):
+        self.number = number
+        self.resource = resource
+        self.coordinates = coordinates
+        self.slot = slot
+
+
+class _ReferenceMap:
+    """Map as it was before the byte-array representation, kept so the "before" size is measurable"""
+    def __init__(self, layout):
+        self.layout = layout
+        self.tiles = [None] * len(layout)
+        self.array = None
+        self.coordinates = list(layout.coordinates)
+        self.resources = list(layout.resources)
+        self.numbers = list(layout.numbers)
+        self.coord_to_tile = {}
+
+
+def _referenceBoard(rng):
+    """A random board built the way randomizeBoard built it on the dict-backed representation"""
+    map_obj = _ReferenceMap(layoutFromSpec())
+    resources = map_obj.resources[:]
+    numbers = iter(rng.sample(map_obj.numbers, len(map_obj.numbers)))
+    rng.shuffle(resources)
+    for slot, (coordinates, resource) in enumerate(zip(map_obj.layout.coordinates, resources)):
+        map_obj.tiles[slot] = _ReferenceTile(0 if resource == "Desert" else next(numbers), resource, slot, coordinates)
+    map_obj.coord_to_tile = {tile.coordinates: tile for tile in map_obj.tiles}
+    return map_obj
+
+
+def measure_board_memory(count=2000, keep_tiles=False, reference=False):
+    """Average bytes held per generated board, measured with tracemalloc
+
+    reference=True measures the dict-backed representation boards had before the byte arrays,
+    for the before/after comparison.
+    """
+    rng = random.Random(0)
+    gc.collect()
+    tracemalloc.start()
+    boards = []
+    for _ in range(count):
+        if reference:
+            boards.append(_referenceBoard(rng))
+            continue
+        map_obj = randomizeBoard(Map(), rng)
+        if keep_tiles:
+            map_obj.tiles
+        else:
+            map_obj.compact()
+        boards.append(map_obj)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "boards": count,
+        "bytes_per_board": current / count,
+        "peak_bytes": peak
+    }
+
+def measure_generation_allocations(count=2000):
+    """Transient allocation and time per randomizeBoard call on a reused map"""
+    map_obj = Map()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        randomizeBoard(map_obj)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "boards": count,
+        "peak_bytes": peak,
+        "us_per_board": elapsed / count * 1e6
+    }
+
+def measure_parallel_scaling(count=8192, constraints=("eightSix", "twoTwelve", "noResources", "noTwoNumber"), max_workers=None):
+    """Boards per second from generateBoards with 1..max_workers processes"""
+    max_workers = max_workers or os.cpu_count() or 1
+    results = []
+    for workers in range(1, max_workers + 1):
+        start = time.perf_counter()
+        for _ in generateBoards(count, constraints, seed=0, workers=workers):
+            pass
+        elapsed = time.perf_counter() - start
+        results.append({
+            "workers": workers,
+            "boards_per_second": count / elapsed
+        })
+    return results
+
+def measure_serialization(count=2000):
+    """Microseconds per board for jsonify-style encoding versus the pre-encoded fragments"""
+    from app import app, map_to_dict, map_to_new_format
+    from serialize import encode_object, map_dict_fragment, new_format_fields
+    map_obj = randomizeBoard(Map())
+    cases = {
+        "map_to_dict": lambda: app.json.dumps(map_to_dict(map_obj), separators=(",", ":"), sort_keys=True),
+        "map_dict_fragment": lambda: map_dict_fragment(map_obj),
+        "map_to_new_format": lambda: app.json.dumps(map_to_new_format(map_obj), separators=(",", ":"), sort_keys=True),
+        "new_format_fields": lambda: encode_object(new_format_fields(map_obj))
+    }
+    results = {}
+    for name, encode in cases.items():
+        start = time.perf_counter()
+        for _ in range(count):
+            encode()
+        results[name] = (time.perf_counter() - start) / count * 1e6
+    return results
+
+def measure_bulk_engine(count=4096, constraints=("eightSix", "twoTwelve")):
+    """Boards per second from the solver and the NumPy bulk engine for one constraint set"""
+    results = {}
+    for engine in ("solver", "numpy"):
+        start = time.perf_counter()
+        for _ in generateBoards(count, constraints, seed=0, engine=engine):
+            pass
+        results[engine] = count / (time.perf_counter() - start)
+    return results
+
+def measure_constraint_combinations(count=500, budget_ms=None):
+    """Satisfaction rate and per-board latency of the solver for every combination of constraints"""
+    rng = random.Random(0)
+    map_obj = Map()
+    results = []
+    for size in range(len(CONSTRAINT_NAMES) + 1):
+        for constraints in combinations(CONSTRAINT_NAMES, size):
+            named = namedConstraints(constraints)
+            satisfied = 0
+            latencies = []
+            for _ in range(count):
+                start = time.perf_counter()
+                try:
+                    solveConstraints(map_obj, constraints, rng, budget_ms=budget_ms)
+                except InfeasibleBoardError:
+                    latencies.append(time.perf_counter() - start)
+                    continue
+                latencies.append(time.perf_counter() - start)
+                satisfied += constraintViolations(map_obj, *named) == 0
+            latencies.sort()
+            results.append({
+                "constraints": constraints,
+                "satisfied_rate": satisfied / count,
+                "mean_ms": sum(latencies) / count * 1000,
+                "p99_ms": latencies[int(count * 0.99) - 1] * 1000,
+                "max_ms": latencies[-1] * 1000
+            })
+    return results
+
+def measure_large_boards(radii=(12, 18, 30, 57), count=5, constraints=("eightSix", "twoTwelve", "noResources", "noTwoNumber")):
+    """Per-board time of each stage on hexagon layouts of growing radius, and its cost per tile
+
+    Near-linear code keeps us_per_tile roughly flat as the board grows.
+    """
+    from serialize import encode_object, new_format_fields
+    rng = random.Random(0)
+    results = []
+    for radius in radii:
+        start = time.perf_counter()
+        layout = layoutFromSpec(f"hexagon-{radius}")
+        layout_seconds = time.perf_counter() - start
+        map_obj = Map(layout)
+        codes = {}
+        stages = {
+            "randomizeBoard": lambda: randomizeBoard(map_obj, rng),
+            "noNumberPairs": lambda: noNumberPairs(map_obj, [6, 8]),
+            "solveConstraints": lambda: solveConstraints(map_obj, constraints, rng),
+            "new_format_fields": lambda: encode_object(new_format_fields(map_obj)),
+            "shortCode": lambda: codes.update(code=map_obj.shortCode()),
+            "fromShortCode": lambda: Map.fromShortCode(codes["code"], layout)
+        }
+        row = {"radius": radius, "tiles": len(layout), "layout_ms": layout_seconds * 1000}
+        for name, stage in stages.items():
+            start = time.perf_counter()
+            for _ in range(count):
+                stage()
+            seconds = (time.perf_counter() - start) / count
+            row[name] = {"ms_per_board": seconds * 1000, "us_per_tile": seconds / len(layout) * 1e6}
+        row["satisfied"] = constraintViolations(map_obj, *namedConstraints(constraints)) == 0
+        row["code_chars"] = len(codes["code"])
+        results.append(row)
+    return results
+
+def _summary(samples):
+    """Latency statistics in microseconds for a list of durations in seconds"""
+    samples = sorted(samples)
+    return {
+        "calls": len(samples),
+        "mean_us": sum(samples) / len(samples) * 1e6,
+        "median_us": samples[len(samples) // 2] * 1e6,
+        "p99_us": samples[max(int(len(samples) * 0.99) - 1, 0)] * 1e6,
+        "max_us": samples[-1] * 1e6
+    }
+
+def _timeCalls(call, count, setup=None):
+    """Time `count` calls of call(state), where state = setup(i) is prepared outside the timing"""
+    samples = []
+    for i in range(count):
+        state = setup(i) if setup is not None else None
+        start = time.perf_counter()
+        call(state)
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def _constraintCombinations():
+    return [list(constraints) for size in range(len(CONSTRAINT_NAMES) + 1) for constraints in combinations(CONSTRAINT_NAMES, size)]
+
+def micro_benchmarks(count=2000):
+    """Per-call latency of the generation, repair and serialization functions on seeded boards"""
+    from app import map_to_dict, map_to_new_format, map_png
+    rng = random.Random(0)
+    boards = [randomizeBoard(Map(), rng).pack() for _ in range(count)]
+    map_obj = Map()
+
+    def fresh(i):
+        return map_obj.unpack(boards[i])
+
+    return {
+        "randomizeBoard": _timeCalls(lambda _: randomizeBoard(map_obj, rng), count),
+        "fillAdjacentNumbers": _timeCalls(fillAdjacentNumbers, count, fresh),
+        "noNumberPairs": _timeCalls(lambda board: noNumberPairs(board, [6, 8]), count, fresh),
+        "noAdjacentSameResources": _timeCalls(noAdjacentSameResources, count, fresh),
+        "rerandomizeNumbersUntilNoPairs": _timeCalls(lambda board: rerandomizeNumbersUntilNoPairs(board, [6, 8], rng=rng), count, fresh),
+        "rerandomizeResourcesUntilNoAdjacentSame": _timeCalls(lambda board: rerandomizeResourcesUntilNoAdjacentSame(board, rng=rng), count, fresh),
+        "map_to_dict": _timeCalls(map_to_dict, count, fresh),
+        "map_to_new_format": _timeCalls(map_to_new_format, count, fresh),
+        "map_png": _timeCalls(map_png, count, fresh)
+    }
+
+def macro_benchmarks(requests=50, batch_count=256):
+    """Per-request latency of every endpoint through the Flask test client, without a server
+
+    Requests carry distinct seeds so boards are reproducible run to run yet never served
+    from the response cache or the board pool.
+    """
+    import app as app_module
+    from archive import BoardArchive
+    client = app_module.app.test_client()
+    counter = iter(range(10 ** 9))
+
+    def seed():
+        return f"bench-{next(counter)}"
+
+    def get(path):
+        return lambda _: client.get(f"{path}?seed={seed()}").data
+
+    def post(path, body):
+        return lambda _: client.post(path, json=dict(body, seed=seed())).data
+
+    board = randomizeBoard(Map(), random.Random(0))
+    code = board.shortCode()
+    tiles = client.get(f"/decode/{code}").get_json()["tiles"]
+    # Four seats of two settlements each, by vertex index; no two of them share or touch a corner
+    seats = [[seat * 6, seat * 6 + 24] for seat in range(4)]
+    # The center and its first neighbors keep their tiles on every reroll
+    locked = [list(coordinates) for coordinates in board.layout.coordinates[4:10]]
+    results = {
+        "GET /generate": _timeCalls(get('/generate'), requests),
+        "GET /generate-no-pairs": _timeCalls(get('/generate-no-pairs'), requests),
+        "POST /generate-custom": _timeCalls(post('/generate-custom', {"pairs": [6, 8]}), requests),
+        "GET /decode/<code>": _timeCalls(lambda _: client.get(f"/decode/{code}").data, requests),
+        "GET /generate [format=png]": _timeCalls(lambda _: client.get(f"/generate?format=png&seed={seed()}").data, requests),
+        "GET /render/<code>": _timeCalls(lambda _: client.get(f"/render/{code}").data, requests),
+        "POST /simulate [exact]": _timeCalls(post('/simulate', {"code": code, "seats": seats, "method": "exact"}), requests),
+        "POST /simulate [monte_carlo, 1M rolls]": _timeCalls(post('/simulate', {"code": code, "seats": seats}), max(requests // 10, 1)),
+        "POST /reroll [eightSix]": _timeCalls(post('/reroll', {"code": code, "locked": locked, "constraints": ["eightSix"]}), requests),
+        "POST /render": _timeCalls(lambda _: client.post('/render', json={"tiles": tiles}).data, requests),
+        "GET /pool": _timeCalls(lambda _: client.get('/pool').data, requests),
+        "GET /metrics": _timeCalls(lambda _: client.get('/metrics').data, requests),
+        "GET /health": _timeCalls(lambda _: client.get('/health').data, requests)
+    }
+
+    # Search a throwaway archive of one batch of boards, so other endpoints never pay for archiving
+    served_archive = app_module.board_archive
+    with tempfile.TemporaryDirectory() as directory:
+        app_module.board_archive = BoardArchive(os.path.join(directory, "boards.db"))
+        try:
+            post('/generate-batch', {"constraints": [], "count": batch_count})(None)
+            app_module.board_archive.flush()
+            results["GET /boards/search [eightSix]"] = _timeCalls(lambda _: client.get('/boards/search?constraints=eightSix&limit=20').data, requests)
+        finally:
+            app_module.board_archive.stop()
+            app_module.board_archive = served_archive
+
+    for constraints in _constraintCombinations():
+        name = "+".join(constraints) or "none"
+        results[f"POST /generate-constrained [{name}]"] = _timeCalls(post('/generate-constrained', {"constraints": constraints}), requests)
+        results[f"POST /generate-batch [{name}]"] = _timeCalls(post('/generate-batch', {"constraints": constraints, "count": batch_count}), max(requests // 10, 1))
+        results[f"POST /generate-balanced [{name}]"] = _timeCalls(post('/generate-balanced', {"constraints": constraints, "budget_ms": 10}), max(requests // 10, 1))
+    return results
+
+def _gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(quick=False):
+    """The offline benchmark suite as one JSON-serializable dict, tagged with the commit it ran on"""
+    count = 200 if quick else 2000
+    requests = 10 if quick else 50
+    return {
+        "meta": {
+            "commit": _gitCommit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "quick": quick,
+            "timestamp": time.time()
+        },
+        "board_memory": {
+            "reference": measure_board_memory(count, reference=True),
+            "compact": measure_board_memory(count),
+            "tile_views": measure_board_memory(count, keep_tiles=True)
+        },
+        "micro": micro_benchmarks(count),
+        "macro": macro_benchmarks(requests),
+        "constraint_combinations": measure_constraint_combinations(count // 4),
+        "large_boards": measure_large_boards((12, 18) if quick else (12, 18, 30, 57), count=2 if quick else 5)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline generation and API benchmarks")
+    parser.add_argument("--json", metavar="PATH", help="run the benchmark suite and write its results as JSON ('-' for stdout)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a fast sanity run")
+    args = parser.parse_args()
+
+    if args.json:
+        # The capped retry loops give up on most boards by design; their warnings are noise here
+        logging.getLogger("Maker").setLevel(logging.ERROR)
+        results = json.dumps(run_suite(args.quick), indent=2)
+        if args.json == "-":
+            print(results)
+        else:
+            with open(args.json, "w") as f:
+                f.write(results + "\n")
+        return
+
+    print(f"Dict-backed boards (before): {measure_board_memory(reference=True)}")
+    print(f"Compact boards: {measure_board_memory()}")
+    print(f"Boards with tile views: {measure_board_memory(keep_tiles=True)}")
+    print(f"randomizeBoard allocations: {measure_generation_allocations()}")
+    print(f"Serialization us/board: {measure_serialization()}")
+    print(f"Bulk engine boards/s: {measure_bulk_engine()}")
+    for row in measure_constraint_combinations():
+        print(f"Constraint combination: {row}")
+    for row in measure_constraint_combinations(budget_ms=1):
+        print(f"Constraint combination, 1 ms budget: {row}")
+    for row in measure_large_boards():
+        print(f"Large board: {row}")
+    for row in measure_parallel_scaling():
+        print(f"Parallel generation: {row}")
+
+if __name__ == "__main__":
+    main()
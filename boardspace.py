@@ -0,0 +1,428 @@
+import argparse
+import json
+import random
+import sys
+import time
+from itertools import combinations
+import numpy as np
+from classes import Map, STANDARD_LAYOUT, RESOURCE_CODES, DESERT_CODE, _counts, _permutationCount, _rankMultiset, _unrankMultiset
+from solver import CONSTRAINT_PAIRS, namedConstraints
+
+# Constraints the index can sample exactly; anything else (noTwoNumber) is left to the solver
+INDEXED_CONSTRAINTS = ("eightSix", "twoTwelve", "noResources")
+
+# Leading bytes of an index file, and the format version after them
+INDEX_MAGIC = b"CATANIDX"
+INDEX_VERSION = 1
+
+# Cube coordinate maps that generate the 12 symmetries of a hexagonal board
+_ROTATE = lambda q, r, s: (-r, -s, -q)
+_REFLECT = lambda q, r, s: (q, s, r)
+
+
+def boardSymmetries(layout):
+    """Slot permutations (tuples, old slot -> new slot) under which the layout maps onto itself"""
+    symmetries = []
+    for reflect in (False, True):
+        for turns in range(6):
+            permutation = []
+            for coordinates in layout.coordinates:
+                if reflect:
+                    coordinates = _REFLECT(*coordinates)
+                for _ in range(turns):
+                    coordinates = _ROTATE(*coordinates)
+                permutation.append(layout.coord_to_slot.get(coordinates))
+            if None not in permutation:
+                symmetries.append(tuple(permutation))
+    return symmetries
+
+
+class Placement:
+    """Arrangements of a multiset of values on `slots` with no two adjacent values in `conflicts`
+
+    Slots are filled in the given order. The count of ways to finish a partial arrangement
+    only depends on the position, the values still left and the values on the frontier
+    (filled slots that touch an unfilled one), so that triple is the state counted.
+    """
+    def __init__(self, layout, slots, values, conflicts):
+        self.slots = tuple(slots)
+        self.values = tuple(sorted(set(values)))
+        self.totals = tuple(values.count(value) for value in self.values)
+        value_index = {value: i for i, value in enumerate(self.values)}
+        self.conflicts = {(value_index[a], value_index[b]) for a, b in conflicts if a in value_index and b in value_index}
+
+        position = {slot: k for k, slot in enumerate(self.slots)}
+        # Earlier slots each slot must be checked against, and the frontier before each position
+        self.earlier = tuple(tuple(position[n] for n in layout.neighbors[slot] if position.get(n, len(self.slots)) < k)
+                             for k, slot in enumerate(self.slots))
+        self.frontier = []
+        for k in range(len(self.slots) + 1):
+            if not self.conflicts:
+                self.frontier.append(())
+                continue
+            self.frontier.append(tuple(j for j in range(k) if any(position.get(n, -1) >= k for n in layout.neighbors[self.slots[j]])))
+        self.width = max(len(frontier) for frontier in self.frontier)
+        self.count_base = max(self.totals) + 1
+
+    def key(self, k, placed, remaining):
+        """Integer key of the state before position `k`, given the value indices placed so far"""
+        key = k
+        frontier = self.frontier[k]
+        for j in frontier:
+            key = key * len(self.values) + placed[j]
+        key *= len(self.values) ** (self.width - len(frontier))
+        for count in remaining:
+            key = key * self.count_base + count
+        return key
+
+    def fits(self, k, value, placed):
+        return not any((value, placed[j]) in self.conflicts for j in self.earlier[k])
+
+    def completions(self, k, placed, remaining, lookup):
+        if k == len(self.slots):
+            return 1
+        if not self.conflicts:
+            return _permutationCount(dict(enumerate(remaining)))
+        return lookup(self.key(k, placed, remaining))
+
+    def build(self):
+        """{key: count} for every reachable state with at least one completion"""
+        table = {}
+        placed = [None] * len(self.slots)
+        remaining = list(self.totals)
+
+        def count(k):
+            if k == len(self.slots):
+                return 1
+            key = self.key(k, placed, remaining)
+            if key in table:
+                return table[key]
+            total = 0
+            for value, left in enumerate(remaining):
+                if left and self.fits(k, value, placed):
+                    placed[k] = value
+                    remaining[value] -= 1
+                    total += count(k + 1)
+                    remaining[value] += 1
+            placed[k] = None
+            table[key] = total
+            return total
+
+        if self.conflicts:
+            count(0)
+        return {key: total for key, total in table.items() if total}
+
+    def total(self, lookup):
+        return self.completions(0, [], self.totals, lookup)
+
+    def unrank(self, rank, lookup):
+        """Values for self.slots, as a list, of the arrangement with this rank"""
+        placed = [None] * len(self.slots)
+        remaining = list(self.totals)
+        for k in range(len(self.slots)):
+            for value, left in enumerate(remaining):
+                if not left or not self.fits(k, value, placed):
+                    continue
+                placed[k] = value
+                remaining[value] -= 1
+                block = self.completions(k + 1, placed, remaining, lookup)
+                if rank < block:
+                    break
+                rank -= block
+                remaining[value] += 1
+            else:
+                raise ValueError("Rank out of range")
+        return [self.values[value] for value in placed]
+
+    def rank(self, arrangement, lookup):
+        """Inverse of unrank for a valid arrangement of self.slots"""
+        value_index = {value: i for i, value in enumerate(self.values)}
+        placed = [None] * len(self.slots)
+        remaining = list(self.totals)
+        rank = 0
+        for k, value in enumerate(arrangement):
+            target = value_index[value]
+            for value, left in enumerate(remaining):
+                if not left or not self.fits(k, value, placed):
+                    continue
+                placed[k] = value
+                remaining[value] -= 1
+                if value == target:
+                    break
+                rank += self.completions(k + 1, placed, remaining, lookup)
+                remaining[value] += 1
+            else:
+                raise ValueError("Arrangement breaks the constraints")
+        return rank
+
+
+class _CountTable:
+    """Sorted state keys and their completion counts, usually views into a memory-mapped file"""
+    def __init__(self, keys, counts):
+        self.keys = keys
+        self.counts = counts
+
+    @classmethod
+    def fromDict(cls, table):
+        keys = np.array(sorted(table), dtype=np.uint64)
+        counts = np.array([table[int(key)] for key in keys], dtype=np.uint64)
+        return cls(keys, counts)
+
+    def __call__(self, key):
+        i = int(np.searchsorted(self.keys, np.uint64(key)))
+        if i < len(self.keys) and int(self.keys[i]) == key:
+            return int(self.counts[i])
+        return 0
+
+
+def _numberClasses(pair_groups, numbers):
+    """Each pair group as one class of numbers, and every other number in a last class"""
+    groups = []
+    for group in pair_groups:
+        group = tuple(sorted(set(group)))
+        if group not in groups:
+            groups.append(group)
+    grouped = {number for group in groups for number in group}
+    classes = [sorted(number for number in numbers if number in group) for group in groups]
+    classes.append(sorted(number for number in numbers if number not in grouped))
+    return classes
+
+
+class BoardSpace:
+    """Every valid board of a layout, indexed so one can be drawn uniformly without any search
+
+    A board splits into where the desert sits, the resource arrangement around it, and the
+    number arrangement on the other slots. Numbers only matter to eightSix/twoTwelve by
+    class (6/8, 2/12 or neither), so the number part is a class arrangement times a plain
+    ordering of the numbers within each class. Desert slots related by a board symmetry
+    share one set of count tables.
+    """
+    def __init__(self, tables, layout=STANDARD_LAYOUT):
+        self.layout = layout
+        self.tables = tables
+        map = Map(layout)
+        self.numbers = list(map.numbers)
+        self.resource_codes = [RESOURCE_CODES[resource] for resource in map.resources]
+
+        # For each desert slot: the smallest slot in its symmetry orbit, and a symmetry moving that one onto it
+        self.representative = {}
+        for symmetry in boardSymmetries(layout):
+            for slot in range(len(layout)):
+                image = symmetry[slot]
+                if image not in self.representative or slot < self.representative[image][0]:
+                    self.representative[image] = (slot, symmetry)
+        self._placements = {}
+        self._totals = {}
+
+    @staticmethod
+    def supports(constraints):
+        return "noTwoNumber" not in constraints
+
+    @staticmethod
+    def _specs(constraints):
+        """Table names for the resource and the number part of a constraint set"""
+        pair_groups, _, no_same_resource = namedConstraints(constraints)
+        names = sorted(name for name in CONSTRAINT_PAIRS if CONSTRAINT_PAIRS[name] in pair_groups)
+        return ("noResources" if no_same_resource else "resources"), "numbers:" + ",".join(names)
+
+    def _placement(self, spec, desert):
+        key = (spec, desert)
+        placement = self._placements.get(key)
+        if placement is None:
+            slots = [slot for slot in range(len(self.layout)) if slot != desert]
+            if spec.startswith("numbers:"):
+                names = [name for name in spec[len("numbers:"):].split(",") if name]
+                classes = _numberClasses([CONSTRAINT_PAIRS[name] for name in names], self.numbers)
+                values = [c for c, members in enumerate(classes) for _ in members]
+                conflicts = {(c, c) for c in range(len(classes) - 1)}
+            else:
+                values = [code for code in self.resource_codes if code != DESERT_CODE]
+                conflicts = {(code, code) for code in set(values)} if spec == "noResources" else set()
+            placement = self._placements[key] = Placement(self.layout, slots, values, conflicts)
+        return placement
+
+    def _lookup(self, spec, desert):
+        return self.tables.get(f"{spec}@{desert}", _CountTable.fromDict({}))
+
+    def _withinClasses(self, spec):
+        """The number classes of a number spec, and how many orderings each class has within itself"""
+        names = [name for name in spec[len("numbers:"):].split(",") if name]
+        classes = _numberClasses([CONSTRAINT_PAIRS[name] for name in names], self.numbers)
+        return classes, [_permutationCount(_counts(members)) for members in classes]
+
+    def _partCounts(self, spec, desert):
+        """Arrangements of one part (resources or numbers) with the desert on `desert`"""
+        rep, _ = self.representative[desert]
+        count = self._placement(spec, rep).total(self._lookup(spec, rep))
+        if spec.startswith("numbers:"):
+            for within in self._withinClasses(spec)[1]:
+                count *= within
+        return count
+
+    def _deserts(self, constraints):
+        """Cumulative board counts by desert slot, each entry (desert, resource count, number count)"""
+        specs = self._specs(constraints)
+        totals = self._totals.get(specs)
+        if totals is None:
+            totals = []
+            for desert in range(len(self.layout)):
+                totals.append((desert, self._partCounts(specs[0], desert), self._partCounts(specs[1], desert)))
+            self._totals[specs] = totals
+        return specs, totals
+
+    def count(self, constraints=()):
+        """Number of boards of the layout that satisfy the (indexed) constraints"""
+        _, totals = self._deserts(constraints)
+        return sum(resources * numbers for _, resources, numbers in totals)
+
+    def unrank(self, constraints, rank, map=None):
+        """Fill `map` (or a new Map) with the valid board at `rank`, for 0 <= rank < count(constraints)"""
+        (resource_spec, number_spec), totals = self._deserts(constraints)
+        if rank < 0:
+            raise ValueError("Rank out of range")
+        for desert, resource_count, number_count in totals:
+            if rank < resource_count * number_count:
+                break
+            rank -= resource_count * number_count
+        else:
+            raise ValueError("Rank out of range")
+
+        resource_rank, number_rank = divmod(rank, number_count)
+        classes, withins = self._withinClasses(number_spec)
+        within_ranks = []
+        for within in reversed(withins):
+            number_rank, within_rank = divmod(number_rank, within)
+            within_ranks.append(within_rank)
+        within_ranks.reverse()
+
+        # Solve in the representative's frame, then carry the board over with the symmetry
+        rep, symmetry = self.representative[desert]
+        resource_placement = self._placement(resource_spec, rep)
+        number_placement = self._placement(number_spec, rep)
+        resources = resource_placement.unrank(resource_rank, self._lookup(resource_spec, rep))
+        number_classes = number_placement.unrank(number_rank, self._lookup(number_spec, rep))
+        members = [iter(_unrankMultiset(within_rank, members)) for within_rank, members in zip(within_ranks, classes)]
+
+        map = map or Map(self.layout)
+        map.slot_resources[symmetry[rep]] = DESERT_CODE
+        map.slot_numbers[symmetry[rep]] = 0
+        for slot, code, number_class in zip(resource_placement.slots, resources, number_classes):
+            map.slot_resources[symmetry[slot]] = code
+            map.slot_numbers[symmetry[slot]] = next(members[number_class])
+        map.resetConflicts()
+        return map
+
+    def rank(self, constraints, map):
+        """Inverse of unrank; raises ValueError if the board breaks the constraints"""
+        (resource_spec, number_spec), totals = self._deserts(constraints)
+        desert = list(map.slot_resources).index(DESERT_CODE)
+        rank = sum(resources * numbers for _, resources, numbers in totals[:desert])
+        rep, symmetry = self.representative[desert]
+        resource_placement = self._placement(resource_spec, rep)
+        number_placement = self._placement(number_spec, rep)
+        resources = [map.slot_resources[symmetry[slot]] for slot in resource_placement.slots]
+        numbers = [map.slot_numbers[symmetry[slot]] for slot in number_placement.slots]
+
+        classes, withins = self._withinClasses(number_spec)
+        class_of = {number: c for c, members in enumerate(classes) for number in members}
+        number_rank = number_placement.rank([class_of[number] for number in numbers], self._lookup(number_spec, rep))
+        for c, within in enumerate(withins):
+            number_rank = number_rank * within + _rankMultiset([number for number in numbers if class_of[number] == c])
+        resource_rank = resource_placement.rank(resources, self._lookup(resource_spec, rep))
+        return rank + resource_rank * totals[desert][2] + number_rank
+
+    def sample(self, constraints=(), rng=random, map=None):
+        """A uniformly random board satisfying the constraints"""
+        return self.unrank(constraints, rng.randrange(self.count(constraints)), map)
+
+    @classmethod
+    def build(cls, layout=STANDARD_LAYOUT):
+        """Count every state of every table the indexed constraints need"""
+        space = cls({}, layout)
+        specs = {cls._specs(constraints) for r in range(len(INDEXED_CONSTRAINTS) + 1)
+                 for constraints in combinations(INDEXED_CONSTRAINTS, r)}
+        for spec in sorted({spec for pair in specs for spec in pair}):
+            for rep in sorted({rep for rep, _ in space.representative.values()}):
+                table = space._placement(spec, rep).build()
+                if table:
+                    space.tables[f"{spec}@{rep}"] = _CountTable.fromDict(table)
+        space._totals = {}
+        return space
+
+    def save(self, path):
+        """Write the tables as a JSON header followed by 8-byte aligned uint64 arrays"""
+        header = {
+            "version": INDEX_VERSION,
+            "layout": self.layout.name,
+            "coordinates": self.layout.coordinates,
+            "resources": self.resource_codes,
+            "numbers": self.numbers,
+            "tables": {}
+        }
+        offset = 0
+        for name, table in sorted(self.tables.items()):
+            header["tables"][name] = [offset, len(table.keys)]
+            offset += 2 * len(table.keys)
+        encoded = json.dumps(header).encode()
+        encoded += b" " * (-(len(INDEX_MAGIC) + 8 + len(encoded)) % 8)
+        with open(path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(len(encoded).to_bytes(8, "little"))
+            f.write(encoded)
+            for name, table in sorted(self.tables.items()):
+                f.write(np.asarray(table.keys, dtype="<u8").tobytes())
+                f.write(np.asarray(table.counts, dtype="<u8").tobytes())
+
+    @classmethod
+    def load(cls, path, layout=STANDARD_LAYOUT):
+        """Memory-map an index written by save(); raises ValueError if it was built for something else"""
+        with open(path, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{path} is not a board index")
+            length = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(length))
+        space = cls({}, layout)
+        if (header["version"] != INDEX_VERSION or header["layout"] != layout.name
+                or [tuple(c) for c in header["coordinates"]] != list(layout.coordinates)
+                or header["resources"] != space.resource_codes or header["numbers"] != space.numbers):
+            raise ValueError(f"{path} was built for a different layout or index version")
+        data_offset = len(INDEX_MAGIC) + 8 + length
+        size = sum(entries for _, entries in header["tables"].values())
+        data = np.memmap(path, dtype="<u8", mode="r", offset=data_offset, shape=(2 * size,)) if size else np.zeros(0, dtype="<u8")
+        for name, (offset, entries) in header["tables"].items():
+            space.tables[name] = _CountTable(data[offset:offset + entries], data[offset + entries:offset + 2 * entries])
+        return space
+
+
+def constraintStatistics(space):
+    """Exact valid-board counts for every combination of the indexed constraints"""
+    total = space.count(())
+    rows = []
+    for r in range(len(INDEXED_CONSTRAINTS) + 1):
+        for constraints in combinations(INDEXED_CONSTRAINTS, r):
+            count = space.count(constraints)
+            rows.append({"constraints": list(constraints), "boards": count, "fraction": count / total})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the valid-board index served by /generate-constrained")
+    parser.add_argument("command", choices=["build", "stats"])
+    parser.add_argument("--index", default="board_index.bin", help="index file to write (build) or read (stats)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        space = BoardSpace.build()
+        space.save(args.index)
+        states = sum(len(table.keys) for table in space.tables.values())
+        print(f"Wrote {states} states in {len(space.tables)} tables to {args.index} in {time.perf_counter() - start:.1f}s")
+    else:
+        space = BoardSpace.load(args.index)
+    for row in constraintStatistics(space):
+        label = "+".join(row["constraints"]) or "none"
+        print(f"{label:<32} {row['boards']:>24,} {row['fraction']:>10.4%}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
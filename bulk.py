@@ -0,0 +1,98 @@
+import weakref
+import numpy as np
+from classes import Map, RESOURCE_CODES, DESERT_CODE, STANDARD_LAYOUT
+from solver import SearchBudgetError
+
+# Candidate boards drawn per vectorized round
+BULK_DRAW_SIZE = 8192
+
+# Candidate boards a single sampleBoards call may draw before giving up
+MAX_BULK_DRAWS = 2000000
+
+
+class BulkTables:
+    """Static arrays for one layout, built once: neighbor indices and the tile multisets"""
+    def __init__(self, layout=STANDARD_LAYOUT):
+        map = Map(layout)
+        self.size = len(layout)
+        # (slots, 6) neighbor slot indices; missing neighbors point at an extra padding column
+        self.neighbor_index = np.full((self.size, 6), self.size, dtype=np.intp)
+        for slot, adjacent in enumerate(layout.adjacent):
+            for direction, neighbor in enumerate(adjacent.to_list()):
+                if neighbor is not None:
+                    self.neighbor_index[slot, direction] = neighbor
+        self.resources = np.array([RESOURCE_CODES[resource] for resource in map.resources], dtype=np.uint8)
+        self.numbers = np.array(map.numbers, dtype=np.uint8)
+
+
+_tables = weakref.WeakKeyDictionary()
+
+def bulkTables(layout=STANDARD_LAYOUT):
+    tables = _tables.get(layout)
+    if tables is None:
+        tables = _tables[layout] = BulkTables(layout)
+    return tables
+
+
+def randomBoards(count, rng, tables=None):
+    """(resources, numbers) arrays of shape (count, slots) for `count` uniformly shuffled boards"""
+    tables = tables or bulkTables()
+    resources = rng.permuted(np.tile(tables.resources, (count, 1)), axis=1)
+    shuffled_numbers = rng.permuted(np.tile(tables.numbers, (count, 1)), axis=1)
+    numbers = np.zeros((count, tables.size), dtype=np.uint8)
+    # Every row has the layout's desert count, so the row-major fill deals each row its own numbers
+    numbers[resources != DESERT_CODE] = shuffled_numbers.ravel()
+    return resources, numbers
+
+
+def _neighborValues(values, tables, padding):
+    padded = np.concatenate([values, np.full((len(values), 1), padding, dtype=values.dtype)], axis=1)
+    return padded[:, tables.neighbor_index]
+
+
+def validBoards(resources, numbers, pair_groups=(), no_same_number=False, no_same_resource=False, tables=None):
+    """Boolean mask of the boards that break none of the given constraints"""
+    tables = tables or bulkTables()
+    valid = np.ones(len(numbers), dtype=bool)
+    if pair_groups or no_same_number:
+        # The padding column holds 0, which is never in a pair group and never matched below
+        neighbor_numbers = _neighborValues(numbers, tables, 0)
+        for group in pair_groups:
+            in_group = np.isin(numbers, group)[:, :, None] & np.isin(neighbor_numbers, group)
+            valid &= ~in_group.any(axis=(1, 2))
+        if no_same_number:
+            same = (numbers[:, :, None] == neighbor_numbers) & (numbers[:, :, None] != 0)
+            valid &= ~same.any(axis=(1, 2))
+    if no_same_resource:
+        neighbor_resources = _neighborValues(resources, tables, 255)
+        valid &= ~(resources[:, :, None] == neighbor_resources).any(axis=(1, 2))
+    return valid
+
+
+def sampleBoards(count, pair_groups=(), no_same_number=False, no_same_resource=False, rng=None, max_draws=MAX_BULK_DRAWS, tables=None):
+    """Rejection-sample `count` valid boards; exactly uniform over the valid boards
+
+    Returns (resources, numbers) arrays of shape (count, slots). Constraint sets that
+    reject almost every shuffle (noResources accepts about 1 board in 2500) run into
+    `max_draws` and raise SearchBudgetError; use the solver for those.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    tables = tables or bulkTables()
+    kept_resources, kept_numbers = [], []
+    kept = 0
+    drawn = 0
+    while kept < count:
+        if drawn >= max_draws:
+            raise SearchBudgetError(f"Draw budget exhausted: only {kept} of {count} boards were valid after {drawn} bulk draws; use engine 'solver'")
+        resources, numbers = randomBoards(BULK_DRAW_SIZE, rng, tables)
+        drawn += BULK_DRAW_SIZE
+        valid = validBoards(resources, numbers, pair_groups, no_same_number, no_same_resource, tables)
+        kept_resources.append(resources[valid])
+        kept_numbers.append(numbers[valid])
+        kept += int(valid.sum())
+    return np.concatenate(kept_resources)[:count], np.concatenate(kept_numbers)[:count]
+
+
+def packedBoards(resources, numbers):
+    """One Map.pack()-style bytes string per row"""
+    return [row.tobytes() for row in np.concatenate([numbers, resources], axis=1)]
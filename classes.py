@@ -1,4 +1,12 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from math import factorial
+
 class Adjacent:
+    __slots__ = ("TL", "TR", "R", "BR", "BL", "L")
+
     def __init__(self,TL,TR,R,BR,BL,L):
         self.TL = TL
         self.TR = TR
@@ -20,15 +28,56 @@ class Adjacent:
         return self.__str__()
         
 
+# Resources are stored per slot as small integer codes indexing this tuple
+RESOURCE_NAMES = ("Wheat", "Brick", "Rock", "Sheep", "Wood", "Desert")
+RESOURCE_CODES = {name: code for code, name in enumerate(RESOURCE_NAMES)}
+DESERT_CODE = RESOURCE_CODES["Desert"]
+
+# Leading byte of Map.canonicalBytes(): the board's rank among all standard boards, or each
+# slot's resource code and number packed into one byte on every other layout; bump them if
+# either encoding ever changes
+CODE_VERSION = 1
+PACKED_CODE_VERSION = 2
+
+# bytes.translate tables splitting a packed slot byte into its resource code and number, and
+# moving a resource code into the high nibble
+HIGH_NIBBLE = bytes(value >> 4 for value in range(256))
+LOW_NIBBLE = bytes(value & 15 for value in range(256))
+TO_HIGH_NIBBLE = bytes(value << 4 & 255 for value in range(256))
+
+
 class Tile:
-    def __init__(self, number, resource, adjacent, coordinates ):
-        self.number = number
-        self.resource = resource
-        self.coordinates = coordinates
-        self.adjacent = adjacent
+    """View of one slot of a Map; the number and resource live in the map's arrays"""
+    __slots__ = ("map", "slot")
+
+    def __init__(self, map, slot):
+        self.map = map
+        self.slot = slot
+
+    @property
+    def number(self):
+        return self.map.slot_numbers[self.slot]
+
+    @number.setter
+    def number(self, new_number):
+        self.map.slot_numbers[self.slot] = new_number
+        self.map.resetConflicts()
+
+    @property
+    def resource(self):
+        return RESOURCE_NAMES[self.map.slot_resources[self.slot]]
+
+    @resource.setter
+    def resource(self, new_resource):
+        self.map.slot_resources[self.slot] = RESOURCE_CODES[new_resource]
+        self.map.resetConflicts()
+
+    @property
+    def coordinates(self):
+        return self.map.layout.coordinates[self.slot]
 
     def __str__(self):
-        return f"Tile(number={self.number}, resource={self.resource}, coordinates={self.coordinates}, row={self.row})"
+        return f"Tile(number={self.number}, resource={self.resource}, coordinates={self.coordinates}, slot={self.slot})"
 
     def update_number(self, new_number):
         self.number = new_number
@@ -37,25 +86,459 @@ class Tile:
         self.resource = new_resource
 
 
+def _permutationCount(counts):
+    """Distinct orderings of a multiset given as {value: count}"""
+    total = factorial(sum(counts.values()))
+    for count in counts.values():
+        total //= factorial(count)
+    return total
+
+
+def _counts(values):
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+def _rankMultiset(sequence):
+    """Lexicographic rank of `sequence` among all orderings of its own multiset"""
+    counts = _counts(sequence)
+    remaining = len(sequence)
+    total = _permutationCount(counts)
+    rank = 0
+    for value in sequence:
+        # Orderings that put a smaller value here all come first
+        for smaller in sorted(counts):
+            if smaller >= value:
+                break
+            rank += total * counts[smaller] // remaining
+        total = total * counts[value] // remaining
+        counts[value] -= 1
+        if not counts[value]:
+            del counts[value]
+        remaining -= 1
+    return rank
+
+
+def _unrankMultiset(rank, values):
+    """Inverse of _rankMultiset for the multiset `values`"""
+    counts = _counts(values)
+    remaining = len(values)
+    total = _permutationCount(counts)
+    sequence = []
+    for _ in range(len(values)):
+        for value in sorted(counts):
+            block = total * counts[value] // remaining
+            if rank < block:
+                break
+            rank -= block
+        sequence.append(value)
+        total = block
+        counts[value] -= 1
+        if not counts[value]:
+            del counts[value]
+        remaining -= 1
+    return sequence
+
+
+# Axial (q,r,s) offsets to each neighbor, in the same order Adjacent stores them
+DIRECTIONS = [
+    (0, -1, 1),   # TL
+    (1, -1, 0),   # TR
+    (-1, 0, 1),   # R
+    (0, 1, -1),   # BR
+    (-1, 1, 0),   # BL
+    (1, 0, -1),   # L
+]
+
+
+class Layout:
+    """Fixed board topology and tile multisets. Built once and shared by every Map that uses it.
+
+    Without `resources`/`numbers` the multisets are scaled from the standard board's (see scaledTiles).
+    """
+    def __init__(self, coordinates, name, resources=None, numbers=None):
+        self.name = name
+        self.coordinates = tuple(coordinates)
+        self.coord_to_slot = {coord: i for i, coord in enumerate(self.coordinates)}
+        if resources is None or numbers is None:
+            resources, numbers = scaledTiles(len(self.coordinates))
+        self.resources = tuple(resources)
+        self.numbers = tuple(numbers)
+        if len(self.resources) != len(self.coordinates) or len(self.numbers) != len(self.coordinates) - self.resources.count("Desert"):
+            raise ValueError("Layout needs one resource per tile and one number per non-desert tile")
+
+        # Adjacent per slot, holding neighbor slot indices (None off the board)
+        adjacent = []
+        for q, r, s in self.coordinates:
+            adjacent.append(Adjacent(*[self.coord_to_slot.get((q + dq, r + dr, s + ds)) for dq, dr, ds in DIRECTIONS]))
+        self.adjacent = tuple(adjacent)
+
+        # slot -> neighbor slots, and every undirected edge once as (low, high)
+        self.neighbors = tuple(tuple(adj.to_list_no_none()) for adj in self.adjacent)
+        self.edges = tuple((i, j) for i, neighbors in enumerate(self.neighbors) for j in neighbors if i < j)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+
+# Tile multisets of the standard board, which scaledTiles() keeps the proportions of
+STANDARD_RESOURCES = ("Wheat",) * 4 + ("Brick",) * 3 + ("Rock",) * 3 + ("Sheep",) * 4 + ("Wood",) * 4 + ("Desert",)
+STANDARD_NUMBERS = (2, 3, 3, 4, 4, 5, 5, 6, 6, 8, 8, 9, 9, 10, 10, 11, 11, 12)
+
+# Standard board tiles per desert when scaling
+TILES_PER_DESERT = 19
+
+
+def _largestRemainder(total, weights):
+    """Split `total` into integer parts proportional to `weights`, earlier weights winning ties"""
+    weight_sum = sum(weights)
+    parts = [total * weight // weight_sum for weight in weights]
+    by_remainder = sorted(range(len(weights)), key=lambda i: -(total * weights[i] % weight_sum))
+    for i in by_remainder[:total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def scaledTiles(tile_count):
+    """(resources, numbers) for `tile_count` tiles in the standard board's proportions
+
+    One desert per TILES_PER_DESERT tiles (at least one); 19 tiles gives the standard multisets.
+    """
+    deserts = max(1, round(tile_count / TILES_PER_DESERT))
+    producing = max(tile_count - deserts, 0)
+    deserts = tile_count - producing
+    resource_counts = _counts(STANDARD_RESOURCES)
+    del resource_counts["Desert"]
+    number_counts = _counts(STANDARD_NUMBERS)
+    resources = [name for name, count in zip(resource_counts, _largestRemainder(producing, list(resource_counts.values()))) for _ in range(count)]
+    numbers = [number for number, count in zip(number_counts, _largestRemainder(producing, list(number_counts.values()))) for _ in range(count)]
+    return resources + ["Desert"] * deserts, numbers
+
+
+def hexagonCoordinates(radius):
+    """Cube coordinates of a hexagon with `radius` rings around the center, row by row"""
+    return [(q, r, -q - r) for r in range(-radius, radius + 1) for q in range(max(-radius, -r - radius), min(radius, radius - r) + 1)]
+
+
+def rowCoordinates(widths):
+    """Cube coordinates for rows of the given widths, each centered under the middle row"""
+    middle = len(widths) // 2
+    # Twice the x of the rows' shared center, chosen so the middle row starts on a whole q
+    center = widths[middle] - 1 - 2 * (widths[middle] // 2)
+    coordinates = []
+    for i, width in enumerate(widths):
+        r = i - middle
+        start = (center - (width - 1) - r) // 2
+        coordinates.extend((q, r, -q - r) for q in range(start, start + width))
+    return coordinates
+
+
+# Axial coordinates (q,r,s)
+STANDARD_LAYOUT = Layout([
+    (0, -2, 2), (1, -2, 1), (2, -2, 0),
+    (-1, -1, 2), (0, -1, 1), (1, -1, 0), (2, -1, -1),
+    (-2, 0, 2), (-1, 0, 1), (0, 0, 0), (1, 0, -1), (2, 0, -2),
+    (-2, 1, 1), (-1, 1, 0), (0, 1, -1), (1, 1, -2),
+    (-2, 2, 0), (-1, 2, -1), (0, 2, -2)
+], "standard", STANDARD_RESOURCES, STANDARD_NUMBERS)
+
+# The 30-hex board of the 5-6 player extension
+EXTENSION_LAYOUT = Layout(rowCoordinates([3, 4, 5, 6, 5, 4, 3]), "extension",
+                          ("Wheat",) * 6 + ("Brick",) * 5 + ("Rock",) * 5 + ("Sheep",) * 6 + ("Wood",) * 6 + ("Desert",) * 2,
+                          (2, 2) + (3, 4, 5, 6, 8, 9, 10, 11) * 3 + (12, 12))
+
+# Largest board a layout spec may describe, and how many spec-built layouts are kept around
+MAX_LAYOUT_TILES = 10000
+LAYOUT_CACHE_SIZE = 32
+
+_layouts = OrderedDict()
+_layouts_lock = threading.Lock()
+
+
+def _specLayout(spec):
+    """(name, build) for a layout spec, where build() makes the Layout"""
+    if isinstance(spec, str) and spec.startswith("hexagon-"):
+        try:
+            spec = {"radius": int(spec[len("hexagon-"):])}
+        except ValueError:
+            raise ValueError(f"Unknown layout {spec!r}")
+    if not isinstance(spec, dict):
+        raise ValueError(f"Unknown layout {spec!r}")
+
+    if "radius" in spec:
+        radius = spec["radius"]
+        if not isinstance(radius, int) or isinstance(radius, bool) or radius < 0 or 3 * radius * (radius + 1) + 1 > MAX_LAYOUT_TILES:
+            raise ValueError(f"radius must be an integer from 0 up to a board of {MAX_LAYOUT_TILES} tiles")
+        return f"hexagon-{radius}", lambda: Layout(hexagonCoordinates(radius), f"hexagon-{radius}")
+
+    if "rows" in spec:
+        widths = spec["rows"]
+        if (not isinstance(widths, list) or not widths or sum(widths) > MAX_LAYOUT_TILES
+                or not all(isinstance(width, int) and not isinstance(width, bool) and width > 0 for width in widths)):
+            raise ValueError(f"rows must be a list of positive row widths totalling at most {MAX_LAYOUT_TILES} tiles")
+        coordinates = rowCoordinates(widths)
+    elif "coordinates" in spec:
+        coordinates = spec["coordinates"]
+        if not isinstance(coordinates, list) or not 0 < len(coordinates) <= MAX_LAYOUT_TILES:
+            raise ValueError(f"coordinates must be a list of 1 to {MAX_LAYOUT_TILES} [q, r, s] triples")
+        try:
+            coordinates = [tuple(coordinate) for coordinate in coordinates]
+        except TypeError:
+            raise ValueError("coordinates must be [q, r, s] triples")
+        if (any(len(coordinate) != 3 or not all(isinstance(c, int) and not isinstance(c, bool) for c in coordinate) or sum(coordinate) != 0
+                for coordinate in coordinates) or len(set(coordinates)) != len(coordinates)):
+            raise ValueError("coordinates must be distinct [q, r, s] integer triples with q + r + s = 0")
+    else:
+        raise ValueError("A layout spec needs a radius, rows or coordinates")
+
+    # Row by row, like the standard board, so the same shape always gets the same slots
+    coordinates = sorted(coordinates, key=lambda coordinate: (coordinate[1], coordinate[0]))
+    name = "custom-" + hashlib.sha1(repr(coordinates).encode()).hexdigest()[:12]
+    return name, lambda: Layout(coordinates, name)
+
+
+def layoutFromSpec(spec=None):
+    """The Layout for a spec; raises ValueError for a malformed spec
+
+    A spec is "standard" (or None), "extension", "hexagon-N", or a dict with one of
+    "radius": N, "rows": [widths...] or "coordinates": [[q, r, s], ...].
+    """
+    if spec is None or spec == "standard":
+        return STANDARD_LAYOUT
+    if spec == "extension":
+        return EXTENSION_LAYOUT
+    name, build = _specLayout(spec)
+    with _layouts_lock:
+        layout = _layouts.get(name)
+        if layout is not None:
+            _layouts.move_to_end(name)
+            return layout
+    layout = build()
+    with _layouts_lock:
+        layout = _layouts.setdefault(name, layout)
+        while len(_layouts) > LAYOUT_CACHE_SIZE:
+            _layouts.popitem(last=False)
+    return layout
+
+
+class ConflictTracker:
+    """Live count of conflicting edges per constraint, kept current across swaps in O(degree)
+
+    Counts are taken from the whole board the first time a constraint is asked about,
+    then only adjusted by swapNumbers/swapResources. Any other write to the slot arrays
+    must go through Map.resetConflicts().
+    """
+    __slots__ = ("map", "pair_counts", "same_number_count", "resource_count")
+
+    def __init__(self, map):
+        self.map = map
+        self.pair_counts = {}
+        self.same_number_count = None
+        self.resource_count = None
+
+    def pairConflicts(self, pairs):
+        """Number of adjacent tile pairs that both hold a number in `pairs`"""
+        key = frozenset(pairs)
+        count = self.pair_counts.get(key)
+        if count is None:
+            numbers = self.map.slot_numbers
+            count = sum(1 for i, j in self.map.layout.edges if numbers[i] in key and numbers[j] in key)
+            self.pair_counts[key] = count
+        return count
+
+    def sameNumberConflicts(self):
+        """Number of adjacent tile pairs that hold the same (non-desert) number"""
+        if self.same_number_count is None:
+            numbers = self.map.slot_numbers
+            self.same_number_count = sum(1 for i, j in self.map.layout.edges if numbers[i] and numbers[i] == numbers[j])
+        return self.same_number_count
+
+    def sameNumberConflictsAt(self, slot, number, skip=None):
+        """Same-number conflicts `slot` would have if it held `number`, ignoring the neighbor `skip`"""
+        if not number:
+            return 0
+        numbers = self.map.slot_numbers
+        return sum(1 for n in self.map.layout.neighbors[slot] if n != skip and numbers[n] == number)
+
+    def resourceConflicts(self):
+        """Number of adjacent tile pairs that hold the same resource"""
+        if self.resource_count is None:
+            resources = self.map.slot_resources
+            self.resource_count = sum(1 for i, j in self.map.layout.edges if resources[i] == resources[j])
+        return self.resource_count
+
+    def pairConflictsAt(self, slot, number, pairs, skip=None):
+        """Conflicts `slot` would have if it held `number`, ignoring the neighbor `skip`"""
+        if number not in pairs:
+            return 0
+        numbers = self.map.slot_numbers
+        return sum(1 for n in self.map.layout.neighbors[slot] if n != skip and numbers[n] in pairs)
+
+    def resourceConflictsAt(self, slot, resource_code, skip=None):
+        """Conflicts `slot` would have if it held `resource_code`, ignoring the neighbor `skip`"""
+        resources = self.map.slot_resources
+        return sum(1 for n in self.map.layout.neighbors[slot] if n != skip and resources[n] == resource_code)
+
+    def swapNumbers(self, a, b):
+        numbers = self.map.slot_numbers
+        for key in self.pair_counts:
+            # The a-b edge itself keeps the same pair of numbers, so skip it on both sides
+            self.pair_counts[key] += (self.pairConflictsAt(a, numbers[b], key, b) - self.pairConflictsAt(a, numbers[a], key, b)
+                                      + self.pairConflictsAt(b, numbers[a], key, a) - self.pairConflictsAt(b, numbers[b], key, a))
+        if self.same_number_count is not None:
+            self.same_number_count += (self.sameNumberConflictsAt(a, numbers[b], b) - self.sameNumberConflictsAt(a, numbers[a], b)
+                                       + self.sameNumberConflictsAt(b, numbers[a], a) - self.sameNumberConflictsAt(b, numbers[b], a))
+        numbers[a], numbers[b] = numbers[b], numbers[a]
+
+    def swapResources(self, a, b):
+        resources = self.map.slot_resources
+        if self.resource_count is not None:
+            self.resource_count += (self.resourceConflictsAt(a, resources[b], b) - self.resourceConflictsAt(a, resources[a], b)
+                                    + self.resourceConflictsAt(b, resources[a], a) - self.resourceConflictsAt(b, resources[b], a))
+        resources[a], resources[b] = resources[b], resources[a]
+
+
 class Map:
-    def __init__(self):
-        self.tiles = [None] * 19
+    """A board stored as one byte per slot for numbers and one for resource codes"""
+    __slots__ = ("layout", "slot_numbers", "slot_resources", "array", "_tiles", "_conflicts")
+
+    def __init__(self, layout=STANDARD_LAYOUT):
+        self.layout = layout
+        self.slot_numbers = bytearray(len(layout))
+        self.slot_resources = bytearray(len(layout))
         self.array = None
+        self._tiles = None
+        self._conflicts = None
 
-        # Axial coordinates (q,r,s)
-        self.coordinates = [
-            (0, -2, 2), (1, -2, 1), (2, -2, 0),
-            (-1, -1, 2), (0, -1, 1), (1, -1, 0), (2, -1, -1),
-            (-2, 0, 2), (-1, 0, 1), (0, 0, 0), (1, 0, -1), (2, 0, -2),
-            (-2, 1, 1), (-1, 1, 0), (0, 1, -1), (1, 1, -2),
-            (-2, 2, 0), (-1, 2, -1), (0, 2, -2)
-        ]
+    @property
+    def coordinates(self):
+        return self.layout.coordinates
 
-        self.resources = ["Wheat", "Wheat", "Wheat", "Wheat", "Brick", "Brick", "Brick", "Rock", "Rock", "Rock", "Sheep", "Sheep", "Sheep", "Sheep", "Wood", "Wood", "Wood", "Wood", "Desert"]
-        self.numbers = [2, 3, 3, 4, 4, 5, 5, 6, 6, 8, 8, 9, 9, 10, 10, 11, 11, 12]
+    @property
+    def resources(self):
+        return self.layout.resources
+
+    @property
+    def numbers(self):
+        return self.layout.numbers
+
+    @property
+    def tiles(self):
+        # Tile views are built on first use and dropped again by compact()
+        if self._tiles is None:
+            self._tiles = [Tile(self, slot) for slot in range(len(self.layout))]
+        return self._tiles
+
+    def compact(self):
+        """Drop the cached Tile views and conflict counts so only the slot arrays are kept"""
+        self._tiles = None
+        self._conflicts = None
+        return self
+
+    def pack(self):
+        """The board as bytes: slot numbers followed by slot resource codes"""
+        return bytes(self.slot_numbers) + bytes(self.slot_resources)
+
+    def unpack(self, packed):
+        """Load a board produced by pack()"""
+        size = len(self.layout)
+        self.slot_numbers[:] = packed[:size]
+        self.slot_resources[:] = packed[size:]
+        self.resetConflicts()
+        return self
+
+    def canonicalBytes(self):
+        """Fixed-size encoding: a version byte, then the board itself
+
+        A standard board is stored as its rank among all standard boards (12 bytes in all):
+        resources are ranked as an ordering of the resource multiset over every slot, and
+        numbers as an ordering of the number multiset over the non-desert slots. Ranking costs
+        quadratic time in the board size, so every other layout stores one byte per slot
+        instead, the resource code in the high nibble and the number in the low one.
+        """
+        if self.layout is not STANDARD_LAYOUT:
+            # Numbers fit in the low nibble, so or-ing the slot arrays as big integers packs them
+            packed = int.from_bytes(self.slot_resources.translate(TO_HIGH_NIBBLE), "big") | int.from_bytes(self.slot_numbers, "big")
+            return bytes([PACKED_CODE_VERSION]) + packed.to_bytes(len(self.layout), "big")
+        resources = list(self.slot_resources)
+        numbers = [number for number, code in zip(self.slot_numbers, resources) if code != DESERT_CODE]
+        number_count = _permutationCount(_counts(self.numbers))
+        rank = _rankMultiset(resources) * number_count + _rankMultiset(numbers)
+        return bytes([CODE_VERSION]) + rank.to_bytes(self._rankSize(), "big")
+
+    @classmethod
+    def fromCanonicalBytes(cls, data, layout=STANDARD_LAYOUT):
+        """Rebuild a board from canonicalBytes(); raises ValueError for anything else"""
+        map = cls(layout)
+        if layout is not STANDARD_LAYOUT:
+            return map._fromPackedBytes(data)
+        if len(data) != 1 + map._rankSize() or data[0] != CODE_VERSION:
+            raise ValueError("Not a board code for this layout")
+        rank = int.from_bytes(data[1:], "big")
+        resource_codes = [RESOURCE_CODES[resource] for resource in map.resources]
+        number_count = _permutationCount(_counts(map.numbers))
+        resource_rank, number_rank = divmod(rank, number_count)
+        if resource_rank >= _permutationCount(_counts(resource_codes)):
+            raise ValueError("Not a board code for this layout")
+
+        resources = _unrankMultiset(resource_rank, resource_codes)
+        next_number = iter(_unrankMultiset(number_rank, list(map.numbers)))
+        map.slot_resources[:] = bytes(resources)
+        map.slot_numbers[:] = bytes(0 if code == DESERT_CODE else next(next_number) for code in resources)
+        return map
+
+    def _fromPackedBytes(self, data):
+        """Load the one-byte-per-slot form of canonicalBytes(), checking it holds this layout's tiles"""
+        if len(data) != 1 + len(self.layout) or data[0] != PACKED_CODE_VERSION:
+            raise ValueError("Not a board code for this layout")
+        resources = bytes(data[1:]).translate(HIGH_NIBBLE)
+        numbers = bytes(data[1:]).translate(LOW_NIBBLE)
+        expected_resources = bytes(RESOURCE_CODES[resource] for resource in self.resources)
+        expected_numbers = bytes(self.numbers)
+        # Every desert and every zero number must be the same slots: deserts numbered 0
+        deserts = expected_resources.count(DESERT_CODE)
+        if (any(resources.count(code) != expected_resources.count(code) for code in range(len(RESOURCE_NAMES)))
+                or any(numbers.count(number) != expected_numbers.count(number) for number in range(1, 16))
+                or numbers.count(0) != deserts or data[1:].count(DESERT_CODE << 4) != deserts):
+            raise ValueError("Not a board code for this layout")
+        self.slot_resources[:] = resources
+        self.slot_numbers[:] = numbers
+        return self
+
+    def shortCode(self):
+        """canonicalBytes() as URL-safe base64 without padding"""
+        return base64.urlsafe_b64encode(self.canonicalBytes()).rstrip(b"=").decode()
+
+    @classmethod
+    def fromShortCode(cls, code, layout=STANDARD_LAYOUT):
+        try:
+            data = base64.urlsafe_b64decode(code + "=" * (-len(code) % 4))
+        except (ValueError, TypeError):
+            raise ValueError("Not a board code for this layout")
+        return cls.fromCanonicalBytes(data, layout)
+
+    def _rankSize(self):
+        resource_codes = [RESOURCE_CODES[resource] for resource in self.resources]
+        boards = _permutationCount(_counts(resource_codes)) * _permutationCount(_counts(self.numbers))
+        return ((boards - 1).bit_length() + 7) // 8
+
+    def conflicts(self):
+        """The map's ConflictTracker, created on first use"""
+        if self._conflicts is None:
+            self._conflicts = ConflictTracker(self)
+        return self._conflicts
+
+    def resetConflicts(self):
+        """Forget tracked counts after the slot arrays were written directly"""
+        self._conflicts = None
 
-        # This only stores tiles that actually exist (not all possible coordinates)
-        self.coord_to_tile = {tile.coordinates: tile for tile in self.tiles if tile}
-    
     def findTileByCoordinate(self, q, r, s):
-        return self.coord_to_tile.get((q, r, s))
+        slot = self.layout.coord_to_slot.get((q, r, s))
+        return self.tiles[slot] if slot is not None else None
+
+    def adjacentTiles(self, tile):
+        """Neighbors of a tile, looked up in the shared layout table"""
+        tiles = self.tiles
+        return [tiles[slot] for slot in self.layout.neighbors[tile.slot]]
@@ -0,0 +1,173 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is always added
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labelText(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels, lock):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = lock
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self, snapshots=()):
+        """Text exposition of this metric, with the values of other processes' snapshots added in"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = self._copy(self.values)
+        for snapshot in snapshots:
+            for key, value in snapshot.get(self.name, {}).items():
+                values[key] = self._add(values[key], value) if key in values else self._copy({key: value})[key]
+        lines.extend(self._samples(values))
+        return "\n".join(lines) + "\n"
+
+    def _copy(self, values):
+        return dict(values)
+
+    def _add(self, value, other):
+        return value + other
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self, values):
+        return [f"{self.name}{_labelText(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Gauge(_Metric):
+    """A value that is set rather than counted; merged snapshots add up, like pool sizes across workers"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def _samples(self, values):
+        return [f"{self.name}{_labelText(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, lock, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels, lock)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # Per-bucket counts (not cumulative) plus the +Inf bucket, then the sum
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            index = 0
+            while index < len(self.buckets) and value > self.buckets[index]:
+                index += 1
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, values):
+        return {key: [list(counts), total] for key, (counts, total) in values.items()}
+
+    def _add(self, value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1]]
+
+    def _samples(self, values):
+        samples = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append(f"{self.name}_bucket{_labelText(self.labels, key, [('le', bound)])} {cumulative}")
+            samples.append(f"{self.name}_sum{_labelText(self.labels, key)} {total}")
+            samples.append(f"{self.name}_count{_labelText(self.labels, key)} {cumulative}")
+        return samples
+
+
+class Registry:
+    """Process-local metrics rendered in the Prometheus text exposition format
+
+    Other processes can ship their values over as snapshot() dicts; absorb() keeps the latest
+    one per process and render() adds them to this process's own.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.absorbed = {}
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels, self.lock))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels, self.lock))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, self.lock, buckets))
+
+    def snapshot(self):
+        """Picklable {metric name: {label values: value}} copy of every metric"""
+        with self.lock:
+            return {metric.name: metric._copy(metric.values) for metric in self.metrics}
+
+    def absorb(self, source, snapshot):
+        """Replace the snapshot last absorbed from `source` (e.g. a worker's pid)"""
+        with self.lock:
+            self.absorbed[source] = snapshot
+
+    def render(self):
+        with self.lock:
+            snapshots = list(self.absorbed.values())
+        return "".join(metric.render(snapshots) for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+# Shared by Maker, solver and app. serve.py absorbs its generation workers' snapshots;
+# worker processes of /generate-batch keep their own copies, which never show up here.
+REQUEST_SECONDS = REGISTRY.histogram("catan_request_duration_seconds", "Time to build each response, per endpoint", ["endpoint"])
+REQUESTS = REGISTRY.counter("catan_requests_total", "Responses sent, per endpoint and status code", ["endpoint", "status"])
+STAGE_SECONDS = REGISTRY.histogram("catan_stage_duration_seconds", "Time spent in each generation stage", ["stage"])
+SOLVE_SECONDS = REGISTRY.histogram("catan_solve_duration_seconds", "Solver time per board, per constraint set", ["constraints"])
+SOLVER_STEPS = REGISTRY.counter("catan_solver_steps_total", "Backtracking search steps, per constraint set", ["constraints"])
+SWAPS = REGISTRY.counter("catan_swaps_total", "Repair swaps made by the legacy swap functions", ["kind"])
+RESHUFFLES = REGISTRY.counter("catan_reshuffles_total", "Reshuffles made by the legacy retry loops", ["kind"])
+BOARDS = REGISTRY.counter("catan_boards_total", "Constrained boards served, by whether they met every constraint", ["constraints", "outcome"])
+REQUESTS_ACTIVE = REGISTRY.gauge("catan_requests_active", "Requests running or queued under the serve.py limits, per endpoint", ["endpoint", "state"])
+REQUESTS_REJECTED = REGISTRY.counter("catan_requests_rejected_total", "Requests turned away with 503 by serve.py, per endpoint and reason", ["endpoint", "reason"])
@@ -0,0 +1,118 @@
+import random
+import threading
+from collections import deque
+from classes import Map
+from solver import namedConstraints, prepareConstraints, solvePrepared, InfeasibleBoardError, SearchBudgetError
+
+
+def constraintSignature(constraints):
+    """Order-independent key for a list of constraint names"""
+    return tuple(sorted(set(constraints)))
+
+
+class BoardPool:
+    """Ready-made valid boards per constraint signature, topped up by a background thread
+
+    Each pool holds up to `max_size` packed boards. When a take() leaves a pool below
+    `low_watermark` the refill thread wakes and generates back up to `max_size`.
+    """
+    def __init__(self, signatures, max_size=256, low_watermark=64):
+        self.max_size = max_size
+        self.low_watermark = low_watermark
+        self.pools = {constraintSignature(signature): deque() for signature in signatures}
+        self.stats_by_signature = {signature: {"hits": 0, "misses": 0, "generated": 0} for signature in self.pools}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        with self.condition:
+            if self.max_size <= 0 or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._refill, name="board-pool-refill", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def take(self, constraints):
+        """Pop a packed board for these constraints, or None when that pool is empty or not kept"""
+        signature = constraintSignature(constraints)
+        with self.condition:
+            # The refill thread drops signatures it cannot stock, so look the pool up under the lock
+            pool = self.pools.get(signature)
+            if pool is None:
+                return None
+            self.start()
+            stats = self.stats_by_signature[signature]
+            if not pool:
+                stats["misses"] += 1
+                self.condition.notify_all()
+                return None
+            stats["hits"] += 1
+            packed = pool.popleft()
+            if len(pool) < self.low_watermark:
+                self.condition.notify_all()
+            return packed
+
+    def stats(self):
+        with self.condition:
+            pools = {}
+            for signature, pool in self.pools.items():
+                stats = self.stats_by_signature[signature]
+                requests = stats["hits"] + stats["misses"]
+                pools[",".join(signature)] = dict(
+                    stats,
+                    size=len(pool),
+                    hit_rate=stats["hits"] / requests if requests else None,
+                    miss_rate=stats["misses"] / requests if requests else None
+                )
+            return {
+                "max_size": self.max_size,
+                "low_watermark": self.low_watermark,
+                "running": self.thread is not None and self.thread.is_alive(),
+                "pools": pools
+            }
+
+    def _lowestPool(self):
+        if not self.pools:
+            return None
+        signature = min(self.pools, key=lambda s: len(self.pools[s]))
+        return signature if len(self.pools[signature]) < self.low_watermark else None
+
+    def _refill(self):
+        rng = random.Random()
+        map = Map()
+        prepared = {signature: prepareConstraints(map, *namedConstraints(signature)) for signature in self.pools}
+        while True:
+            with self.condition:
+                while not self.stopping and self._lowestPool() is None:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                signature = self._lowestPool()
+                missing = self.max_size - len(self.pools[signature])
+
+            # Generate outside the lock so requests can keep popping meanwhile
+            for _ in range(missing):
+                try:
+                    packed = solvePrepared(map, prepared[signature], rng).pack()
+                except SearchBudgetError:
+                    # Only this draw ran out of search steps; the next one may well succeed
+                    continue
+                except InfeasibleBoardError:
+                    # Nothing valid to stock; stop keeping this signature instead of spinning on it
+                    with self.condition:
+                        del self.pools[signature]
+                        del self.stats_by_signature[signature]
+                    break
+                with self.condition:
+                    if self.stopping:
+                        return
+                    self.pools[signature].append(packed)
+                    self.stats_by_signature[signature]["generated"] += 1
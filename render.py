@@ -0,0 +1,166 @@
+import io
+import math
+import threading
+from PIL import Image, ImageDraw, ImageFont
+
+# Fill colors per terrain of map_to_new_format, and the sea behind the board
+TERRAIN_COLORS = {
+    "field": (232, 196, 80),
+    "hill": (190, 96, 56),
+    "mountain": (132, 132, 140),
+    "pasture": (150, 200, 90),
+    "forest": (46, 120, 60),
+    "desert": (222, 206, 160)
+}
+SEA_COLOR = (56, 120, 180)
+TOKEN_COLOR = (246, 236, 208)
+
+# Numbers printed in red on their token, as on the printed board
+HOT_NUMBERS = (6, 8)
+
+# Dice combinations (pips) shown under each number
+PIPS = {2: 1, 3: 2, 4: 3, 5: 4, 6: 5, 8: 5, 9: 4, 10: 3, 11: 2, 12: 1}
+
+# Hex corner-to-center distance in pixels; large boards shrink it so no side passes
+# MAX_IMAGE_SIDE, but never below MIN_HEX_SIZE, and boards still too wide at that size are
+# refused. Tokens are left off below MIN_TOKEN_HEX_SIZE.
+HEX_SIZE = 40
+MIN_HEX_SIZE = 6
+MIN_TOKEN_HEX_SIZE = 14
+MAX_IMAGE_SIDE = 4096
+
+# Most tiles one render_png call draws, the same cap layouts have
+MAX_RENDER_TILES = 10000
+
+# zlib level for the PNG; the flat palette image compresses well even at the fastest level
+PNG_COMPRESS_LEVEL = 1
+
+
+class SpriteAtlas:
+    """Every hex and number-token sprite for one hex size, rasterized once onto a shared palette
+
+    The sprites are drawn in RGBA, laid out side by side on one sheet and the sheet is
+    quantized once. Boards are then pasted together from the palette crops, and a palette
+    image encodes to PNG several times faster than an RGB one.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.width = math.ceil(math.sqrt(3) * size)
+        self.height = 2 * size
+        sprites = {("hex", terrain): self._hex(color) for terrain, color in TERRAIN_COLORS.items()}
+        if size >= MIN_TOKEN_HEX_SIZE:
+            sprites.update({("token", number): self._token(number) for number in PIPS})
+
+        # Column 0 of the sheet is left as sea so its palette index can be read back
+        sheet = Image.new("RGB", (1 + sum(sprite.width for sprite in sprites.values()), self.height), SEA_COLOR)
+        boxes = {}
+        x = 1
+        for key, sprite in sprites.items():
+            sheet.paste(sprite, (x, 0), sprite)
+            boxes[key] = (x, 0, x + sprite.width, sprite.height)
+            x += sprite.width
+        sheet = sheet.quantize(colors=256)
+        self.palette = sheet.getpalette()
+        self.sea = sheet.getpixel((0, 0))
+
+        # (palette sprite, mask) per terrain and per number
+        self.hexes = {}
+        self.tokens = {}
+        for (kind, value), sprite in sprites.items():
+            target = self.hexes if kind == "hex" else self.tokens
+            target[value] = (sheet.crop(boxes[kind, value]), sprite.getchannel("A"))
+
+    def _hex(self, color):
+        image = Image.new("RGBA", (self.width, self.height), (0, 0, 0, 0))
+        cx, cy = self.width / 2, self.height / 2
+        # Pointy-top corners, so rows of the layout (same r) run left to right
+        corners = [(cx + self.size * math.cos(math.radians(60 * i - 30)), cy + self.size * math.sin(math.radians(60 * i - 30))) for i in range(6)]
+        outline = tuple(channel * 3 // 4 for channel in color)
+        ImageDraw.Draw(image).polygon(corners, fill=color + (255,), outline=outline + (255,), width=max(1, self.size // 20))
+        return image
+
+    def _token(self, number):
+        radius = round(self.size * 0.4)
+        image = Image.new("RGBA", (2 * radius + 1, 2 * radius + 1), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        draw.ellipse((0, 0, 2 * radius, 2 * radius), fill=TOKEN_COLOR + (255,), outline=(90, 70, 40, 255))
+        color = (200, 30, 30, 255) if number in HOT_NUMBERS else (30, 30, 30, 255)
+        font = ImageFont.load_default(size=max(8, round(radius * (1.0 if number < 10 else 0.85))))
+        draw.text((radius, radius * 0.9), str(number), fill=color, font=font, anchor="mm")
+        dot = max(1, radius // 10)
+        spacing = 3 * dot
+        left = radius - (PIPS[number] - 1) * spacing / 2
+        for i in range(PIPS[number]):
+            x, y = left + i * spacing, radius * 1.55
+            draw.ellipse((x - dot, y - dot, x + dot, y + dot), fill=color)
+        return image
+
+
+_atlases = {}
+_atlases_lock = threading.Lock()
+
+def sprite_atlas(size=HEX_SIZE):
+    atlas = _atlases.get(size)
+    if atlas is None:
+        with _atlases_lock:
+            atlas = _atlases.get(size)
+            if atlas is None:
+                atlas = _atlases[size] = SpriteAtlas(size)
+    return atlas
+
+
+def _tile_fields(tile):
+    """(q, r, terrain, number) of one map_to_new_format tile; raises ValueError if malformed"""
+    if not isinstance(tile, dict):
+        raise ValueError("Each tile must be an object with q, r, terrain and number")
+    q, r, terrain, number = tile.get("q"), tile.get("r"), tile.get("terrain"), tile.get("number")
+    if not all(isinstance(c, int) and not isinstance(c, bool) for c in (q, r)):
+        raise ValueError("Tile q and r must be integers")
+    if not isinstance(terrain, str) or terrain not in TERRAIN_COLORS:
+        raise ValueError(f"Tile terrain must be one of {', '.join(TERRAIN_COLORS)}")
+    if number is not None and (not isinstance(number, int) or isinstance(number, bool) or number not in PIPS):
+        raise ValueError("Tile number must be 2-6, 8-12 or null")
+    return q, r, terrain, number
+
+
+def render_png(tiles, size=HEX_SIZE):
+    """PNG bytes of a board given as the "tiles" list of map_to_new_format
+
+    Raises ValueError for malformed, repeated or too many tiles, and for boards spread too
+    wide to fit MAX_IMAGE_SIDE even at MIN_HEX_SIZE.
+    """
+    if len(tiles) > MAX_RENDER_TILES:
+        raise ValueError(f"A board can have at most {MAX_RENDER_TILES} tiles")
+    tiles = [_tile_fields(tile) for tile in tiles]
+    if not tiles:
+        raise ValueError("A board needs at least one tile")
+    if len({(q, r) for q, r, _, _ in tiles}) != len(tiles):
+        raise ValueError("Each hex may only appear once")
+
+    # Pixel centers in hex widths/heights: x = q + r/2 across, y = 3/4 of a hex height per row
+    xs = [q + r / 2 for q, r, _, _ in tiles]
+    ys = [r for _, r, _, _ in tiles]
+    span_x = max(xs) - min(xs) + 2
+    span_y = (max(ys) - min(ys)) * 0.75 + 1.5
+    fitting_size = int(MAX_IMAGE_SIDE / max(span_x * math.sqrt(3), span_y * 2))
+    if fitting_size < MIN_HEX_SIZE:
+        raise ValueError(f"The board is too spread out to render within {MAX_IMAGE_SIDE} pixels a side")
+    size = min(size, fitting_size)
+    atlas = sprite_atlas(size)
+
+    left = (min(xs) - 1) * atlas.width
+    top = min(ys) * 1.5 * size - size * 1.5
+    image = Image.new("P", (math.ceil(span_x * atlas.width), math.ceil(span_y * atlas.height)), atlas.sea)
+    image.putpalette(atlas.palette)
+    for (q, r, terrain, number), x in zip(tiles, xs):
+        cx = round(x * atlas.width - left)
+        cy = round(r * 1.5 * size - top)
+        sprite, mask = atlas.hexes[terrain]
+        image.paste(sprite, (cx - atlas.width // 2, cy - atlas.height // 2), mask)
+        if number in atlas.tokens:
+            sprite, mask = atlas.tokens[number]
+            image.paste(sprite, (cx - sprite.width // 2, cy - sprite.height // 2), mask)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
@@ -0,0 +1,172 @@
+import random
+import time
+import weakref
+import numpy as np
+from classes import Map, RESOURCE_NAMES, DESERT_CODE, STANDARD_LAYOUT
+from bulk import bulkTables, randomBoards, validBoards
+from solver import EXACT_SEARCH_TILES, SearchBudgetError, constraintViolations, prepareConstraints, solvePrepared
+
+# Axial directions in rotational order; a hex corner sits between two consecutive ones
+ROTATION = [(1, -1, 0), (1, 0, -1), (0, 1, -1), (-1, 1, 0), (-1, 0, 1), (0, -1, 1)]
+
+# Dice combinations (pips) that roll each number; 0 is the desert
+PIPS = np.array([0, 0, 1, 2, 3, 4, 5, 0, 5, 4, 3, 2, 1], dtype=np.int16)
+
+# Candidates the solver produces per scoring round when rejection sampling would find too few
+SOLVER_BATCH_SIZE = 32
+
+# Lower is more balanced; each weight scales one metric of boardMetrics
+DEFAULT_WEIGHTS = {
+    "max_vertex_pips": 1.0,
+    "vertex_pip_std": 1.0,
+    "resource_imbalance": 10.0,
+    "number_spread": 1.0
+}
+
+
+class VertexTable:
+    """Intersections of a layout (where up to three hexes meet), built once per layout"""
+    def __init__(self, layout=STANDARD_LAYOUT):
+        vertices = {}
+        for q, r, s in layout.coordinates:
+            for i in range(6):
+                (dq1, dr1, ds1), (dq2, dr2, ds2) = ROTATION[i], ROTATION[(i + 1) % 6]
+                corner = frozenset([(q, r, s), (q + dq1, r + dr1, s + ds1), (q + dq2, r + dr2, s + ds2)])
+                if corner not in vertices:
+                    vertices[corner] = sorted(layout.coord_to_slot[coord] for coord in corner if coord in layout.coord_to_slot)
+        self.vertices = list(vertices.values())
+        # The three hex coordinates around each vertex, off-layout ones included; two corners
+        # sharing two of them are the ends of one edge
+        self.corners = list(vertices)
+        # (vertices, 3) slot indices; coastal corners are padded with the extra zero-pip column
+        self.vertex_index = np.full((len(self.vertices), 3), len(layout), dtype=np.intp)
+        for vertex, slots in enumerate(self.vertices):
+            self.vertex_index[vertex, :len(slots)] = slots
+
+
+_vertex_tables = weakref.WeakKeyDictionary()
+
+def vertexTable(layout=STANDARD_LAYOUT):
+    table = _vertex_tables.get(layout)
+    if table is None:
+        table = _vertex_tables[layout] = VertexTable(layout)
+    return table
+
+
+def boardMetrics(resources, numbers, layout=STANDARD_LAYOUT):
+    """Balance metrics for (N, slots) resource and number arrays, each as an array over the N boards
+
+    vertex_pips is (N, vertices) and resource_pips is (N, resources); every other metric is (N,).
+    """
+    tables = bulkTables(layout)
+    vertices = vertexTable(layout)
+    pips = PIPS[numbers]
+    padded = np.concatenate([pips, np.zeros((len(pips), 1), dtype=pips.dtype)], axis=1)
+
+    vertex_pips = padded[:, vertices.vertex_index].sum(axis=2)
+    resource_pips = np.stack([(pips * (resources == code)).sum(axis=1) for code in range(len(RESOURCE_NAMES)) if code != DESERT_CODE], axis=1)
+
+    # Each resource's share of the pips against its share of the producing tiles
+    tile_counts = np.array([np.count_nonzero(tables.resources == code) for code in range(len(RESOURCE_NAMES)) if code != DESERT_CODE])
+    total = pips.sum(axis=1, keepdims=True)
+    expected = total * tile_counts / max(tile_counts.sum(), 1)
+    # A board of deserts alone has no pips to share out, so it counts as perfectly even
+    resource_imbalance = np.divide(np.abs(resource_pips - expected).sum(axis=1), total[:, 0],
+                                   out=np.zeros(len(total)), where=total[:, 0] > 0)
+
+    # How evenly pips spread: deviation of each hex's pips plus its neighbors' pips
+    neighborhood = pips + padded[:, tables.neighbor_index].sum(axis=2)
+
+    return {
+        "vertex_pips": vertex_pips,
+        "resource_pips": resource_pips,
+        "max_vertex_pips": vertex_pips.max(axis=1),
+        "vertex_pip_std": vertex_pips.std(axis=1),
+        "resource_imbalance": resource_imbalance,
+        "number_spread": neighborhood.std(axis=1)
+    }
+
+
+def balanceScores(metrics, weights=None):
+    """Weighted sum of the scalar metrics per board; lower is more balanced"""
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    scores = np.zeros(len(metrics["max_vertex_pips"]))
+    for name, weight in weights.items():
+        scores += weight * metrics[name]
+    return scores
+
+
+def scoreMap(map, weights=None):
+    """Balance metrics and score of a single Map as plain Python values"""
+    resources = np.frombuffer(bytes(map.slot_resources), dtype=np.uint8)[None, :]
+    numbers = np.frombuffer(bytes(map.slot_numbers), dtype=np.uint8)[None, :]
+    metrics = boardMetrics(resources, numbers, map.layout)
+    producing = [name for code, name in enumerate(RESOURCE_NAMES) if code != DESERT_CODE]
+    return {
+        "vertex_pips": metrics["vertex_pips"][0].tolist(),
+        "resource_pips": dict(zip(producing, metrics["resource_pips"][0].tolist())),
+        "max_vertex_pips": int(metrics["max_vertex_pips"][0]),
+        "vertex_pip_std": float(metrics["vertex_pip_std"][0]),
+        "resource_imbalance": float(metrics["resource_imbalance"][0]),
+        "number_spread": float(metrics["number_spread"][0]),
+        "balance_score": float(balanceScores(metrics, weights)[0])
+    }
+
+
+def _solverCandidates(pair_groups, no_same_number, no_same_resource, rng, layout, deadline):
+    """Endless batches of solved boards as (resources, numbers) arrays, cut short at the deadline
+
+    A board the solver could not finish before the deadline is left out, so a batch may be empty.
+    The best-scoring candidate is kept, not a random one, so the solver skips uniform sampling.
+    """
+    map = Map(layout)
+    prepared = prepareConstraints(map, pair_groups, no_same_number, no_same_resource)
+    solver_rng = random.Random(int(rng.integers(2 ** 63)))
+    size = len(layout)
+    while True:
+        packed = []
+        while len(packed) < SOLVER_BATCH_SIZE and time.perf_counter() < deadline:
+            solvePrepared(map, prepared, solver_rng, deadline=deadline, uniform=False)
+            if constraintViolations(map, pair_groups, no_same_number, no_same_resource) == 0:
+                packed.append(map.pack())
+        boards = np.frombuffer(b"".join(packed), dtype=np.uint8).reshape(len(packed), 2 * size)
+        yield boards[:, size:], boards[:, :size]
+
+
+def _shuffledCandidates(pair_groups, no_same_number, no_same_resource, rng, batch_size, layout):
+    """Endless batches of shuffled boards, filtered down to the valid ones"""
+    tables = bulkTables(layout)
+    while True:
+        resources, numbers = randomBoards(batch_size, rng, tables)
+        valid = validBoards(resources, numbers, pair_groups, no_same_number, no_same_resource, tables)
+        yield resources[valid], numbers[valid]
+
+
+def bestBalancedBoard(pair_groups=(), no_same_number=False, no_same_resource=False, budget_ms=50, max_candidates=20000, weights=None, rng=None, batch_size=2048, layout=STANDARD_LAYOUT):
+    """Score candidates in vectorized batches until the time budget or candidate cap runs out
+
+    Candidates are rejection-sampled shuffles, except with noResources or on boards over
+    EXACT_SEARCH_TILES tiles, which almost no shuffle satisfies; those come from the solver
+    instead. Returns (map, candidates_scored); raises SearchBudgetError if the budget ran out
+    before any valid candidate turned up.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    deadline = time.perf_counter() + budget_ms / 1000
+    if no_same_resource or len(layout) > EXACT_SEARCH_TILES:
+        batches = _solverCandidates(pair_groups, no_same_number, no_same_resource, rng, layout, deadline)
+    else:
+        batches = _shuffledCandidates(pair_groups, no_same_number, no_same_resource, rng, batch_size, layout)
+
+    best, best_score, scored = None, None, 0
+    for resources, numbers in batches:
+        if len(numbers):
+            scores = balanceScores(boardMetrics(resources, numbers, layout), weights)
+            index = int(scores.argmin())
+            if best_score is None or scores[index] < best_score:
+                best, best_score = (resources[index], numbers[index]), scores[index]
+            scored += len(numbers)
+        if scored >= max_candidates or time.perf_counter() >= deadline:
+            break
+    if best is None:
+        raise SearchBudgetError(f"No valid candidate turned up within {budget_ms} ms; raise budget_ms")
+    return Map(layout).unpack(best[1].tobytes() + best[0].tobytes()), scored
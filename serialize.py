@@ -0,0 +1,90 @@
+import json
+import weakref
+from classes import RESOURCE_NAMES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Resource to terrain mapping
+RESOURCE_TO_TERRAIN = {
+    "Wheat": "field",
+    "Brick": "hill", 
+    "Rock": "mountain",
+    "Sheep": "pasture",
+    "Wood": "forest",
+    "Desert": "desert"
+}
+
+# Neighbor keys of map_to_dict in the sorted order jsonify writes them
+ADJACENT_KEYS = ("BL", "BR", "L", "R", "TL", "TR")
+
+
+def dumps(value):
+    """Compact, key-sorted JSON bytes, matching what jsonify sends"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, separators=(",", ":"), sort_keys=True).encode()
+
+
+def encode_object(fields):
+    """Encode a dict as a JSON object; bytes values are taken as already-encoded JSON"""
+    parts = []
+    for key in sorted(fields):
+        value = fields[key]
+        parts.append(dumps(key) + b":" + (value if isinstance(value, bytes) else dumps(value)))
+    return b"{" + b",".join(parts) + b"}"
+
+
+class LayoutFragments:
+    """The parts of every response that only depend on the layout, encoded once"""
+    def __init__(self, map_obj):
+        layout = map_obj.layout
+        self.numbers = [dumps(number) for number in range(max(map_obj.numbers, default=0) + 1)]
+        self.resources = [dumps(name) for name in RESOURCE_NAMES]
+        self.terrains = [dumps(RESOURCE_TO_TERRAIN.get(name, "desert")) for name in RESOURCE_NAMES]
+
+        # map_to_dict: {"coordinates":...,"numbers":...,"resources":...,"tiles":[...]}
+        self.map_dict_head = (b'{"coordinates":' + dumps(layout.coordinates) + b',"numbers":' + dumps(map_obj.numbers)
+                              + b',"resources":' + dumps(map_obj.resources) + b',"tiles":[')
+        self.map_dict_tiles = []
+        for slot, coordinates in enumerate(layout.coordinates):
+            adjacent = layout.adjacent[slot]
+            neighbors = {key: layout.coordinates[getattr(adjacent, key)] if getattr(adjacent, key) is not None else None for key in ADJACENT_KEYS}
+            self.map_dict_tiles.append(b'{"adjacent":' + dumps(neighbors) + b',"coordinates":' + dumps(coordinates) + b',"number":')
+
+        # map_to_new_format tiles: {"number":...,"q":...,"r":...,"s":...,"terrain":...}
+        self.new_format_tiles = []
+        for q, r, s in layout.coordinates:
+            self.new_format_tiles.append(b',"q":' + dumps(q) + b',"r":' + dumps(r) + b',"s":' + dumps(s) + b',"terrain":')
+
+
+# Weak keys, so a spec-built layout's fragments go once the layout cache drops it
+_fragments = weakref.WeakKeyDictionary()
+
+def layout_fragments(map_obj):
+    fragments = _fragments.get(map_obj.layout)
+    if fragments is None:
+        fragments = _fragments[map_obj.layout] = LayoutFragments(map_obj)
+    return fragments
+
+
+def map_dict_fragment(map_obj):
+    """Encoded JSON of map_to_dict(map_obj)"""
+    fragments = layout_fragments(map_obj)
+    numbers = map_obj.slot_numbers
+    resources = map_obj.slot_resources
+    tiles = [fragments.map_dict_tiles[slot] + fragments.numbers[numbers[slot]] + b',"resource":' + fragments.resources[resources[slot]] + b'}'
+             for slot in range(len(numbers))]
+    return fragments.map_dict_head + b",".join(tiles) + b"]}"
+
+
+def new_format_fields(map_obj):
+    """Fields of map_to_new_format(map_obj), with the tiles array already encoded"""
+    fragments = layout_fragments(map_obj)
+    numbers = map_obj.slot_numbers
+    resources = map_obj.slot_resources
+    tiles = [b'{"number":' + (fragments.numbers[numbers[slot]] if numbers[slot] else b"null") + fragments.new_format_tiles[slot] + fragments.terrains[resources[slot]] + b'}'
+             for slot in range(len(numbers))]
+    return {"tiles": b"[" + b",".join(tiles) + b"]"}
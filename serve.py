@@ -0,0 +1,430 @@
+import asyncio
+import atexit
+import io
+import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.exceptions import HTTPException
+import app as flask_module
+from serialize import encode_object
+from metrics import REGISTRY, REQUESTS_ACTIVE, REQUESTS_REJECTED
+
+# Processes the generation routes are offloaded to, and threads for everything answered in
+# this process (cheap routes, and /generate-batch, whose stream is fed from a thread)
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1))
+SERVE_THREADS = int(os.environ.get('SERVE_THREADS', 16))
+
+# Routes whose whole request runs in a worker process, so a slow solve never blocks the event loop
+OFFLOADED_ROUTES = {
+    '/generate', '/generate-no-pairs', '/generate-custom', '/generate-constrained',
+    '/generate-balanced', '/reroll', '/simulate', '/render/<code>', '/render'
+}
+
+# (requests running at once, requests allowed to wait) per route. A request that finds both
+# full is answered 503 straight away instead of queueing behind work it would time out on.
+# Routes not listed get DEFAULT_LIMIT each.
+ENDPOINT_LIMITS = {
+    '/generate': (SERVE_WORKERS, 8 * SERVE_WORKERS),
+    '/generate-no-pairs': (SERVE_WORKERS, 4 * SERVE_WORKERS),
+    '/generate-custom': (SERVE_WORKERS, 4 * SERVE_WORKERS),
+    '/generate-constrained': (SERVE_WORKERS, 4 * SERVE_WORKERS),
+    '/generate-balanced': (max(1, SERVE_WORKERS // 2), 2 * SERVE_WORKERS),
+    '/generate-batch': (2, 2),
+    '/reroll': (SERVE_WORKERS, 8 * SERVE_WORKERS),
+    '/simulate': (SERVE_WORKERS, 2 * SERVE_WORKERS),
+    '/render/<code>': (SERVE_WORKERS, 8 * SERVE_WORKERS),
+    '/render': (SERVE_WORKERS, 4 * SERVE_WORKERS)
+}
+DEFAULT_LIMIT = (SERVE_THREADS, 4 * SERVE_THREADS)
+
+# Weight of the newest request in each route's moving average service time, used for Retry-After
+SERVICE_TIME_SMOOTHING = 0.2
+
+# How long shutdown waits for in-flight requests, and the Retry-After sent while it does
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', 30))
+SHUTDOWN_RETRY_AFTER = 5
+
+# Chunks of a streamed response buffered ahead of a slow client before the producing thread waits
+STREAM_BUFFER_CHUNKS = 64
+
+
+class EndpointLimiter:
+    """At most `concurrency` requests of one route at once, with up to `queue_depth` more waiting
+
+    Only touched from the event loop, so it needs no lock. Waiters are served in arrival order.
+    """
+    def __init__(self, endpoint, concurrency, queue_depth):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.running = 0
+        self.waiting = deque()
+        self.service_seconds = None
+
+    async def acquire(self):
+        """Take a slot, waiting for one if the queue has room; returns False if it does not"""
+        if self.running < self.concurrency and not self.waiting:
+            self.running += 1
+            self._report()
+            return True
+        if len(self.waiting) >= self.queue_depth:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting.append(waiter)
+        self._report()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A slot handed over just as the client went away is passed on to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self._hand_over()
+            else:
+                self.waiting.remove(waiter)
+                self._report()
+            raise
+        return True
+
+    def release(self, seconds):
+        if self.service_seconds is None:
+            self.service_seconds = seconds
+        else:
+            self.service_seconds += SERVICE_TIME_SMOOTHING * (seconds - self.service_seconds)
+        self._hand_over()
+
+    def _hand_over(self):
+        while self.waiting:
+            waiter = self.waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._report()
+                return
+        self.running -= 1
+        self._report()
+
+    def retry_after(self):
+        """Whole seconds until the queue ahead of a new request has likely drained"""
+        service_seconds = self.service_seconds or 1.0
+        return max(1, math.ceil(service_seconds * (len(self.waiting) + 1) / self.concurrency))
+
+    def _report(self):
+        REQUESTS_ACTIVE.set(self.running, endpoint=self.endpoint, state="running")
+        REQUESTS_ACTIVE.set(len(self.waiting), endpoint=self.endpoint, state="queued")
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI http scope, without the streams so it can be pickled to a worker"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _start_wsgi(environ, body):
+    """Call the Flask app; returns ([status, headers], body iterable)"""
+    environ = dict(environ, **{'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr})
+    started = []
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+    chunks = flask_module.app(environ, start_response)
+    return started, chunks
+
+
+def call_wsgi(environ, body):
+    """Run one request through the Flask app in a worker process
+
+    Returns (status, headers, body, pid, metrics), where metrics is the worker's registry
+    snapshot taken after the request, for the front process to absorb.
+    """
+    started, chunks = _start_wsgi(environ, body)
+    try:
+        content = b"".join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    status, headers = started
+    flask_module.refresh_stat_gauges()
+    return int(status.split(' ', 1)[0]), headers, content, os.getpid(), REGISTRY.snapshot()
+
+
+def _init_worker():
+    # Each worker imports its own app, with its own pool and archive writer threads; both are
+    # daemons, so without this the archive's queued boards would die with the worker
+    atexit.register(_stop_worker)
+
+
+def _stop_worker():
+    flask_module.board_pool.stop()
+    if flask_module.board_archive is not None:
+        flask_module.board_archive.stop()
+
+
+def _warm_worker():
+    return os.getpid()
+
+
+def _error_response(status, message, retry_after=None):
+    headers = [(b'content-type', b'application/json')]
+    if retry_after is not None:
+        headers.append((b'retry-after', str(retry_after).encode()))
+    body = encode_object({"success": False, "error": message})
+    return status, headers, body
+
+
+class ServingApp:
+    """ASGI front end for the Flask app: connections on an event loop, generation in a process pool
+
+    Each route passes through its EndpointLimiter first; a saturated route answers 503 with
+    Retry-After. On lifespan shutdown new requests are refused, in-flight ones get up to
+    SHUTDOWN_GRACE_SECONDS to finish, then the pools and the board archive are stopped. Each
+    worker has its own board pool, caches and archive writer; it stops them as it exits, and
+    its metrics reach this process's /metrics with every response it returns.
+    """
+    def __init__(self, workers=SERVE_WORKERS, threads=SERVE_THREADS, limits=ENDPOINT_LIMITS, default_limit=DEFAULT_LIMIT):
+        self.workers = workers
+        self.threads = threads
+        self.limits = limits
+        self.default_limit = default_limit
+        self.limiters = {}
+        self.processes = None
+        self.thread_pool = None
+        self.in_flight = 0
+        self.draining = False
+        self.drained = None
+        self.urls = flask_module.app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _pools(self):
+        if self.processes is None:
+            # spawn rather than fork: this process runs threads (pool refill, archive writer)
+            self.processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='serve')
+        return self.processes, self.thread_pool
+
+    async def startup(self):
+        """Start the workers and wait for them to import the app, so the first requests are not slow"""
+        processes, _ = self._pools()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(processes, _warm_worker) for _ in range(self.workers)))
+
+    async def shutdown(self):
+        """Refuse new requests, wait for in-flight ones, then stop every background worker"""
+        self.draining = True
+        if self.in_flight:
+            self.drained = asyncio.Event()
+            try:
+                await asyncio.wait_for(self.drained.wait(), SHUTDOWN_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._stop)
+
+    def _stop(self):
+        if self.processes is not None:
+            self.processes.shutdown(wait=True, cancel_futures=True)
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown(wait=True, cancel_futures=True)
+        if flask_module.batch_executor is not None:
+            flask_module.batch_executor.shutdown(wait=True, cancel_futures=True)
+        flask_module.board_pool.stop()
+        if flask_module.board_archive is not None:
+            flask_module.board_archive.stop()
+
+    def _route(self, scope):
+        try:
+            rule, _ = self.urls.match(scope['path'], method=scope['method'], return_rule=True)
+        except HTTPException:
+            # Flask answers these itself (404, 405, redirects)
+            return 'unmatched'
+        return rule.rule
+
+    def _limiter(self, route):
+        limiter = self.limiters.get(route)
+        if limiter is None:
+            concurrency, queue_depth = self.limits.get(route, self.default_limit)
+            limiter = self.limiters[route] = EndpointLimiter(route, concurrency, queue_depth)
+        return limiter
+
+    async def _http(self, scope, receive, send):
+        route = self._route(scope)
+        if self.draining:
+            REQUESTS_REJECTED.inc(endpoint=route, reason="shutdown")
+            await self._send(send, *_error_response(503, "The server is shutting down", SHUTDOWN_RETRY_AFTER))
+            return
+
+        limiter = self._limiter(route)
+        self.in_flight += 1
+        try:
+            if not await limiter.acquire():
+                REQUESTS_REJECTED.inc(endpoint=route, reason="saturated")
+                await self._send(send, *_error_response(503, f"Too many {route} requests in progress; retry later", limiter.retry_after()))
+                return
+            start = time.perf_counter()
+            try:
+                body = await self._read_body(receive)
+                if body is None:
+                    return
+                environ = wsgi_environ(scope, body)
+                if route in OFFLOADED_ROUTES:
+                    await self._offload(route, environ, body, send)
+                else:
+                    await self._stream(environ, body, receive, send)
+            finally:
+                limiter.release(time.perf_counter() - start)
+        finally:
+            self.in_flight -= 1
+            if self.draining and not self.in_flight and self.drained is not None:
+                self.drained.set()
+
+    async def _read_body(self, receive):
+        """The whole request body, or None if the client disconnected first"""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b"".join(chunks)
+
+    async def _offload(self, route, environ, body, send):
+        processes, _ = self._pools()
+        try:
+            status, headers, content, pid, snapshot = await asyncio.get_running_loop().run_in_executor(processes, call_wsgi, environ, body)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next request
+            processes.shutdown(wait=False)
+            self.processes = None
+            REQUESTS_REJECTED.inc(endpoint=route, reason="worker_lost")
+            await self._send(send, *_error_response(503, "A generation worker stopped unexpectedly; retry the request", 1))
+            return
+        # The worker counted the request itself; its snapshot carries that over to /metrics here
+        REGISTRY.absorb(pid, snapshot)
+        await self._send(send, status, [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers], content)
+
+    async def _stream(self, environ, body, receive, send):
+        """Run the request in a thread and pass its chunks on as they are produced
+
+        The whole WSGI call stays on one thread (Flask's stream_with_context needs that). The
+        bounded queue makes the thread wait for a slow client, and a disconnect stops it.
+        """
+        loop = asyncio.get_running_loop()
+        _, thread_pool = self._pools()
+        queue = asyncio.Queue(STREAM_BUFFER_CHUNKS)
+        disconnected = False
+        done = object()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            try:
+                started, chunks = _start_wsgi(environ, body)
+                put(started)
+                try:
+                    for chunk in chunks:
+                        if disconnected:
+                            break
+                        if chunk:
+                            put(chunk)
+                finally:
+                    if hasattr(chunks, 'close'):
+                        chunks.close()
+            finally:
+                put(done)
+
+        async def watch_disconnect():
+            nonlocal disconnected
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected = True
+
+        producer = loop.run_in_executor(thread_pool, produce)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            started = await queue.get()
+            if started is done:
+                # The app raised before starting a response; re-raise it for the server to log
+                await producer
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            })
+            while (chunk := await queue.get()) is not done:
+                if not disconnected:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected = True
+            watcher.cancel()
+            # Keep draining so the producer is never left blocked on a full queue
+            while not producer.done():
+                try:
+                    await asyncio.wait_for(queue.get(), 0.1)
+                except asyncio.TimeoutError:
+                    pass
+            await producer
+
+    async def _send(self, send, status, headers, body):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+application = ServingApp()
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(
+        'serve:application',
+        host='0.0.0.0',
+        port=int(os.environ.get('PORT', 5000)),
+        timeout_graceful_shutdown=SHUTDOWN_GRACE_SECONDS
+    )
@@ -0,0 +1,148 @@
+import numpy as np
+from classes import Map, RESOURCE_NAMES, DESERT_CODE, STANDARD_LAYOUT
+from scoring import vertexTable
+
+# Totals of two dice, and the exact chance of rolling each one
+ROLLS = np.arange(2, 13)
+ROLL_PROBABILITIES = np.array([1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1]) / 36
+
+# Resources a hex can produce, in the order of the income arrays' last axis
+PRODUCING = tuple(code for code in range(len(RESOURCE_NAMES)) if code != DESERT_CODE)
+
+# Rolls per game when none is given; a game is the unit the income distribution is over
+DEFAULT_TURNS = 60
+
+# Income array elements (boards x games x seats x resources) built per step of simulateIncome
+SIMULATION_CHUNK_ELEMENTS = 1 << 22
+
+# Most histogram elements (boards x seats x income totals) simulateIncome will allocate
+MAX_HISTOGRAM_ELEMENTS = 1 << 24
+
+# Percentiles of each seat's total income per game reported by simulateIncome
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def boardArrays(boards, layout=STANDARD_LAYOUT):
+    """(N, slots) resource and number arrays for a Map, a list of Maps, or packed rows
+
+    Packed rows are Map.pack() bytes, or an (N, 2 * slots) uint8 array of them (numbers first).
+    """
+    if isinstance(boards, Map):
+        boards = [boards]
+    if isinstance(boards, list) and all(isinstance(board, Map) for board in boards):
+        layout = boards[0].layout if boards else layout
+        boards = [board.pack() for board in boards]
+    if isinstance(boards, (bytes, bytearray)):
+        boards = [boards]
+    size = len(layout)
+    if isinstance(boards, list):
+        boards = np.frombuffer(b"".join(boards), dtype=np.uint8)
+    packed = np.asarray(boards, dtype=np.uint8).reshape(-1, 2 * size)
+    return packed[:, size:], packed[:, :size]
+
+
+def seatWeights(layout, seats):
+    """(seats, slots) income each seat takes from a hex per production: 1 per settlement, 2 per city
+
+    A seat is a list of (corner, city) settlements. The corner is a vertex index of
+    vertexTable(layout) or the slots of the hexes meeting there. Raises ValueError for any
+    other corner, and for corners already built on or next to another settlement of any seat.
+    """
+    table = vertexTable(layout)
+    indices = {frozenset(slots): vertex for vertex, slots in enumerate(table.vertices)}
+    weights = np.zeros((len(seats), len(layout)), dtype=np.int64)
+    built = set()
+    for seat, settlements in enumerate(seats):
+        for corner, city in settlements:
+            if isinstance(corner, int):
+                if not 0 <= corner < len(table.vertices):
+                    raise ValueError(f"Vertex {corner} is not on the {layout.name} layout")
+                vertex = corner
+            else:
+                vertex = indices.get(frozenset(corner))
+                if vertex is None:
+                    raise ValueError(f"Hexes {[layout.coordinates[slot] for slot in sorted(corner)]} do not meet at a corner of the {layout.name} layout")
+            if vertex in built:
+                raise ValueError(f"Vertex {vertex} already has a settlement")
+            for other in built:
+                if len(table.corners[vertex] & table.corners[other]) == 2:
+                    raise ValueError(f"Vertex {vertex} is next to the settlement on vertex {other}")
+            built.add(vertex)
+            weights[seat, table.vertices[vertex]] += 2 if city else 1
+    return weights
+
+
+def incomeTables(resources, numbers, weights):
+    """(N, rolls, seats, resources) income each seat collects when each total 2-12 is rolled"""
+    rolled = (numbers[:, :, None] == ROLLS).astype(np.float64)
+    produced = (resources[:, :, None] == np.array(PRODUCING)).astype(np.float64)
+    return np.einsum('bhd,sh,bhr->bdsr', rolled, weights.astype(np.float64), produced, optimize=True)
+
+
+def expectedIncome(resources, numbers, weights, turns=DEFAULT_TURNS):
+    """Exact mean and variance of each seat's income over `turns` rolls, from the dice probabilities
+
+    Rolls are independent, so both are `turns` times those of a single roll. Returns
+    "mean"/"variance" as (N, seats, resources) and "total_mean"/"total_variance" as (N, seats).
+    """
+    tables = incomeTables(resources, numbers, weights)
+    totals = tables.sum(axis=3)
+
+    def moments(values):
+        mean = np.tensordot(ROLL_PROBABILITIES, values, axes=(0, 1))
+        return turns * mean, turns * (np.tensordot(ROLL_PROBABILITIES, values ** 2, axes=(0, 1)) - mean ** 2)
+
+    mean, variance = moments(tables)
+    total_mean, total_variance = moments(totals)
+    return {"mean": mean, "variance": variance, "total_mean": total_mean, "total_variance": total_variance}
+
+
+def simulateIncome(resources, numbers, weights, rolls, turns=DEFAULT_TURNS, rng=None):
+    """Monte Carlo income per seat over rolls // turns games of `turns` rolls each
+
+    A seat's income only depends on how often each total comes up, so every game draws its
+    eleven roll counts at once from the multinomial of `turns` 2d6 rolls; all boards share
+    the same games. Returns expectedIncome's keys measured over the games, plus "histogram"
+    (N, seats, most income + 1) counting games by total income, "percentiles" (N, seats,
+    len(PERCENTILES)) of that total, and "games". Raises ValueError if the histograms would
+    hold more than MAX_HISTOGRAM_ELEMENTS counts.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    tables = incomeTables(resources, numbers, weights)
+    boards, _, seats, kinds = tables.shape
+    games = max(1, rolls // turns)
+    # Income per game is whole cards, so totals can be counted exactly in a histogram
+    bins = turns * int(tables.sum(axis=3).max(initial=0)) + 1
+    if boards * seats * bins > MAX_HISTOGRAM_ELEMENTS:
+        raise ValueError(f"The income histograms would need {boards * seats * bins} counts, more than {MAX_HISTOGRAM_ELEMENTS}; pass fewer boards, seats or turns")
+
+    sums = np.zeros((boards, seats, kinds))
+    squares = np.zeros((boards, seats, kinds))
+    histogram = np.zeros(boards * seats * bins, dtype=np.int64)
+    offsets = (np.arange(boards * seats) * bins).reshape(boards, 1, seats)
+    chunk = max(1, SIMULATION_CHUNK_ELEMENTS // (boards * seats * kinds))
+    for start in range(0, games, chunk):
+        counts = rng.multinomial(turns, ROLL_PROBABILITIES, size=min(chunk, games - start)).astype(np.float64)
+        income = np.einsum('gd,bdsr->bgsr', counts, tables, optimize=True)
+        sums += income.sum(axis=1)
+        squares += (income ** 2).sum(axis=1)
+        totals = income.sum(axis=3).astype(np.int64)
+        histogram += np.bincount((totals + offsets).ravel(), minlength=len(histogram))
+
+    histogram = histogram.reshape(boards, seats, bins)
+    mean = sums / games
+    total_counts = np.arange(bins)
+    total_mean = (histogram * total_counts).sum(axis=2) / games
+    total_variance = (histogram * total_counts ** 2).sum(axis=2) / games - total_mean ** 2
+    # Smallest total whose cumulative share of games reaches each percentile
+    cumulative = histogram.cumsum(axis=2)
+    percentiles = np.stack([(cumulative < games * p / 100).sum(axis=2) for p in PERCENTILES], axis=2)
+    return {
+        "mean": mean,
+        "variance": squares / games - mean ** 2,
+        "total_mean": total_mean,
+        "total_variance": total_variance,
+        "histogram": histogram,
+        "percentiles": percentiles,
+        "games": games
+    }
@@ -0,0 +1,581 @@
+import random
+import time
+import numpy as np
+from classes import RESOURCE_CODES, RESOURCE_NAMES
+from metrics import SOLVE_SECONDS, SOLVER_STEPS
+
+DESERT = RESOURCE_CODES["Desert"]
+
+# Number groups that may not sit next to each other for each named constraint
+CONSTRAINT_PAIRS = {
+    "eightSix": [6, 8],
+    "twoTwelve": [2, 12]
+}
+
+# Every constraint name /generate-constrained and namedConstraints understand
+CONSTRAINT_NAMES = (*CONSTRAINT_PAIRS, "noResources", "noTwoNumber")
+
+# Search steps allowed per board before giving up
+MAX_NODES = 20000
+
+# Shuffles tried by exact rejection sampling before the backtracking search takes over, drawn
+# in vectorized batches that start at UNIFORM_FIRST_BATCH and double up to UNIFORM_MAX_BATCH
+UNIFORM_DRAWS = 1 << 18
+UNIFORM_FIRST_BATCH = 64
+UNIFORM_MAX_BATCH = 8192
+
+# Tries after which rejection sampling stops if a stage (resources, then numbers) has not passed
+# once yet; a stage that rare leaves little chance of a board within UNIFORM_DRAWS
+UNIFORM_PROBE_DRAWS = 1 << 14
+
+# Search steps in the first randomized restart; each later restart gets twice as many
+RESTART_NODES = 100
+
+# Boards with more tiles than this are dealt at random and then repaired by swaps, since
+# one backtracking search over the whole board stops scaling (see _repair); by 60 tiles it
+# already runs out of steps on a few boards in a hundred
+EXACT_SEARCH_TILES = 40
+
+# Repair steps allowed per tile on large boards, when that is more than max_nodes
+REPAIR_STEPS_PER_TILE = 50
+
+# Random swap partners weighed per repair step
+REPAIR_CANDIDATES = 12
+
+# Chance of taking the least bad swap when every candidate adds conflicts
+REPAIR_NOISE = 0.1
+
+
+class InfeasibleBoardError(Exception):
+    """Raised when no board can satisfy the requested constraints"""
+
+
+class SearchBudgetError(InfeasibleBoardError):
+    """Raised when the search ran out of steps; a valid board may still exist"""
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+class _RestartLimit(Exception):
+    pass
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class _SearchState:
+    """Step limits and deadline for solving one board, plus the deepest partial assignment reached"""
+    __slots__ = ("nodes_left", "restart_left", "deadline", "best_depth", "best_assignment", "best_counts")
+
+    def __init__(self, max_nodes, deadline=None):
+        self.nodes_left = max_nodes
+        self.restart_left = 0
+        self.deadline = deadline
+        self.best_depth = -1
+        self.best_assignment = None
+        self.best_counts = None
+
+
+def deadlineAfter(budget_ms):
+    """perf_counter() value `budget_ms` from now, or None for no deadline"""
+    if budget_ms is None:
+        return None
+    return time.perf_counter() + budget_ms / 1000
+
+
+def numberConflicts(pair_groups, no_same_number=False, numbers=()):
+    """Set of (a, b) number pairs that may not be placed on adjacent tiles"""
+    conflicts = set()
+    for group in pair_groups:
+        for a in group:
+            for b in group:
+                conflicts.add((a, b))
+    if no_same_number:
+        for number in numbers:
+            conflicts.add((number, number))
+    return conflicts
+
+
+def resourceConflicts(no_same_resource=False):
+    """Set of (a, b) resource code pairs that may not be placed on adjacent tiles"""
+    if not no_same_resource:
+        return set()
+    return {(code, code) for code in range(len(RESOURCE_NAMES))}
+
+
+def _valueOrder(counts, rng):
+    # Shuffle with multiplicity so each value comes first as often as a plain shuffle would pick it
+    pool = [value for value, count in counts.items() for _ in range(count)]
+    rng.shuffle(pool)
+    return list(dict.fromkeys(pool))
+
+
+def _fits(slot, value, assignment, neighbors, conflicts, banned):
+    if (slot, value) in banned:
+        return False
+    for n in neighbors[slot]:
+        if assignment[n] is not None and (value, assignment[n]) in conflicts:
+            return False
+    return True
+
+
+def _hasOption(slot, assignment, counts, neighbors, conflicts, banned):
+    for value, count in counts.items():
+        if count and _fits(slot, value, assignment, neighbors, conflicts, banned):
+            return True
+    return False
+
+
+def _search(order, depth, assignment, counts, neighbors, conflicts, banned, rng, state):
+    """Assign order[depth:] slot by slot, forward checking the neighbors of each placement"""
+    if depth == len(order):
+        return True
+    state.nodes_left -= 1
+    state.restart_left -= 1
+    if state.nodes_left < 0:
+        raise _BudgetExhausted()
+    if state.deadline is not None and time.perf_counter() >= state.deadline:
+        raise _OutOfTime()
+    if state.restart_left < 0:
+        raise _RestartLimit()
+    if depth > state.best_depth:
+        state.best_depth = depth
+        state.best_assignment = assignment[:]
+        state.best_counts = dict(counts)
+
+    slot = order[depth]
+    for value in _valueOrder(counts, rng):
+        if not _fits(slot, value, assignment, neighbors, conflicts, banned):
+            continue
+        assignment[slot] = value
+        counts[value] -= 1
+        if all(assignment[n] is not None or _hasOption(n, assignment, counts, neighbors, conflicts, banned) for n in neighbors[slot]):
+            if _search(order, depth + 1, assignment, counts, neighbors, conflicts, banned, rng, state):
+                return True
+        counts[value] += 1
+        assignment[slot] = None
+    return False
+
+
+def _solve(layout, slots, values, conflicts, rng, state, fixed=None, banned=()):
+    """Place the multiset `values` on `slots`, or return None if it cannot be done
+
+    `fixed` pre-assigns slot values outside `slots`, and `banned` holds (slot, value) pairs to skip.
+    Unlucky early choices are cut off by restarting with a doubled step limit, so only a
+    search that runs to completion counts as proof that no placement exists.
+    """
+    restart_nodes = RESTART_NODES
+    banned = set(banned)
+    state.best_depth = -1
+    while True:
+        assignment = [None] * len(layout)
+        for slot, value in (fixed or {}).items():
+            assignment[slot] = value
+        counts = {}
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+        if state.best_assignment is None or state.best_depth < 0:
+            state.best_assignment, state.best_counts = assignment[:], dict(counts)
+        state.restart_left = restart_nodes
+        try:
+            if _search(list(slots), 0, assignment, counts, layout.neighbors, conflicts, banned, rng, state):
+                return assignment
+            return None
+        except _RestartLimit:
+            restart_nodes *= 2
+
+
+def _completeGreedily(assignment, counts, slots, neighbors, conflicts, banned, rng):
+    """Fill the unassigned `slots` in order, each with the remaining value that conflicts least"""
+    for slot in slots:
+        if assignment[slot] is not None:
+            continue
+        value = min(_valueOrder(counts, rng), key=lambda value: (
+            (slot, value) in banned,
+            sum(1 for n in neighbors[slot] if assignment[n] is not None and (value, assignment[n]) in conflicts)
+        ))
+        assignment[slot] = value
+        counts[value] -= 1
+    return assignment
+
+
+class _ConflictedSlots:
+    """Set of slots with at least one conflict that can also hand out a random member in O(1)"""
+    __slots__ = ("slots", "position")
+
+    def __init__(self):
+        self.slots = []
+        self.position = {}
+
+    def update(self, slot, conflicted):
+        if conflicted and slot not in self.position:
+            self.position[slot] = len(self.slots)
+            self.slots.append(slot)
+        elif not conflicted and slot in self.position:
+            # Move the last slot into the hole so removal stays O(1)
+            index = self.position.pop(slot)
+            last = self.slots.pop()
+            if last != slot:
+                self.slots[index] = last
+                self.position[last] = index
+
+    def __len__(self):
+        return len(self.slots)
+
+
+def _repair(layout, values, slots, conflicts, rng, state, banned=()):
+    """Swap values between `slots` until no two neighbors hold a pair in `conflicts`
+
+    Min-conflicts local search: each step takes a random conflicted slot and swaps it with
+    the best of a few random partners, so a step costs O(degree) however big the board is.
+    Swaps that would put a (slot, value) pair of `banned` on the board are skipped.
+    Raises _BudgetExhausted or _OutOfTime with `values` left at the board reached so far.
+    """
+    neighbors = layout.neighbors
+
+    def conflictsAt(slot, value, skip=None):
+        return sum(1 for n in neighbors[slot] if n != skip and (value, values[n]) in conflicts)
+
+    # Neighbors outside `slots` can be in conflict too, but only `slots` may be picked to move
+    movable = set(slots)
+    conflicted = _ConflictedSlots()
+    for slot in slots:
+        conflicted.update(slot, conflictsAt(slot, values[slot]) > 0)
+    while len(conflicted):
+        state.nodes_left -= 1
+        if state.nodes_left < 0:
+            raise _BudgetExhausted()
+        if state.deadline is not None and time.perf_counter() >= state.deadline:
+            raise _OutOfTime()
+
+        a = conflicted.slots[rng.randrange(len(conflicted))]
+        best, best_delta = None, None
+        for _ in range(REPAIR_CANDIDATES):
+            b = slots[rng.randrange(len(slots))]
+            if values[b] == values[a] or (a, values[b]) in banned or (b, values[a]) in banned:
+                continue
+            delta = (conflictsAt(a, values[b], b) + conflictsAt(b, values[a], a)
+                     - conflictsAt(a, values[a], b) - conflictsAt(b, values[b], a))
+            if best_delta is None or delta < best_delta:
+                best, best_delta = b, delta
+        if best is None or (best_delta > 0 and rng.random() >= REPAIR_NOISE):
+            continue
+
+        values[a], values[best] = values[best], values[a]
+        for slot in (a, best, *neighbors[a], *neighbors[best]):
+            if slot in movable:
+                conflicted.update(slot, conflictsAt(slot, values[slot]) > 0)
+    return values
+
+
+def _dealResources(layout, resource_codes, rng, fixed, banned):
+    """Resources shuffled onto the slots not in `fixed`, then swapped off any `banned` placement"""
+    shuffled = list(resource_codes)
+    rng.shuffle(shuffled)
+    resources = [None] * len(layout)
+    for slot, code in fixed.items():
+        resources[slot] = code
+    free = [slot for slot in range(len(layout)) if slot not in fixed]
+    for slot, code in zip(free, shuffled):
+        resources[slot] = code
+    for slot in free:
+        if (slot, resources[slot]) not in banned:
+            continue
+        other = next((other for other in free if (slot, resources[other]) not in banned and (other, resources[slot]) not in banned), None)
+        if other is None:
+            raise InfeasibleBoardError("No board satisfies the requested constraints")
+        resources[slot], resources[other] = resources[other], resources[slot]
+    return resources
+
+
+def _dealNumbers(layout, resources, number_values, rng, fixed=None):
+    """Numbers shuffled onto the non-desert slots not in `fixed`, with 0 on the deserts"""
+    fixed = fixed or {}
+    shuffled = list(number_values)
+    rng.shuffle(shuffled)
+    numbers = [0] * len(layout)
+    for slot, number in fixed.items():
+        numbers[slot] = number
+    for slot, number in zip((slot for slot, code in enumerate(resources) if code != DESERT and slot not in fixed), shuffled):
+        numbers[slot] = number
+    return numbers
+
+
+def _solveByRepair(layout, number_values, resource_codes, number_conflicts, resource_conflicts, rng, state, locked=({}, {}, set())):
+    """Large-board counterpart of the search in solvePrepared: deal at random, then repair
+
+    Resources are repaired first, then numbers are dealt to the non-desert slots and
+    repaired; the values and slots of `locked` (see _lockedPlacement) never move. Returns
+    (resources, numbers). With a deadline, running out of steps or time returns the board
+    reached so far instead of raising.
+    """
+    fixed_resources, fixed_numbers, no_desert = locked
+    banned = {(slot, DESERT) for slot in no_desert}
+    resources = _dealResources(layout, resource_codes, rng, fixed_resources, banned)
+    numbers = None
+    try:
+        _repair(layout, resources, [slot for slot in range(len(layout)) if slot not in fixed_resources], resource_conflicts, rng, state, banned)
+        numbers = _dealNumbers(layout, resources, number_values, rng, fixed_numbers)
+        _repair(layout, numbers, [slot for slot, number in enumerate(numbers) if number and slot not in fixed_numbers], number_conflicts, rng, state)
+    except (_BudgetExhausted, _OutOfTime):
+        if state.deadline is None:
+            raise
+        if numbers is None:
+            numbers = _dealNumbers(layout, resources, number_values, rng, fixed_numbers)
+    return resources, numbers
+
+
+def _conflictTable(conflicts, values):
+    """Boolean lookup table [a, b] of the pairs in `conflicts`, sized for every value in `values`"""
+    size = max([*values, *(value for pair in conflicts for value in pair), 0]) + 1
+    table = np.zeros((size, size), dtype=bool)
+    for a, b in conflicts:
+        table[a, b] = table[b, a] = True
+    return table
+
+
+def _sampleUniform(layout, resource_codes, number_values, number_conflicts, resource_conflicts, locked, rng, state):
+    """Exactly uniform valid board by rejection: (resources, numbers) lists, or None if none turned up
+
+    Batches of shuffles of the free values onto the free slots (see _lockedPlacement) are
+    checked edge by edge, and the first valid one is kept. Every shuffle is equally likely, so
+    the kept board is uniform over the valid boards. Gives up after UNIFORM_DRAWS shuffles, at
+    the deadline, or early when a stage looks hopeless (see UNIFORM_PROBE_DRAWS).
+    """
+    fixed_resources, fixed_numbers, no_desert = locked
+    size = len(layout)
+    edges = np.array(layout.edges, dtype=np.intp).reshape(-1, 2)
+    resource_table = _conflictTable(resource_conflicts, [*resource_codes, *fixed_resources.values()])
+    number_table = _conflictTable(number_conflicts, [*number_values, *fixed_numbers.values()])
+    free_resource_slots = np.array([slot for slot in range(size) if slot not in fixed_resources], dtype=np.intp)
+    no_desert_slots = np.array(sorted(no_desert), dtype=np.intp)
+    base_resources = np.zeros(size, dtype=np.uint8)
+    base_numbers = np.zeros(size, dtype=np.uint8)
+    free_numbers = np.ones(size, dtype=bool)
+    for slot, code in fixed_resources.items():
+        base_resources[slot] = code
+    for slot, number in fixed_numbers.items():
+        base_numbers[slot] = number
+        free_numbers[slot] = False
+    resource_values = np.array(resource_codes, dtype=np.uint8)
+    number_array = np.array(number_values, dtype=np.uint8)
+    generator = np.random.default_rng(rng.getrandbits(64))
+
+    drawn, resource_hits, number_tries, batch = 0, 0, 0, UNIFORM_FIRST_BATCH
+    while drawn < UNIFORM_DRAWS:
+        if state.deadline is not None and time.perf_counter() >= state.deadline:
+            return None
+        if (drawn >= UNIFORM_PROBE_DRAWS and not resource_hits) or number_tries >= UNIFORM_PROBE_DRAWS:
+            return None
+        drawn += batch
+        resources = np.tile(base_resources, (batch, 1))
+        resources[:, free_resource_slots] = generator.permuted(np.tile(resource_values, (batch, 1)), axis=1)
+        if len(no_desert_slots):
+            resources = resources[~(resources[:, no_desert_slots] == DESERT).any(axis=1)]
+        if resource_conflicts:
+            resources = resources[~resource_table[resources[:, edges[:, 0]], resources[:, edges[:, 1]]].any(axis=1)]
+        resource_hits += len(resources)
+        number_tries += len(resources)
+        if len(resources):
+            # Every row left has the same number of open non-desert slots, so the numbers deal row by row
+            numbers = np.tile(base_numbers, (len(resources), 1))
+            numbers[(resources != DESERT) & free_numbers] = generator.permuted(np.tile(number_array, (len(resources), 1)), axis=1).ravel()
+            valid = ~number_table[numbers[:, edges[:, 0]], numbers[:, edges[:, 1]]].any(axis=1)
+            hits = np.flatnonzero(valid)
+            if len(hits):
+                return resources[hits[0]].tolist(), numbers[hits[0]].tolist()
+        batch = min(2 * batch, UNIFORM_MAX_BATCH)
+    return None
+
+
+def _lockedPlacement(locked):
+    """(fixed resources, fixed numbers, slots that may not become deserts) for solvePrepared's `locked`
+
+    A locked number decides whether its slot is a desert (0) or not, and a locked desert
+    keeps its 0, so each attribute's lock is extended to cover that.
+    """
+    fixed_resources, fixed_numbers = (dict(values) for values in locked or ({}, {}))
+    no_desert = set()
+    for slot, number in fixed_numbers.items():
+        if number == 0:
+            fixed_resources[slot] = DESERT
+        else:
+            no_desert.add(slot)
+    for slot, code in fixed_resources.items():
+        if code == DESERT:
+            fixed_numbers[slot] = 0
+    return fixed_resources, fixed_numbers, no_desert
+
+
+def _without(values, removed):
+    """`values` in order with one occurrence of each of `removed` taken out"""
+    counts = {}
+    for value in removed:
+        counts[value] = counts.get(value, 0) + 1
+    remaining = []
+    for value in values:
+        if counts.get(value):
+            counts[value] -= 1
+        else:
+            remaining.append(value)
+    if any(counts.values()):
+        raise ValueError("Locked values are not part of this layout's tiles")
+    return remaining
+
+
+def constraintLabel(pair_groups=(), no_same_number=False, no_same_resource=False):
+    """Short name for a constraint set, used as a metrics label; unnamed pair groups share one name"""
+    names = {tuple(sorted(group)): name for name, group in CONSTRAINT_PAIRS.items()}
+    parts = sorted({names.get(tuple(sorted(group)), "customPairs") for group in pair_groups})
+    if no_same_resource:
+        parts.append("noResources")
+    if no_same_number:
+        parts.append("noTwoNumber")
+    return "+".join(parts) or "none"
+
+
+def prepareConstraints(map, pair_groups=(), no_same_number=False, no_same_resource=False):
+    """Precompute everything solvePrepared needs, so a batch can build it once for many boards"""
+    number_conflicts = numberConflicts(pair_groups, no_same_number, map.numbers)
+    resource_conflicts = resourceConflicts(no_same_resource)
+    resource_codes = [RESOURCE_CODES[resource] for resource in map.resources]
+    label = constraintLabel(pair_groups, no_same_number, no_same_resource)
+    return number_conflicts, resource_conflicts, resource_codes, label
+
+
+def solvePrepared(map, prepared, rng=random, max_nodes=MAX_NODES, deadline=None, locked=None, uniform=True):
+    """solveBoard with constraints already built by prepareConstraints
+
+    Boards up to EXACT_SEARCH_TILES tiles are first drawn by exact rejection sampling (see
+    _sampleUniform), which is uniform over the valid boards; uniform=False skips it. Only when
+    that finds nothing does the backtracking search run; its boards are valid but not uniform,
+    since the search favors boards that are quick to reach.
+
+    Without a deadline, running out of search steps raises SearchBudgetError. With one (a
+    time.perf_counter() value), running out of steps or time instead returns the deepest
+    partial board reached, completed greedily; check it with constraintViolations. Boards over
+    EXACT_SEARCH_TILES tiles are repaired instead of searched (see _solveByRepair), with at
+    least REPAIR_STEPS_PER_TILE steps per tile. `locked` is a pair of {slot: resource code}
+    and {slot: number} dicts that stay as they are; only the other slots are solved.
+    """
+    layout = map.layout
+    number_conflicts, resource_conflicts, resource_codes, label = prepared
+    fixed_resources, fixed_numbers, no_desert = placement = _lockedPlacement(locked)
+    resource_slots = [slot for slot in range(len(layout)) if slot not in fixed_resources]
+    resource_codes = _without(resource_codes, fixed_resources.values())
+    number_values = _without(map.numbers, [number for number in fixed_numbers.values() if number])
+    if len(layout) > EXACT_SEARCH_TILES:
+        max_nodes = max(max_nodes, REPAIR_STEPS_PER_TILE * len(layout))
+    state = _SearchState(max_nodes, deadline)
+    start = time.perf_counter()
+
+    # Number placement only depends on where the deserts are, so a desert placement that
+    # leaves no valid numbering is ruled out and the resources are solved again
+    bad_desert_slots = set()
+    bad_desert_sets = set()
+    resources = None
+    try:
+        if len(layout) > EXACT_SEARCH_TILES:
+            resources, numbers = _solveByRepair(layout, number_values, resource_codes, number_conflicts, resource_conflicts, rng, state, placement)
+        elif uniform:
+            sampled = _sampleUniform(layout, resource_codes, number_values, number_conflicts, resource_conflicts, placement, rng, state)
+            if sampled is not None:
+                resources, numbers = sampled
+        while resources is None:
+            banned = [(slot, DESERT) for slot in bad_desert_slots | no_desert]
+            resources = _solve(layout, resource_slots, resource_codes, resource_conflicts, rng, state, fixed=fixed_resources, banned=banned)
+            if resources is None:
+                raise InfeasibleBoardError("No board satisfies the requested constraints")
+
+            desert_slots = [slot for slot, code in enumerate(resources) if code == DESERT]
+            movable = frozenset(desert_slots) - set(fixed_resources)
+            if movable in bad_desert_sets:
+                resources = None
+                continue
+            number_slots = [slot for slot, code in enumerate(resources) if code != DESERT and slot not in fixed_numbers]
+            numbers = _solve(layout, number_slots, number_values, number_conflicts, rng, state, fixed={**{slot: 0 for slot in desert_slots}, **fixed_numbers})
+            if numbers is None:
+                if not movable:
+                    raise InfeasibleBoardError("No board satisfies the requested constraints")
+                if len(movable) == 1:
+                    # Every board has this one free desert somewhere, so its slot can be banned outright
+                    bad_desert_slots.update(movable)
+                else:
+                    # Only the combination is ruled out; each of its slots may still work with other deserts
+                    bad_desert_sets.add(movable)
+                resources = None
+    except (_BudgetExhausted, _OutOfTime):
+        if deadline is None:
+            raise SearchBudgetError(f"Gave up after {max_nodes} search steps without finding a valid board")
+        # Best effort: finish whichever phase was cut short from its deepest partial assignment
+        if resources is None:
+            banned = {(slot, DESERT) for slot in bad_desert_slots | no_desert}
+            resources = _completeGreedily(state.best_assignment, state.best_counts, range(len(layout)), layout.neighbors, resource_conflicts, banned, rng)
+            numbers = [0 if code == DESERT else fixed_numbers.get(slot) for slot, code in enumerate(resources)]
+            counts = {}
+            for number in number_values:
+                counts[number] = counts.get(number, 0) + 1
+        else:
+            numbers, counts = state.best_assignment, state.best_counts
+        numbers = _completeGreedily(numbers, counts, range(len(layout)), layout.neighbors, number_conflicts, set(), rng)
+    finally:
+        SOLVE_SECONDS.observe(time.perf_counter() - start, constraints=label)
+        SOLVER_STEPS.inc(max_nodes - max(state.nodes_left, 0), constraints=label)
+
+    map.slot_resources[:] = bytes(resources)
+    map.slot_numbers[:] = bytes(numbers)
+    map.resetConflicts()
+    return map
+
+
+def solveBoard(map, pair_groups=(), no_same_number=False, no_same_resource=False, rng=random, max_nodes=MAX_NODES, budget_ms=None):
+    """Fill the map with a random board that satisfies every constraint, or raise InfeasibleBoardError
+
+    Boards are uniform over the valid boards unless the constraints are so tight that rejection
+    sampling gives up and the (biased) backtracking search fills in; see solvePrepared. With
+    `budget_ms` the call returns within that time, possibly with a best-effort board.
+    """
+    prepared = prepareConstraints(map, pair_groups, no_same_number, no_same_resource)
+    return solvePrepared(map, prepared, rng, max_nodes, deadlineAfter(budget_ms))
+
+
+def rerollBoard(map, locked_resources=(), locked_numbers=(), pair_groups=(), no_same_number=False, no_same_resource=False, rng=random, max_nodes=MAX_NODES, budget_ms=None):
+    """Re-randomize the map in place except the resources of `locked_resources` and the numbers
+    of `locked_numbers` (slots); returns the sorted slots whose tile changed
+
+    Unlocked values are only redealt among unlocked slots, searched with the locked tiles as
+    fixed neighbors, so a mostly locked board is solved in a handful of steps. Raises
+    InfeasibleBoardError, or with `budget_ms` returns a best effort, as solveBoard does.
+    """
+    before = map.pack()
+    locked = ({slot: map.slot_resources[slot] for slot in locked_resources}, {slot: map.slot_numbers[slot] for slot in locked_numbers})
+    prepared = prepareConstraints(map, pair_groups, no_same_number, no_same_resource)
+    solvePrepared(map, prepared, rng, max_nodes, deadlineAfter(budget_ms), locked)
+    after = map.pack()
+    size = len(map.layout)
+    return sorted({index % size for index in range(2 * size) if before[index] != after[index]})
+
+
+def namedConstraints(constraints):
+    """(pair_groups, no_same_number, no_same_resource) for the names used by /generate-constrained"""
+    pair_groups = [CONSTRAINT_PAIRS[name] for name in constraints if name in CONSTRAINT_PAIRS]
+    return pair_groups, "noTwoNumber" in constraints, "noResources" in constraints
+
+
+def solveConstraints(map, constraints, rng=random, max_nodes=MAX_NODES, budget_ms=None):
+    """solveBoard for the named constraints accepted by /generate-constrained"""
+    return solveBoard(map, *namedConstraints(constraints), rng=rng, max_nodes=max_nodes, budget_ms=budget_ms)
+
+
+def constraintViolations(map, pair_groups=(), no_same_number=False, no_same_resource=False):
+    """Adjacent tile pairs breaking any of the constraints; 0 means the board satisfies them all"""
+    conflicts = map.conflicts()
+    violations = sum(conflicts.pairConflicts(group) for group in pair_groups)
+    if no_same_number:
+        violations += conflicts.sameNumberConflicts()
+    if no_same_resource:
+        violations += conflicts.resourceConflicts()
+    return violations
@@ -0,0 +1,585 @@
+"""Offline checks of the solver, the board index and the short codes; no server needed (see test_api.py)"""
+import os
+import random
+import time
+import weakref
+
+# The pool's refill thread is not needed to test the endpoints
+os.environ.setdefault('BOARD_POOL_SIZE', '0')
+
+import numpy as np
+import pytest
+from app import app
+from boardspace import BoardSpace
+from classes import Map, DESERT_CODE, RESOURCE_CODES, layoutFromSpec
+from solver import InfeasibleBoardError, SearchBudgetError, constraintViolations, namedConstraints, prepareConstraints, solveBoard, solvePrepared
+
+# Seven tiles: one ring around a center, small enough to count every board exactly
+SMALL_LAYOUT = layoutFromSpec("hexagon-1")
+
+
+@pytest.fixture(scope="module")
+def small_space():
+    return BoardSpace.build(SMALL_LAYOUT)
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize("constraints", [["eightSix"], ["twoTwelve"], ["noResources"], ["noTwoNumber"],
+                                         ["eightSix", "twoTwelve", "noResources", "noTwoNumber"]])
+def test_solver_boards_are_valid(constraints):
+    rng = random.Random(1)
+    for _ in range(20):
+        map_obj = solveBoard(Map(), *namedConstraints(constraints), rng=rng)
+        assert sorted(map_obj.slot_resources) == sorted(RESOURCE_CODES[resource] for resource in map_obj.resources)
+        assert sorted(number for number in map_obj.slot_numbers if number) == sorted(map_obj.numbers)
+        assert all((code == DESERT_CODE) == (number == 0) for code, number in zip(map_obj.slot_resources, map_obj.slot_numbers))
+        assert constraintViolations(map_obj, *namedConstraints(constraints)) == 0
+
+
+def test_solver_reports_infeasible_constraints():
+    # Every ring tile touches two others, so no numbering keeps all six numbers apart
+    with pytest.raises(InfeasibleBoardError):
+        solveBoard(Map(SMALL_LAYOUT), [Map(SMALL_LAYOUT).numbers], rng=random.Random(1))
+
+
+def test_solver_samples_uniformly(small_space):
+    # The share of eightSix boards with the desert in the center, exactly and as drawn
+    center = SMALL_LAYOUT.coord_to_slot[(0, 0, 0)]
+    _, totals = small_space._deserts(["eightSix"])
+    expected = totals[center][1] * totals[center][2] / small_space.count(["eightSix"])
+    rng = random.Random(2)
+    draws = 2000
+    hits = sum(solveBoard(Map(SMALL_LAYOUT), [(6, 8)], rng=rng).slot_resources[center] == DESERT_CODE for _ in range(draws))
+    assert abs(hits / draws - expected) < 4 * (expected * (1 - expected) / draws) ** 0.5
+
+
+def test_board_space_counts_match_brute_force(small_space):
+    rng = random.Random(3)
+    draws = 20000
+    valid = 0
+    for _ in range(draws):
+        map_obj = Map(SMALL_LAYOUT)
+        resources = [RESOURCE_CODES[resource] for resource in map_obj.resources]
+        rng.shuffle(resources)
+        numbers = list(map_obj.numbers)
+        rng.shuffle(numbers)
+        map_obj.slot_resources[:] = bytes(resources)
+        map_obj.slot_numbers[:] = bytes(0 if code == DESERT_CODE else numbers.pop() for code in resources)
+        valid += constraintViolations(map_obj, *namedConstraints(["eightSix"])) == 0
+    share = small_space.count(["eightSix"]) / small_space.count()
+    assert abs(valid / draws - share) < 4 * (share * (1 - share) / draws) ** 0.5
+
+
+@pytest.mark.parametrize("constraints", [[], ["eightSix"], ["noResources"], ["eightSix", "twoTwelve", "noResources"]])
+def test_rank_unrank_round_trip(small_space, constraints):
+    rng = random.Random(4)
+    count = small_space.count(constraints)
+    for rank in [0, count - 1, *(rng.randrange(count) for _ in range(50))]:
+        map_obj = small_space.unrank(constraints, rank)
+        assert constraintViolations(map_obj, *namedConstraints(constraints)) == 0
+        assert small_space.rank(constraints, map_obj) == rank
+    with pytest.raises(ValueError):
+        small_space.unrank(constraints, count)
+
+
+def test_rank_of_solver_boards(small_space):
+    rng = random.Random(5)
+    count = small_space.count(["eightSix"])
+    for _ in range(20):
+        map_obj = solveBoard(Map(SMALL_LAYOUT), [(6, 8)], rng=rng)
+        rank = small_space.rank(["eightSix"], map_obj)
+        assert 0 <= rank < count
+        assert small_space.unrank(["eightSix"], rank).pack() == map_obj.pack()
+
+
+@pytest.mark.parametrize("layout", ["standard", "extension", "hexagon-3"])
+def test_conflict_tracker_matches_a_recount(layout):
+    layout = layoutFromSpec(layout)
+    rng = random.Random(10)
+    map_obj = solveBoard(Map(layout), [], rng=rng)
+    tracker = map_obj.conflicts()
+    pair_groups = [(6, 8), (2, 12)]
+
+    def recount(same):
+        # Every neighbor pair is seen from both ends
+        return sum(same(slot, neighbor) for slot in range(len(layout)) for neighbor in layout.neighbors[slot]) // 2
+
+    for _ in range(300):
+        a, b = rng.sample(range(len(layout)), 2)
+        if rng.random() < 0.5:
+            tracker.swapNumbers(a, b)
+        else:
+            tracker.swapResources(a, b)
+        numbers, resources = map_obj.slot_numbers, map_obj.slot_resources
+        for pairs in pair_groups:
+            assert tracker.pairConflicts(pairs) == recount(lambda i, j: numbers[i] in pairs and numbers[j] in pairs)
+        assert tracker.sameNumberConflicts() == recount(lambda i, j: numbers[i] != 0 and numbers[i] == numbers[j])
+        assert tracker.resourceConflicts() == recount(lambda i, j: resources[i] == resources[j])
+
+
+def test_short_code_round_trip():
+    rng = random.Random(6)
+    for layout in ("standard", "extension", "hexagon-1", "hexagon-12"):
+        map_obj = solveBoard(Map(layoutFromSpec(layout)), [(6, 8)], rng=rng)
+        assert Map.fromShortCode(map_obj.shortCode(), map_obj.layout).pack() == map_obj.pack()
+
+
+def test_packed_codes_only_hold_the_layouts_tiles():
+    # Outside the standard layout a code is one byte per slot, so it grows linearly with the board
+    map_obj = solveBoard(Map(layoutFromSpec("extension")), [(6, 8)], rng=random.Random(6))
+    data = map_obj.canonicalBytes()
+    assert len(data) == 1 + len(map_obj.layout)
+    for slot in range(1, len(data)):
+        for value in {data[slot] ^ 1, data[slot] ^ 16, (DESERT_CODE << 4) | 6}:
+            if value != data[slot]:
+                with pytest.raises(ValueError):
+                    Map.fromCanonicalBytes(data[:slot] + bytes([value]) + data[slot + 1:], map_obj.layout)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+@pytest.mark.parametrize("layout", ["standard", "extension", "hexagon-3", {"rows": [2, 3, 2]}])
+def test_pre_encoded_fragments_match_jsonify(monkeypatch, use_orjson, layout):
+    import serialize
+    from flask import jsonify
+    from app import map_to_dict, map_to_new_format
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(serialize, "orjson", None)
+    # Fragments cached under the other encoder must not be reused
+    monkeypatch.setattr(serialize, "_fragments", weakref.WeakKeyDictionary())
+    map_obj = solveBoard(Map(layoutFromSpec(layout)), [(6, 8)], rng=random.Random(12))
+    with app.app_context():
+        assert serialize.encode_object({"map": serialize.map_dict_fragment(map_obj)}) == jsonify({"map": map_to_dict(map_obj)}).get_data().rstrip()
+        assert serialize.encode_object(serialize.new_format_fields(map_obj)) == jsonify(map_to_new_format(map_obj)).get_data().rstrip()
+
+
+def test_decode_endpoint(client):
+    compact = client.post('/generate-constrained', json={"constraints": ["eightSix"], "seed": 7, "format": "compact"}).get_json()
+    full = client.post('/generate-constrained', json={"constraints": ["eightSix"], "seed": 7}).get_json()
+    decoded = client.get(f"/decode/{compact['code']}")
+    assert decoded.status_code == 200
+    assert decoded.get_json()["tiles"] == full["tiles"]
+    assert client.get('/decode/not-a-code').status_code == 400
+
+
+@pytest.mark.parametrize("url, body", [
+    ('/generate-constrained', {"constraints": [["eightSix"]]}),
+    ('/generate-constrained', {"constraints": "eightSix"}),
+    ('/generate-constrained', {"constraints": ["eightSix", "sevenSeven"]}),
+    ('/reroll', {"code": "AQROfBkdY9LIjslH", "constraints": [["x"]]}),
+    ('/generate-custom', {"pairs": [[6], 8]}),
+])
+def test_malformed_constraints_are_rejected(client, url, body):
+    response = client.post(url, json=body)
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+@pytest.mark.parametrize("field, value", [("terrain", ["field"]), ("terrain", {"field": 1}), ("number", [6]), ("number", "6"), ("number", True)])
+def test_reroll_rejects_malformed_tiles(client, field, value):
+    tiles = client.get('/decode/AQROfBkdY9LIjslH').get_json()["tiles"]
+    tile = next(tile for tile in tiles if tile["number"] is not None)
+    tile[field] = value
+    response = client.post('/reroll', json={"tiles": tiles})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_seeded_pairs_echo_the_cache_key(client):
+    first = client.post('/generate-custom', json={"pairs": [8, 6], "seed": 1, "format": "compact"}).get_json()
+    second = client.post('/generate-custom', json={"pairs": [6, 8], "seed": 1, "format": "compact"}).get_json()
+    assert first == second
+    assert first["pairs_avoided"] == [6, 8]
+
+
+def test_pool_retries_exhausted_searches(monkeypatch):
+    import pool
+    failures = iter([True, True])
+    real_solve = pool.solvePrepared
+
+    def flaky_solve(*args, **kwargs):
+        if next(failures, False):
+            raise SearchBudgetError("Gave up")
+        return real_solve(*args, **kwargs)
+
+    monkeypatch.setattr(pool, "solvePrepared", flaky_solve)
+    board_pool = pool.BoardPool([["eightSix"]], max_size=4, low_watermark=4)
+    board_pool.start()
+    try:
+        deadline = time.monotonic() + 10
+        while board_pool.stats()["pools"]["eightSix"]["size"] < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert board_pool.take(["eightSix"]) is not None
+    finally:
+        board_pool.stop()
+
+
+def test_pool_survives_dropping_every_signature(monkeypatch):
+    import pool
+
+    def infeasible(*args, **kwargs):
+        raise InfeasibleBoardError("No board satisfies the requested constraints")
+
+    monkeypatch.setattr(pool, "solvePrepared", infeasible)
+    board_pool = pool.BoardPool([["eightSix"]], max_size=4, low_watermark=4)
+    board_pool.start()
+    try:
+        deadline = time.monotonic() + 10
+        while board_pool.stats()["pools"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert board_pool.take(["eightSix"]) is None
+        assert board_pool.stats()["running"]
+    finally:
+        board_pool.stop()
+
+
+def test_batch_echoes_a_replayable_seed(client):
+    body = {"count": 3, "constraints": ["eightSix"], "format": "compact"}
+    unseeded = client.post('/generate-batch', json=body)
+    seed = unseeded.headers["X-Board-Seed"]
+    replayed = client.post(f'/generate-batch?seed={seed}', json=body)
+    assert replayed.headers["X-Board-Seed"] == seed
+    assert replayed.data == unseeded.data
+
+
+@pytest.mark.parametrize("engine", ["solver", "numpy"])
+def test_seeded_batches_do_not_depend_on_workers(engine):
+    from Maker import BATCH_CHUNK_SIZE, generateBoards
+    count = 2 * BATCH_CHUNK_SIZE + 3
+    single = [map_obj.pack() for map_obj in generateBoards(count, ["eightSix"], "11", 1, engine=engine)]
+    parallel = [map_obj.pack() for map_obj in generateBoards(count, ["eightSix"], "11", 2, engine=engine)]
+    assert len(single) == count
+    assert single == parallel
+
+
+def test_bulk_sampling_reports_an_exhausted_draw_budget():
+    from bulk import sampleBoards
+    with pytest.raises(SearchBudgetError):
+        sampleBoards(10, *namedConstraints(["noResources"]), rng=np.random.default_rng(1), max_draws=1)
+
+
+def test_batch_rejects_numpy_with_no_resources(client):
+    response = client.post('/generate-batch', json={"count": 2, "constraints": ["noResources"], "engine": "numpy"})
+    assert response.status_code == 400
+
+
+def test_batch_reports_an_exhausted_budget_as_unavailable(client, monkeypatch):
+    import app as app_module
+
+    def exhausted(*args, **kwargs):
+        raise SearchBudgetError("Draw budget exhausted")
+        yield
+
+    monkeypatch.setattr(app_module, "generateBoards", exhausted)
+    response = client.post('/generate-batch', json={"count": 2, "constraints": ["eightSix"], "engine": "numpy"})
+    assert response.status_code == 503
+    assert response.get_json()["success"] is False
+
+
+def test_balanced_board_uses_the_requested_layout(client):
+    response = client.post('/generate-balanced', json={"constraints": ["eightSix"], "layout": "extension", "seed": 1})
+    assert response.status_code == 200
+    assert len(response.get_json()["tiles"]) == len(layoutFromSpec("extension"))
+
+
+def test_balanced_board_keeps_to_its_budget(client):
+    start = time.perf_counter()
+    response = client.post('/generate-balanced', json={"constraints": ["eightSix"], "layout": "hexagon-6", "budget_ms": 1})
+    assert response.status_code == 422
+    assert time.perf_counter() - start < 0.5
+
+
+@pytest.mark.parametrize("weights", [{"max_vertex_pips": "a"}, {"max_vertex_pips": [1]}, {"number_spread": True}, {"number_spread": 10 ** 400}])
+def test_balanced_board_rejects_malformed_weights(client, weights):
+    response = client.post('/generate-balanced', json={"weights": weights})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_balanced_desert_only_board_scores_zero(client):
+    response = client.post('/generate-balanced', json={"layout": "hexagon-0", "seed": 1})
+    assert response.status_code == 200
+    assert response.get_json()["score"]["balance_score"] == 0
+
+
+def test_index_is_preferred_over_the_pool(client, monkeypatch):
+    import app as app_module
+    indexed = solveBoard(Map(), [(6, 8), (2, 12)], rng=random.Random(8))
+
+    class IndexStub:
+        def supports(self, constraints):
+            return True
+
+        def sample(self, constraints):
+            return Map().unpack(indexed.pack())
+
+    def take(constraints):
+        raise AssertionError("the pool was asked before the index")
+
+    monkeypatch.setattr(app_module, "board_space", IndexStub())
+    monkeypatch.setattr(app_module.board_pool, "take", take)
+    response = client.post('/generate-constrained', json={"constraints": ["eightSix", "twoTwelve"], "format": "compact"})
+    assert response.get_json()["code"] == indexed.shortCode()
+
+
+def test_search_only_rules_out_failed_desert_combinations():
+    # Freeing both deserts and two other tiles of a valid extension board leaves desert pairs
+    # that cannot be numbered next to ones that can; banning each slot of a failed pair used
+    # to rule out the good pairs too
+    layout = layoutFromSpec("extension")
+    board = Map.fromShortCode("AkoMSTgyOyYUSTwTSiMoUFAFOwQFSAIWBkoTNSsZJA", layout)
+    pair_groups = [(6, 8), (5, 9), (4, 10)]
+    free = {layout.coord_to_slot[coordinates] for coordinates in [(2, -3, 1), (-1, 0, 1), (0, 0, 0), (-2, 3, -1)]}
+    locked_slots = [slot for slot in range(len(layout)) if slot not in free]
+    locked = ({slot: board.slot_resources[slot] for slot in locked_slots}, {slot: board.slot_numbers[slot] for slot in locked_slots})
+    prepared = prepareConstraints(board, pair_groups, True)
+    for seed in range(40):
+        map_obj = solvePrepared(Map(layout).unpack(board.pack()), prepared, random.Random(seed), locked=locked, uniform=False)
+        assert constraintViolations(map_obj, pair_groups, True) == 0
+
+
+@pytest.mark.parametrize("coordinates", [[(0, 0), (0, 3000000)], [(0, 0), (0, 0)]])
+def test_render_rejects_unrenderable_boards(client, coordinates):
+    tiles = [{"q": q, "r": r, "s": -q - r, "terrain": "field", "number": 6} for q, r in coordinates]
+    response = client.post('/render', json={"tiles": tiles})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+@pytest.mark.parametrize("terrain, number", [(["field"], 6), ({"field": 1}, 6), ("field", [6]), ("field", {"6": 1}), ("field", True)])
+def test_render_rejects_malformed_tile_fields(client, terrain, number):
+    response = client.post('/render', json={"tiles": [{"q": 0, "r": 0, "s": 0, "terrain": terrain, "number": number}]})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_png_leaves_out_codes_too_long_for_a_header(client):
+    small = client.post('/generate-constrained', json={"constraints": ["eightSix"], "layout": "hexagon-12", "format": "png", "seed": 1})
+    large = client.post('/generate-constrained', json={"constraints": ["eightSix"], "layout": "hexagon-20", "format": "png", "seed": 1})
+    assert small.status_code == large.status_code == 200
+    assert "X-Board-Code" in small.headers and "X-Board-Seed" in small.headers
+    assert "X-Board-Code" not in large.headers and "X-Board-Seed" in large.headers
+
+
+@pytest.mark.parametrize("query", ["max_pips=ten", "limit=5x", "limit=1.5"])
+def test_board_search_rejects_malformed_integers(client, monkeypatch, tmp_path, query):
+    import app as app_module
+    from archive import BoardArchive
+    archive = BoardArchive(str(tmp_path / "boards.db"))
+    monkeypatch.setattr(app_module, "board_archive", archive)
+    try:
+        response = client.get(f"/boards/search?{query}")
+        assert response.status_code == 400
+        assert client.get("/boards/search?max_pips=12&limit=5").status_code == 200
+    finally:
+        archive.stop()
+
+
+@pytest.mark.parametrize("seats", [
+    [[0], [0]],
+    [[0, {"vertex": 0, "city": True}]],
+    [list(range(0, 60, 6))],
+])
+def test_simulate_rejects_impossible_settlements(client, seats):
+    response = client.post('/simulate', json={"code": solveBoard(Map(), [], rng=random.Random(9)).shortCode(), "seats": seats, "method": "exact"})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_simulate_rejects_adjacent_settlements(client):
+    from scoring import vertexTable
+    table = vertexTable(Map().layout)
+    neighbor = next(vertex for vertex in range(1, len(table.corners)) if len(table.corners[0] & table.corners[vertex]) == 2)
+    code = solveBoard(Map(), [], rng=random.Random(9)).shortCode()
+    assert client.post('/simulate', json={"code": code, "seats": [[0], [neighbor]], "method": "exact"}).status_code == 400
+    assert client.post('/simulate', json={"code": code, "seats": [[0], [6]], "method": "exact"}).status_code == 200
+
+
+def test_simulate_caps_settlements_per_seat(client):
+    from app import MAX_SIMULATION_SETTLEMENTS
+    from scoring import vertexTable
+    table = vertexTable(Map().layout)
+    # Corners far enough apart to all be built on, so only the cap can refuse them
+    apart = []
+    for vertex in range(len(table.corners)):
+        if all(len(table.corners[vertex] & table.corners[other]) < 2 for other in apart):
+            apart.append(vertex)
+    code = solveBoard(Map(), [], rng=random.Random(9)).shortCode()
+    allowed = client.post('/simulate', json={"code": code, "seats": [apart[:MAX_SIMULATION_SETTLEMENTS]], "method": "exact"})
+    assert allowed.status_code == 200
+    refused = client.post('/simulate', json={"code": code, "seats": [apart[:MAX_SIMULATION_SETTLEMENTS + 1]], "method": "exact"})
+    assert refused.status_code == 400
+
+
+def test_simulated_income_matches_the_exact_moments():
+    from simulation import boardArrays, expectedIncome, seatWeights, simulateIncome
+    boards = [solveBoard(Map(), [(6, 8)], rng=random.Random(seed)) for seed in (14, 15)]
+    resources, numbers = boardArrays(boards)
+    weights = seatWeights(boards[0].layout, [[(0, False), (24, True)], [(6, True)], [(30, False), (42, False)]])
+    exact = expectedIncome(resources, numbers, weights, turns=60)
+    simulated = simulateIncome(resources, numbers, weights, 600000, turns=60, rng=np.random.default_rng(16))
+    games = simulated["games"]
+    assert games == 10000
+    # Within five standard errors of the exact mean, per resource and in total
+    assert np.all(np.abs(simulated["mean"] - exact["mean"]) <= 5 * np.sqrt(exact["variance"] / games) + 1e-9)
+    assert np.all(np.abs(simulated["total_mean"] - exact["total_mean"]) <= 5 * np.sqrt(exact["total_variance"] / games))
+    assert np.allclose(simulated["total_variance"], exact["total_variance"], rtol=0.1)
+    assert np.all(simulated["histogram"].sum(axis=2) == games)
+
+
+def test_simulate_income_refuses_oversized_histograms(monkeypatch):
+    import simulation
+    board = solveBoard(Map(), [], rng=random.Random(9))
+    resources, numbers = simulation.boardArrays(board)
+    weights = simulation.seatWeights(board.layout, [[(0, True)]])
+    monkeypatch.setattr(simulation, "MAX_HISTOGRAM_ELEMENTS", 10)
+    with pytest.raises(ValueError):
+        simulation.simulateIncome(resources, numbers, weights, 100, turns=10)
+
+
+def test_simulate_caps_the_histogram(client, monkeypatch):
+    import simulation
+    monkeypatch.setattr(simulation, "MAX_HISTOGRAM_ELEMENTS", 100000)
+    code = solveBoard(Map(), [], rng=random.Random(9)).shortCode()
+    seats = [[seat * 6 + offset for offset in (0, 24)] for seat in range(4)]
+    response = client.post('/simulate', json={"codes": [code] * 100, "seats": seats, "turns": 1000, "rolls": 1000})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_archive_round_trip_through_search(client, monkeypatch, tmp_path):
+    import app as app_module
+    from archive import BoardArchive
+    from scoring import scoreMap
+    # A batch smaller than the boards recorded, so the flush spans several transactions
+    archive = BoardArchive(str(tmp_path / "boards.db"), batch_size=7)
+    monkeypatch.setattr(app_module, "board_archive", archive)
+    rng = random.Random(13)
+    boards = [solveBoard(Map(), [(6, 8)] if i % 2 else [], rng=rng) for i in range(20)]
+    boards += [solveBoard(Map(layoutFromSpec("extension")), [], rng=rng) for _ in range(5)]
+    try:
+        for map_obj in boards:
+            assert archive.record(map_obj)
+        archive.flush()
+        assert archive.stats()["written"] == len(boards)
+
+        standard = {map_obj.shortCode(): map_obj for map_obj in boards[:20]}
+        found = client.get("/boards/search?limit=100").get_json()
+        assert sorted(board["code"] for board in found["boards"]) == sorted(standard)
+
+        eight_six = [code for code, map_obj in standard.items() if constraintViolations(map_obj, [(6, 8)]) == 0]
+        found = client.get("/boards/search?constraints=eightSix&limit=100").get_json()
+        assert sorted(board["code"] for board in found["boards"]) == sorted(eight_six)
+
+        max_pips = sorted(scoreMap(map_obj)["max_vertex_pips"] for map_obj in standard.values())[10]
+        found = client.get(f"/boards/search?max_pips={max_pips}&limit=100").get_json()
+        assert sorted(board["code"] for board in found["boards"]) == sorted(code for code, map_obj in standard.items() if scoreMap(map_obj)["max_vertex_pips"] <= max_pips)
+
+        center = Map().layout.coord_to_slot[(0, 0, 0)]
+        found = client.get("/boards/search?desert=center&limit=100").get_json()
+        assert sorted(board["code"] for board in found["boards"]) == sorted(code for code, map_obj in standard.items() if map_obj.slot_resources[center] == DESERT_CODE)
+
+        found = client.get("/boards/search?layout=extension&limit=100").get_json()
+        assert sorted(board["code"] for board in found["boards"]) == sorted(map_obj.shortCode() for map_obj in boards[20:])
+    finally:
+        archive.stop()
+
+
+def test_endpoint_limiter_queues_then_refuses():
+    import asyncio
+    from serve import EndpointLimiter
+
+    async def scenario():
+        limiter = EndpointLimiter('/test', concurrency=1, queue_depth=1)
+        assert await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not queued.done() and len(limiter.waiting) == 1
+        # Both the slot and the queue are taken
+        assert not await limiter.acquire()
+        limiter.release(4.0)
+        assert await queued
+        assert limiter.running == 1 and not limiter.waiting
+        # One request's service time, one slot, and nobody ahead yet
+        assert limiter.retry_after() == 4
+        limiter.release(4.0)
+        assert limiter.running == 0
+
+    asyncio.run(scenario())
+
+
+def _asgi_request(serving, path):
+    """(run, messages): a coroutine function sending one GET through the ASGI app, and what it sends back"""
+    import asyncio
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": [], "root_path": ""}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await serving(scope, receive, send)
+
+    return run, messages
+
+
+def test_serving_app_answers_503_with_retry_after_when_saturated():
+    import asyncio
+    from serve import ServingApp
+    serving = ServingApp(workers=1, threads=1, limits={'/health': (1, 0)})
+
+    async def scenario():
+        limiter = serving._limiter('/health')
+        assert await limiter.acquire()
+        run, messages = _asgi_request(serving, '/health')
+        await run()
+        start = messages[0]
+        assert start["status"] == 503
+        assert (b"retry-after", b"1") in start["headers"]
+        limiter.release(0.01)
+
+    asyncio.run(scenario())
+
+
+def test_serving_app_drains_in_flight_requests_on_shutdown():
+    import asyncio
+    from serve import ServingApp
+    serving = ServingApp(workers=1, threads=1)
+    release = None
+    stopped = []
+
+    async def slow_stream(environ, body, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"done"})
+
+    serving._stream = slow_stream
+    serving._stop = lambda: stopped.append(True)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        run, messages = _asgi_request(serving, '/health')
+        request = asyncio.ensure_future(run())
+        await asyncio.sleep(0)
+        shutdown = asyncio.ensure_future(serving.shutdown())
+        await asyncio.sleep(0.05)
+        # The in-flight request holds shutdown back, and newcomers are turned away meanwhile
+        assert not shutdown.done() and not stopped
+        refused, refused_messages = _asgi_request(serving, '/health')
+        await refused()
+        assert refused_messages[0]["status"] == 503
+        release.set()
+        await asyncio.gather(request, shutdown)
+        assert messages[0]["status"] == 200
+        assert stopped == [True]
+
+    asyncio.run(scenario())